@@ -0,0 +1,193 @@
+import os
+import re
+import sys
+import gzip
+import json
+import base64
+import hashlib
+
+from PIL import Image
+
+from process_logo import circular_logo
+
+# Asset build: replaces apply_base64_logo.py.
+# Instead of pasting the whole logo into every page as a data:image/png;base64
+# URI (~1.7 MB per page, downloaded again on every navigation), the build:
+#   1. renders the circular logo from Logotipo.jpg at a few sizes, as PNG and WebP
+#   2. extracts every inline data: URI from the pages into content-hashed files
+#   3. rewrites the references (the logo becomes a responsive <picture>)
+#   4. reports per-page byte budgets before and after
+# Hashed files never change, so /assets/build is served with an immutable
+# Cache-Control (see main.py). Re-running the build is safe: existing
+# /assets/build references are re-pointed at the current fingerprints.
+#
+#   python build_assets.py           -> build and report
+#   python build_assets.py --check   -> report only, exit 1 if a page is over budget
+
+BASE_DIR = "echomechanic_ai_-_landing_page_4"
+LOGO_SOURCE = "Logotipo.jpg"
+LOGO_FALLBACK = os.path.join(BASE_DIR, "assets/images/neon-circle-logo.png")
+BUILD_DIR = os.path.join(BASE_DIR, "assets/build")
+BUILD_URL = "/assets/build"
+MANIFEST_PATH = os.path.join(BUILD_DIR, "manifest.json")
+
+LOGO_SIZES = [64, 128, 256]
+WEBP_QUALITY = 85
+# Small data: URIs (icons, a few hundred bytes) are cheaper inline than as a request
+INLINE_LIMIT_BYTES = 4 * 1024
+# HTML per page, compressed, as the browser downloads it
+PAGE_BUDGET_BYTES = 40 * 1024
+
+DATA_URI_RE = re.compile(r'data:(image/[a-z0-9.+-]+);base64,([A-Za-z0-9+/=]+)')
+LOGO_IMG_RE = re.compile(r'<img\s[^>]*?src="(?:data:image/png;base64,[^"]+|/assets/build/logo-\d+\.[0-9a-f]+\.png)"[^>]*>', re.DOTALL)
+BUILD_REF_RE = re.compile(r'/assets/build/([a-z0-9-]+)\.([0-9a-f]{10})\.([a-z0-9]+)')
+PX_RE = re.compile(r'width:\s*(\d+)px')
+EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp", "image/gif": "gif", "image/svg+xml": "svg"}
+
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def write_asset(manifest, name, ext, data):
+    filename = f"{name}.{fingerprint(data)}.{ext}"
+    path = os.path.join(BUILD_DIR, filename)
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(data)
+    manifest[f"{name}.{ext}"] = f"{BUILD_URL}/{filename}"
+    return manifest[f"{name}.{ext}"]
+
+
+def encode_image(img, fmt):
+    from io import BytesIO
+    out = BytesIO()
+    if fmt == "webp":
+        img.save(out, "WEBP", quality=WEBP_QUALITY, method=6)
+    else:
+        img.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+
+def build_logo(manifest):
+    if os.path.exists(LOGO_SOURCE):
+        logo = circular_logo(Image.open(LOGO_SOURCE))
+    else:
+        print(f"Warning: {LOGO_SOURCE} not found, using {LOGO_FALLBACK}")
+        logo = Image.open(LOGO_FALLBACK).convert("RGBA")
+    for size in LOGO_SIZES:
+        resized = logo.resize((size, size), Image.LANCZOS)
+        for fmt in ("png", "webp"):
+            write_asset(manifest, f"logo-{size}", fmt, encode_image(resized, fmt))
+
+
+def logo_sizes_for(tag):
+    # 1x/2x variants for the displayed width (inline style set by fix_logo_css.py)
+    match = PX_RE.search(tag)
+    width = int(match.group(1)) if match else 128
+    one_x = next((s for s in LOGO_SIZES if s >= width), LOGO_SIZES[-1])
+    two_x = next((s for s in LOGO_SIZES if s >= 2 * width), LOGO_SIZES[-1])
+    return one_x, two_x
+
+
+def logo_picture(tag, manifest):
+    one_x, two_x = logo_sizes_for(tag)
+    # Attributes from an earlier build are regenerated below
+    tag = re.sub(r'\s(?:srcset|width|height|decoding)="[^"]*"', "", tag)
+    png = manifest[f"logo-{one_x}.png"]
+    webp_srcset = f'{manifest[f"logo-{one_x}.webp"]} 1x, {manifest[f"logo-{two_x}.webp"]} 2x'
+    img = re.sub(r'src="[^"]+"', f'src="{png}" srcset="{png} 1x, {manifest[f"logo-{two_x}.png"]} 2x" width="{one_x}" height="{one_x}" decoding="async"', tag, count=1)
+    # display: contents keeps the <img> laid out exactly as before
+    return f'<picture style="display: contents"><source type="image/webp" srcset="{webp_srcset}">{img}</picture>'
+
+
+def rewrite_page(content, manifest):
+    # 1. Logo: plain <img> with inline base64 (or an older build) -> <picture>
+    content = re.sub(r'<picture style="display: contents"><source type="image/webp" srcset="[^"]*">(<img\s[^>]*>)</picture>',
+                     lambda m: m.group(1), content)
+    content = LOGO_IMG_RE.sub(lambda m: logo_picture(m.group(0), manifest), content)
+
+    # 2. Any other large inline asset -> hashed file
+    def extract(m):
+        data = base64.b64decode(m.group(2))
+        if len(data) < INLINE_LIMIT_BYTES:
+            return m.group(0)
+        return write_asset(manifest, "inline", EXTENSIONS.get(m.group(1), "bin"), data)
+    content = DATA_URI_RE.sub(extract, content)
+
+    # 3. Re-point references from earlier builds at the current fingerprints
+    def repoint(m):
+        return manifest.get(f"{m.group(1)}.{m.group(3)}", m.group(0))
+    return BUILD_REF_RE.sub(repoint, content)
+
+
+def page_weight(content):
+    raw = content.encode("utf-8")
+    return len(raw), len(gzip.compress(raw, 6))
+
+
+def referenced_bytes(content):
+    # Build assets a WebP-capable browser at 1x downloads for this page
+    urls = set(re.findall(r'<source type="image/webp" srcset="([^ "]+)', content))
+    for url in re.findall(r'(?:src="|url\()(/assets/build/[^"\')\s]+)', content):
+        # The PNG logo inside a <picture> is only the fallback
+        if not (url.startswith(f"{BUILD_URL}/logo-") and urls):
+            urls.add(url)
+    return sum(os.path.getsize(os.path.join(BASE_DIR, url.lstrip("/")))
+               for url in urls if os.path.exists(os.path.join(BASE_DIR, url.lstrip("/"))))
+
+
+def remove_stale(manifest):
+    current = {os.path.basename(url) for url in manifest.values()} | {"manifest.json"}
+    for name in os.listdir(BUILD_DIR):
+        if name not in current:
+            os.remove(os.path.join(BUILD_DIR, name))
+
+
+def report(rows):
+    print(f"\n{'page':<24}{'before':>12}{'before gz':>12}{'after':>10}{'after gz':>10}{'assets':>9}  budget ({PAGE_BUDGET_BYTES // 1024} KB gz)")
+    over = 0
+    for name, before, after, assets in rows:
+        ok = after[1] <= PAGE_BUDGET_BYTES
+        over += not ok
+        print(f"{name:<24}{before[0] / 1024:>10.0f}KB{before[1] / 1024:>10.0f}KB{after[0] / 1024:>8.0f}KB"
+              f"{after[1] / 1024:>8.1f}KB{assets / 1024:>7.1f}KB  {'OK' if ok else 'OVER'}")
+    total_before = sum(r[1][1] for r in rows)
+    total_after = sum(r[2][1] + r[3] for r in rows)
+    print(f"\nTotal transferred (gzip, all pages once): {total_before / 1024 / 1024:.1f} MB -> {total_after / 1024:.0f} KB")
+    return over
+
+
+def main(check_only=False):
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    manifest = {}
+    if not check_only:
+        build_logo(manifest)
+
+    rows = []
+    for filename in sorted(os.listdir(BASE_DIR)):
+        if not filename.endswith(".html"):
+            continue
+        path = os.path.join(BASE_DIR, filename)
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read()
+        before = page_weight(content)
+        if not check_only:
+            new_content = rewrite_page(content, manifest)
+            if new_content != content:
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(new_content)
+                print(f"Updated {filename}")
+            content = new_content
+        rows.append((filename, before, page_weight(content), referenced_bytes(content)))
+
+    if not check_only:
+        with open(MANIFEST_PATH, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        remove_stale(manifest)
+    return report(rows)
+
+
+if __name__ == "__main__":
+    over_budget = main(check_only="--check" in sys.argv)
+    sys.exit(1 if over_budget and "--check" in sys.argv else 0)
@@ -0,0 +1,178 @@
+import os
+import csv
+import asyncio
+import zipfile
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+import audio_store
+import audio_upload
+
+# --- ANÁLISE EM LOTE ---
+# Numa volta à fábrica os técnicos gravam 20-40 máquinas e depois tinham de as
+# enviar uma a uma pelo /api/analyze. O /api/analyze/batch recebe todos os
+# ficheiros (ou um .zip) com a máquina de cada um:
+#   - cada gravação é guardada no armazém de áudio (limites do upload normal);
+#   - gravações iguais (mesmo SHA-256) são analisadas uma só vez;
+#   - as análises correm em paralelo, no máximo BATCH_CONCURRENCY de cada vez,
+#     e cada resultado é enviado ao cliente assim que fica pronto;
+#   - as linhas do historico são todas gravadas no fim, numa só transação.
+# Máquina de cada ficheiro: machine_ids pela mesma ordem dos ficheiros; dentro
+# de um zip, o manifest.csv (ficheiro,maquina), senão a pasta, senão o nome.
+
+MAX_BATCH_FILES = int(os.environ.get("ECHO_BATCH_MAX_FILES", "100"))
+BATCH_CONCURRENCY = int(os.environ.get("ECHO_BATCH_CONCURRENCY", "4"))
+MAX_ZIP_BYTES = int(float(os.environ.get("ECHO_BATCH_MAX_ZIP_MB", "500")) * 1024 * 1024)
+DEFAULT_MACHINE = "Nova Análise (Áudio)"
+MANIFEST_NAME = "manifest.csv"
+
+
+class BatchItem:
+    def __init__(self, index, filename, machine):
+        self.index = index
+        self.filename = filename
+        self.machine = machine or DEFAULT_MACHINE
+        self.stored = None
+        self.audio_path = None
+        self.error = None
+
+
+class _ZipEntry:
+    # O mínimo de um UploadFile (size + read assíncrono) para reutilizar o stream_to_disk
+    def __init__(self, archive, info):
+        self.size = info.file_size
+        self._file = archive.open(info)
+
+    async def read(self, size):
+        return await run_in_threadpool(self._file.read, size)
+
+    def close(self):
+        self._file.close()
+
+
+def _extension(filename):
+    return filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+
+
+async def _store(item, upload):
+    # Erros de uma gravação (demasiado grande, vazia) ficam nesse item, o lote continua
+    ext = _extension(item.filename) or "mp3"
+    try:
+        item.stored = await audio_upload.stream_to_disk(upload, audio_store.temp_path(ext))
+        item.audio_path, _ = await audio_store.put(item.stored)
+    except HTTPException as e:
+        item.error = e.detail
+    return item
+
+
+def _read_manifest(archive):
+    try:
+        with archive.open(MANIFEST_NAME) as f:
+            rows = list(csv.reader(line.decode("utf-8-sig") for line in f))
+    except KeyError:
+        return {}
+    return {row[0].strip(): row[1].strip() for row in rows if len(row) >= 2 and row[0].strip()}
+
+
+def _zip_machine(name, manifest):
+    if name in manifest:
+        return manifest[name]
+    if os.path.basename(name) in manifest:
+        return manifest[os.path.basename(name)]
+    parts = name.split("/")
+    return parts[0] if len(parts) > 1 else parts[0].rsplit(".", 1)[0]
+
+
+async def _save_zip(upload):
+    path = audio_store.temp_path("zip")
+    size = 0
+    with open(path, "wb") as out:
+        while True:
+            chunk = await upload.read(audio_upload.UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_ZIP_BYTES:
+                out.close()
+                os.remove(path)
+                raise HTTPException(status_code=413, detail=f"Zip demasiado grande (máx. {MAX_ZIP_BYTES // (1024 * 1024)} MB)")
+            await run_in_threadpool(out.write, chunk)
+    return path
+
+
+async def _expand_zip(upload, items):
+    path = await _save_zip(upload)
+    try:
+        try:
+            archive = await run_in_threadpool(zipfile.ZipFile, path)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail=f"Zip inválido: {upload.filename}")
+        with archive:
+            manifest = await run_in_threadpool(_read_manifest, archive)
+            for info in archive.infolist():
+                if info.is_dir() or _extension(info.filename) not in audio_upload.AUDIO_MIME_TYPES:
+                    continue
+                if len(items) >= MAX_BATCH_FILES:
+                    raise HTTPException(status_code=413, detail=f"Demasiados ficheiros (máx. {MAX_BATCH_FILES})")
+                item = BatchItem(len(items), info.filename, _zip_machine(info.filename, manifest))
+                entry = _ZipEntry(archive, info)
+                try:
+                    await _store(item, entry)
+                finally:
+                    entry.close()
+                items.append(item)
+    finally:
+        os.remove(path)
+
+
+async def collect(files, machine_ids):
+    # Grava todas as gravações do pedido no armazém e devolve os BatchItem
+    items = []
+    for position, upload in enumerate(files):
+        if _extension(upload.filename or "") == "zip":
+            await _expand_zip(upload, items)
+            continue
+        if len(items) >= MAX_BATCH_FILES:
+            raise HTTPException(status_code=413, detail=f"Demasiados ficheiros (máx. {MAX_BATCH_FILES})")
+        machine = machine_ids[position] if position < len(machine_ids) else None
+        items.append(await _store(BatchItem(len(items), upload.filename, machine), upload))
+    if not items:
+        raise HTTPException(status_code=400, detail="Nenhuma gravação de áudio no pedido")
+    return items
+
+
+async def run(items, diagnose, concurrency=BATCH_CONCURRENCY):
+    # Gerador assíncrono: (item, data, features, duplicate_of, erro) pela ordem em
+    # que as análises acabam. diagnose(item) -> (data, features)
+    groups = {}
+    for item in items:
+        if item.error is not None:
+            yield item, None, None, None, item.error
+        else:
+            groups.setdefault(item.stored.sha256, []).append(item)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def analyze(group):
+        async with semaphore:
+            try:
+                return group, await diagnose(group[0]), None
+            except Exception as e:
+                print(f"ERRO: análise de {group[0].filename} no lote falhou: {e}")
+                return group, None, str(e)
+
+    tasks = [asyncio.ensure_future(analyze(group)) for group in groups.values()]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            group, result, error = await finished
+            for item in group:
+                duplicate_of = group[0].index if item is not group[0] else None
+                if error is not None:
+                    yield item, None, None, duplicate_of, error
+                else:
+                    yield item, result[0], result[1], duplicate_of, None
+    finally:
+        # Cliente desligou-se a meio: não deixa análises órfãs a gastar quota
+        for task in tasks:
+            task.cancel()
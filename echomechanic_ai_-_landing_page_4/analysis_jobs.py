@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+
+import database
+
+# --- FILA DE ANÁLISES EM BACKGROUND ---
+# Com background=true o POST /api/analyze só espera pelo upload: a análise
+# (pré-triagem, modelo, escrita na DB) passa para esta fila e o cliente recebe
+# logo um job_id. Depois faz polling em GET /api/analyze/{job_id} ou subscreve
+# GET /api/analyze/{job_id}/events (SSE). Os jobs vivem na tabela analysis_jobs,
+# por isso sobrevivem a um restart. Cada job a correr renova um heartbeat
+# (heartbeat_at) a cada JOB_HEARTBEAT_SECONDS; os que ficam JOB_STALE_SECONDS sem
+# ele (processo morto ou reiniciado) voltam para a fila, e os de outros workers
+# vivos não são tocados.
+# A concorrência é limitada pelo número de workers e a ordem é por prioridade
+# (plano do utilizador) e depois por chegada.
+
+JOB_WORKERS = int(os.environ.get("ECHO_JOB_WORKERS", "4"))
+# Os workers acordam com cada enqueue; o polling apanha jobs criados por outros processos
+JOB_POLL_SECONDS = float(os.environ.get("ECHO_JOB_POLL_SECONDS", "2"))
+JOB_RETENTION_SECONDS = int(os.environ.get("ECHO_JOB_RETENTION", str(7 * 24 * 3600)))
+JOB_HEARTBEAT_SECONDS = float(os.environ.get("ECHO_JOB_HEARTBEAT_SECONDS", "10"))
+# Sem heartbeat há mais do que isto = o worker morreu
+JOB_STALE_SECONDS = float(os.environ.get("ECHO_JOB_STALE_SECONDS", str(6 * JOB_HEARTBEAT_SECONDS)))
+
+PLAN_PRIORITIES = {"empresarial": 20, "profissional": 10, "basico": 0}
+FINAL_STATUSES = ("done", "error")
+
+stats = {"enqueued": 0, "completed": 0, "failed": 0, "recovered": 0}
+
+_handler = None
+_workers = []
+_janitor = None
+_wakeup = None
+_watchers = {}
+
+
+def _priority(conn, email):
+    row = conn.execute("SELECT plano FROM users WHERE email=?", (email,)).fetchone()
+    return PLAN_PRIORITIES.get((row[0] or "basico").lower() if row else "basico", 0)
+
+
+def _enqueue(conn, job_id, email, params, now):
+    priority = _priority(conn, email)
+    conn.execute("""
+        INSERT INTO analysis_jobs (id, user_email, status, priority, params_json, audio_path, created_at)
+        VALUES (?, ?, 'queued', ?, ?, ?, ?)
+    """, (job_id, email, priority, json.dumps(params), params.get("audio_path"), now))
+    return priority
+
+
+async def enqueue(email, params):
+    job_id = uuid.uuid4().hex
+    priority = await database.run(_enqueue, job_id, email, params, time.time())
+    stats["enqueued"] += 1
+    print(f"DEBUG: Job {job_id[:8]} em fila (prioridade {priority})")
+    if _wakeup is not None:
+        _wakeup.set()
+    return job_id
+
+
+def _get(conn, job_id):
+    row = conn.execute("""
+        SELECT id, user_email, status, priority, created_at, started_at, finished_at, result_json, error
+        FROM analysis_jobs WHERE id=?
+    """, (job_id,)).fetchone()
+    if not row:
+        return None
+    job = {
+        "job_id": row[0], "email": row[1], "status": row[2], "priority": row[3],
+        "created_at": row[4], "started_at": row[5], "finished_at": row[6],
+        "result": json.loads(row[7]) if row[7] else None, "error": row[8],
+    }
+    if job["status"] == "queued":
+        # Jobs que correm antes deste (mesma ordem que _claim)
+        job["queue_position"] = conn.execute("""
+            SELECT COUNT(*) FROM analysis_jobs
+            WHERE status='queued' AND (priority > ? OR (priority = ? AND created_at < ?))
+        """, (row[3], row[3], row[4])).fetchone()[0]
+    return job
+
+
+async def get(job_id):
+    return await database.run(_get, job_id)
+
+
+def _claim(conn, now):
+    # UPDATE ... RETURNING é atómico: dois workers nunca apanham o mesmo job
+    return conn.execute("""
+        UPDATE analysis_jobs SET status='running', started_at=?, heartbeat_at=?, attempts=attempts+1
+        WHERE id = (SELECT id FROM analysis_jobs WHERE status='queued'
+                    ORDER BY priority DESC, created_at ASC LIMIT 1)
+        RETURNING id, user_email, params_json
+    """, (now, now)).fetchone()
+
+
+def _heartbeat(conn, job_id, now):
+    conn.execute("UPDATE analysis_jobs SET heartbeat_at=? WHERE id=? AND status='running'", (now, job_id))
+
+
+def _finish(conn, job_id, status, result, error, now):
+    conn.execute("UPDATE analysis_jobs SET status=?, result_json=?, error=?, finished_at=? WHERE id=?",
+                 (status, json.dumps(result) if result is not None else None, error, now, job_id))
+
+
+def _recover(conn, now):
+    # Jobs sem heartbeat recente (worker morto) voltam para a fila; os antigos já
+    # terminados são apagados. Os jobs de antes da migração 014 só têm started_at
+    recovered = conn.execute("""
+        UPDATE analysis_jobs SET status='queued', started_at=NULL, heartbeat_at=NULL
+        WHERE status='running' AND COALESCE(heartbeat_at, started_at, 0) < ?
+    """, (now - JOB_STALE_SECONDS,)).rowcount
+    conn.execute("DELETE FROM analysis_jobs WHERE status IN ('done', 'error') AND finished_at < ?",
+                 (now - JOB_RETENTION_SECONDS,))
+    return recovered
+
+
+def _notify(job_id):
+    for event in _watchers.get(job_id, ()):
+        event.set()
+
+
+async def wait_for_change(job_id, timeout):
+    # Usado pelo SSE: acorda quando o job muda de estado (ou ao fim de timeout)
+    event = asyncio.Event()
+    _watchers.setdefault(job_id, set()).add(event)
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        _watchers[job_id].discard(event)
+        if not _watchers[job_id]:
+            del _watchers[job_id]
+
+
+async def _beat(job_id):
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+        try:
+            await database.run(_heartbeat, job_id, time.time())
+        except Exception as e:
+            print(f"ERRO JOB {job_id[:8]}: heartbeat falhou: {e}")
+
+
+async def _run(job_id, email, params):
+    _notify(job_id)
+    beat = asyncio.create_task(_beat(job_id))
+    try:
+        result = await _handler(email, params)
+        await database.run(_finish, job_id, "done", result, None, time.time())
+        stats["completed"] += 1
+    except Exception as e:
+        print(f"ERRO JOB {job_id[:8]}: {e}")
+        await database.run(_finish, job_id, "error", None, str(e), time.time())
+        stats["failed"] += 1
+    finally:
+        beat.cancel()
+    _notify(job_id)
+
+
+async def _worker():
+    while True:
+        try:
+            job = await database.run(_claim, time.time())
+            if job is None:
+                # Limpa o aviso só com a fila vazia e volta a ver: um enqueue entre
+                # o claim e o clear (ou o aviso que outro worker apagou) não se perde
+                _wakeup.clear()
+                job = await database.run(_claim, time.time())
+            if job is None:
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await _run(job[0], job[1], json.loads(job[2]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Erro da própria fila (ex: DB ocupada): espera e tenta outra vez
+            print(f"ERRO FILA: {e}")
+            await asyncio.sleep(JOB_POLL_SECONDS)
+
+
+async def _recover_stale():
+    # Também de tempos a tempos: jobs de outro processo que morreu entretanto
+    while True:
+        try:
+            recovered = await database.run(_recover, time.time())
+            stats["recovered"] += recovered
+            if recovered:
+                print(f"DEBUG: {recovered} job(s) interrompido(s) voltaram para a fila")
+                _wakeup.set()
+        except Exception as e:
+            print(f"ERRO FILA: {e}")
+        await asyncio.sleep(JOB_STALE_SECONDS)
+
+
+async def start(handler, workers=JOB_WORKERS):
+    # handler: async (email, params) -> dict com o resultado da análise
+    global _handler, _wakeup, _janitor
+    _handler = handler
+    _wakeup = asyncio.Event()
+    _janitor = asyncio.create_task(_recover_stale())
+    for _ in range(workers):
+        _workers.append(asyncio.create_task(_worker()))
+
+
+async def stop():
+    global _janitor
+    tasks = _workers + ([_janitor] if _janitor else [])
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _workers.clear()
+    _janitor = None
+
+
+async def snapshot():
+    rows = await database.fetchall("SELECT status, COUNT(*) FROM analysis_jobs GROUP BY status")
+    return {**stats, "workers": len(_workers), "by_status": dict(rows)}
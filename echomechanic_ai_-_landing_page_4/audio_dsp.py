@@ -0,0 +1,231 @@
+import os
+import time
+import wave
+import shutil
+import itertools
+import subprocess
+
+import numpy as np
+
+try:
+    import soundfile
+except ImportError:  # opcional: sem ele usamos o ffmpeg (se existir) ou só WAV
+    soundfile = None
+
+# --- PRÉ-TRIAGEM LOCAL DO ÁUDIO (DSP) ---
+# O prompt da análise pede ao Gemini para rejeitar voz, silêncio e batidas na
+# mesa ("Fonte Inválida"), mas cada rejeição custa uma inferência completa.
+# Aqui descodificamos o áudio localmente e medimos energia RMS, planura
+# espectral, taxa de passagens por zero e a fração de energia na banda da voz
+# (300-3400 Hz). Silêncio e voz óbvia são rejeitados em milissegundos; tudo o
+# resto (incluindo os casos duvidosos) segue para o modelo.
+
+def _env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+PRESCREEN_ENABLED = os.environ.get("ECHO_PRESCREEN_ENABLED", "1") == "1"
+PRESCREEN_MAX_SECONDS = _env_float("ECHO_PRESCREEN_MAX_SECONDS", 30)
+# Tamanho dos blocos lidos de cada vez pelo stream()
+STREAM_BLOCK_SECONDS = 10
+
+PRESCREEN_THRESHOLDS = {
+    # Abaixo disto (dBFS) a gravação é silêncio
+    "silence_rms_db": _env_float("ECHO_PRESCREEN_SILENCE_DB", -50),
+    # Voz: quase toda a energia na banda 300-3400 Hz...
+    "speech_voice_band_min": _env_float("ECHO_PRESCREEN_SPEECH_BAND_MIN", 0.75),
+    # ...espectro tonal (harmónicos), não ruído largo...
+    "speech_flatness_max": _env_float("ECHO_PRESCREEN_SPEECH_FLATNESS_MAX", 0.2),
+    # ...e energia a variar muito entre frames (sílabas e pausas)
+    "speech_energy_cv_min": _env_float("ECHO_PRESCREEN_SPEECH_CV_MIN", 0.6),
+}
+
+FRAME_SIZE = 2048
+VOICE_BAND = (300.0, 3400.0)
+# A planura é medida só nesta banda: os codecs (MP3, AAC) cortam os agudos e os
+# bins vazios levariam a média geométrica a zero em qualquer gravação
+FLATNESS_BAND = (100.0, 8000.0)
+
+# Contadores do processo (quantas chamadas ao modelo foram evitadas)
+stats = {"checked": 0, "rejected_silence": 0, "rejected_speech": 0, "undecodable": 0}
+
+
+# --- DESCODIFICAÇÃO ---
+# Cada descodificador é um gerador: primeiro o sample rate, depois blocos mono
+# float32 de STREAM_BLOCK_SECONDS. Quem só precisa de acumular (características,
+# assinatura) lê a gravação aos blocos com stream(), sem a ter toda em memória.
+def _blocks_soundfile(path, max_seconds, block_seconds):
+    info = soundfile.info(path)
+    yield info.samplerate
+    frames = int(max_seconds * info.samplerate) if max_seconds else -1
+    for block in soundfile.blocks(path, blocksize=int(block_seconds * info.samplerate), frames=frames,
+                                  dtype="float32", always_2d=True):
+        yield block.mean(axis=1)
+
+
+def _blocks_ffmpeg(path, max_seconds, block_seconds, sample_rate=44100):
+    cmd = ["ffmpeg", "-v", "quiet", "-i", path, "-ac", "1", "-ar", str(sample_rate), "-f", "f32le"]
+    if max_seconds:
+        cmd += ["-t", str(max_seconds)]
+    proc = subprocess.Popen(cmd + ["-"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        yield sample_rate
+        while True:
+            data = proc.stdout.read(int(block_seconds * sample_rate) * 4)
+            if not data:
+                break
+            yield np.frombuffer(data[:len(data) // 4 * 4], dtype=np.float32)
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+    finally:
+        proc.kill()
+        proc.stdout.close()
+        proc.wait()
+
+
+def _blocks_wave(path, max_seconds, block_seconds):
+    with wave.open(path, "rb") as w:
+        if w.getsampwidth() != 2:
+            raise ValueError("Só WAV PCM 16-bit sem soundfile/ffmpeg")
+        sr = w.getframerate()
+        yield sr
+        left = min(w.getnframes(), int(max_seconds * sr)) if max_seconds else w.getnframes()
+        while left > 0:
+            n = min(left, int(block_seconds * sr))
+            data = np.frombuffer(w.readframes(n), dtype="<i2").astype(np.float32) / 32768.0
+            if not len(data):
+                break
+            left -= n
+            yield data.reshape(-1, w.getnchannels()).mean(axis=1)
+
+
+def stream(path, max_seconds=None, block_seconds=STREAM_BLOCK_SECONDS):
+    # (sample rate, iterador de blocos mono float32 em [-1, 1]) ou None se não for
+    # possível. O primeiro bloco já foi lido (escolha do descodificador); um erro a
+    # meio do ficheiro sai do iterador
+    decoders = []
+    with open(path, "rb") as f:
+        is_webm = f.read(4) == b"\x1a\x45\xdf\xa3"   # gravações do browser (MediaRecorder)
+    if soundfile is not None and not is_webm:
+        decoders.append(_blocks_soundfile)
+    if shutil.which("ffmpeg"):
+        decoders.append(_blocks_ffmpeg)
+    decoders.append(_blocks_wave)
+    for decoder in decoders:
+        blocks = decoder(path, max_seconds, block_seconds)
+        try:
+            sr = next(blocks)
+            first = next(blocks)
+        except Exception:
+            blocks.close()
+            continue
+        if len(first):
+            return sr, itertools.chain([first], blocks)
+        blocks.close()
+    return None
+
+
+def decode(path, max_seconds=None):
+    # Devolve (amostras mono float32 em [-1, 1], sample rate) ou None se não for possível
+    opened = stream(path, max_seconds)
+    if opened is None:
+        return None
+    sr, blocks = opened
+    try:
+        return np.concatenate(list(blocks)), sr
+    except Exception:
+        return None
+
+
+# --- MÉTRICAS ---
+def frames(samples, frame_size=FRAME_SIZE, hop=None):
+    # Vista (sem cópia) de frames sobrepostas, shape (n_frames, frame_size)
+    hop = hop or frame_size // 2
+    if len(samples) < frame_size:
+        samples = np.pad(samples, (0, frame_size - len(samples)))
+    return np.lib.stride_tricks.sliding_window_view(samples, frame_size)[::hop]
+
+
+def prescreen_metrics(samples, sr):
+    samples = samples - samples.mean()
+    rms = float(np.sqrt(np.mean(samples ** 2)))
+    rms_db = 20 * np.log10(rms + 1e-12)
+
+    fr = frames(samples)
+    frame_rms = np.sqrt(np.mean(fr ** 2, axis=1))
+    # Só as frames "ativas" contam para o espectro (as pausas distorcem a planura)
+    active = frame_rms > max(frame_rms.max() * 0.05, 1e-6)
+    spec_frames = fr[active] if active.any() else fr
+
+    power = np.abs(np.fft.rfft(spec_frames * np.hanning(FRAME_SIZE), axis=1)) ** 2 + 1e-20
+    freqs = np.fft.rfftfreq(FRAME_SIZE, 1.0 / sr)
+    flat_band = power[:, (freqs >= FLATNESS_BAND[0]) & (freqs <= min(FLATNESS_BAND[1], sr / 2))]
+    flatness = np.exp(np.mean(np.log(flat_band), axis=1)) / np.mean(flat_band, axis=1)
+    band = (freqs >= VOICE_BAND[0]) & (freqs <= VOICE_BAND[1])
+    voice_band_ratio = power[:, band].sum() / power.sum()
+
+    signs = np.signbit(fr)
+    zcr = np.mean(signs[:, 1:] != signs[:, :-1])
+
+    return {
+        "rms_db": round(float(rms_db), 2),
+        "spectral_flatness": round(float(np.mean(flatness)), 4),
+        "zero_crossing_rate": round(float(zcr), 4),
+        "voice_band_ratio": round(float(voice_band_ratio), 4),
+        "energy_cv": round(float(frame_rms.std() / (frame_rms.mean() + 1e-12)), 4),
+        "duration_s": round(len(samples) / sr, 2),
+    }
+
+
+def classify(metrics, thresholds=None):
+    t = thresholds or PRESCREEN_THRESHOLDS
+    if metrics["rms_db"] < t["silence_rms_db"]:
+        return "silence"
+    if (metrics["voice_band_ratio"] >= t["speech_voice_band_min"]
+            and metrics["spectral_flatness"] <= t["speech_flatness_max"]
+            and metrics["energy_cv"] >= t["speech_energy_cv_min"]):
+        return "speech"
+    return "ok"
+
+
+def prescreen(path, thresholds=None, decoded=None):
+    # Síncrono (CPU): chamar via run_in_threadpool a partir dos endpoints.
+    # decoded: (amostras, sr) já descodificadas por quem chama, para não ler o ficheiro duas vezes
+    t0 = time.perf_counter()
+    stats["checked"] += 1
+    if decoded is not None:
+        samples, sr = decoded
+        decoded = samples[:int(PRESCREEN_MAX_SECONDS * sr)], sr
+    else:
+        decoded = decode(path, PRESCREEN_MAX_SECONDS)
+    if decoded is None:
+        stats["undecodable"] += 1
+        return {"verdict": "undecodable", "metrics": {}, "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1)}
+    metrics = prescreen_metrics(*decoded)
+    verdict = classify(metrics, thresholds)
+    if verdict != "ok":
+        stats[f"rejected_{verdict}"] += 1
+    return {"verdict": verdict, "metrics": metrics, "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1)}
+
+
+REJECTION_MESSAGES = {
+    "silence": "A gravação está praticamente em silêncio; não há ruído mecânico para analisar.",
+    "speech": "A gravação parece conter sobretudo voz humana e não o som de uma máquina.",
+}
+
+
+def invalid_source_result(result):
+    # Mesmo formato JSON que o modelo devolve, para o resto do pipeline não mudar
+    return {
+        "diagnosis": "Fonte Inválida",
+        "confidence": "95%",
+        "description": REJECTION_MESSAGES[result["verdict"]],
+        "estimated_cost": "0€",
+        "repair_time": "0h",
+        "steps": [
+            "Aproximar o microfone do equipamento em funcionamento",
+            "Evitar falar durante a gravação",
+            "Gravar pelo menos 10 segundos de funcionamento contínuo",
+        ],
+        "prescreen": result["metrics"],
+    }
@@ -0,0 +1,229 @@
+import os
+
+import numpy as np
+
+# --- EXTRAÇÃO DE CARACTERÍSTICAS ESPECTRAIS ---
+# Medições locais, vetorizadas em NumPy, de cada gravação de máquina:
+#   - energia por bandas, centroide e picos dominantes (FFT média, tipo Welch)
+#   - RMS, pico, fator de crista e curtose (impactos -> curtose alta)
+#   - espectro de envelope na banda de ressonância (frequências de defeito de rolamentos)
+#   - ganchos para order tracking e frequências de defeito quando se conhece a rotação
+# O áudio é processado em blocos (FeatureAccumulator.update), por isso uma hora
+# de gravação nunca precisa de estar toda em memória; cada lote de blocos é
+# tratado com uma única FFT 2D.
+
+FRAME_SIZE = 4096
+BLOCK_SECONDS = 2.0            # blocos do espectro de envelope (resolução de 0.5 Hz)
+BATCH_BLOCKS = 16              # blocos por FFT 2D
+BANDS_HZ = [(20, 200), (200, 500), (500, 1000), (1000, 2000), (2000, 4000), (4000, 8000), (8000, 16000)]
+ENVELOPE_BAND_HZ = (2000, 8000)  # ressonâncias excitadas pelos impactos dos rolamentos
+ENVELOPE_MAX_HZ = 500
+MIN_PEAK_HZ = 10
+TOP_PEAKS = 5
+# Segundos de cada gravação usados nas características (lidos aos blocos)
+MAX_SECONDS = float(os.environ.get("ECHO_FEATURES_MAX_SECONDS", "600"))
+
+
+def _db(x):
+    return 10 * np.log10(np.maximum(x, 1e-20))
+
+
+def _top_peaks(freqs, values, n=TOP_PEAKS, min_hz=MIN_PEAK_HZ):
+    # Máximos locais mais fortes (índices ordenados por amplitude)
+    interior = (values[1:-1] > values[:-2]) & (values[1:-1] >= values[2:]) & (freqs[1:-1] >= min_hz)
+    idx = np.nonzero(interior)[0] + 1
+    return idx[np.argsort(values[idx])[::-1][:n]]
+
+
+class FeatureAccumulator:
+    def __init__(self, sample_rate):
+        self.sr = sample_rate
+        # Blocos com um número inteiro de frames da FFT
+        self.block_len = max(1, int(BLOCK_SECONDS * sample_rate) // FRAME_SIZE) * FRAME_SIZE
+        self.pending = np.empty(0, dtype=np.float32)
+        self.window = np.hanning(FRAME_SIZE).astype(np.float32)
+        self.freqs = np.fft.rfftfreq(FRAME_SIZE, 1.0 / sample_rate)
+
+        self.n = 0
+        self.moments = np.zeros(4)     # somas de x, x², x³, x⁴
+        self.peak = 0.0
+        self.psd_sum = np.zeros(FRAME_SIZE // 2 + 1)
+        self.psd_frames = 0
+
+        block_freqs = np.fft.rfftfreq(self.block_len, 1.0 / sample_rate)
+        self.env_lo, self.env_hi = np.searchsorted(block_freqs, ENVELOPE_BAND_HZ)
+        self.env_n = 1 << int(np.ceil(np.log2(max(self.env_hi - self.env_lo, 2))))
+        # O envelope decimado tem env_n amostras por bloco
+        self.env_freqs = np.fft.rfftfreq(self.env_n, self.block_len / sample_rate / self.env_n)
+        # Sample rates baixos (< 2x a banda de ressonância) ficam sem espectro de envelope
+        self.env_keep = int(np.searchsorted(self.env_freqs, ENVELOPE_MAX_HZ)) if self.env_hi - self.env_lo >= 2 else 0
+        self.env_sum = np.zeros(self.env_keep)
+        self.env_blocks = 0
+
+    # --- acumulação ---
+    def update(self, samples):
+        samples = np.asarray(samples, dtype=np.float32)
+        if len(self.pending):
+            samples = np.concatenate([self.pending, samples])
+        batch = self.block_len * BATCH_BLOCKS
+        full = (len(samples) // self.block_len) * self.block_len
+        for start in range(0, full, batch):
+            stop = min(start + batch, full)
+            self._process_blocks(samples[start:stop].reshape(-1, self.block_len))
+        self.pending = samples[full:].copy()
+
+    def _accumulate_moments(self, x):
+        # Produtos em float32, somas acumuladas em float64
+        x = x.ravel()
+        x2 = x * x
+        self.moments += (x.sum(dtype=np.float64), x2.sum(dtype=np.float64),
+                         np.dot(x2, x).astype(np.float64), np.dot(x2, x2).astype(np.float64))
+        self.n += x.size
+        self.peak = max(self.peak, float(np.abs(x).max()))
+
+    def _accumulate_psd(self, frames):
+        spectrum = np.fft.rfft(frames * self.window, axis=1)
+        self.psd_sum += (spectrum.real ** 2 + spectrum.imag ** 2).sum(axis=0)
+        self.psd_frames += len(frames)
+
+    def _accumulate_envelope(self, blocks):
+        # Envelope = módulo do sinal analítico da banda de ressonância. Como o
+        # módulo não depende de deslocar a banda para a origem, basta uma IFFT
+        # curta dos bins da banda (envelope já decimado).
+        if not self.env_keep:
+            return
+        spectrum = np.fft.rfft(blocks, axis=1)[:, self.env_lo:self.env_hi]
+        envelope = np.abs(np.fft.ifft(spectrum, n=self.env_n, axis=1))
+        envelope -= envelope.mean(axis=1, keepdims=True)
+        env_spectrum = np.abs(np.fft.rfft(envelope, axis=1))[:, :self.env_keep]
+        self.env_sum += env_spectrum.sum(axis=0)
+        self.env_blocks += len(blocks)
+
+    def _process_blocks(self, blocks):
+        self._accumulate_moments(blocks)
+        self._accumulate_psd(blocks.reshape(-1, FRAME_SIZE))
+        self._accumulate_envelope(blocks)
+
+    # --- resultado ---
+    def _flush(self):
+        rest = self.pending
+        self.pending = np.empty(0, dtype=np.float32)
+        if not len(rest):
+            return
+        self._accumulate_moments(rest)
+        n_frames = len(rest) // FRAME_SIZE
+        if n_frames:
+            self._accumulate_psd(rest[:n_frames * FRAME_SIZE].reshape(-1, FRAME_SIZE))
+        elif not self.psd_frames:
+            self._accumulate_psd(np.pad(rest, (0, FRAME_SIZE - len(rest)))[None, :])
+        if not self.env_blocks:
+            self._accumulate_envelope(np.pad(rest, (0, self.block_len - len(rest)))[None, :])
+
+    def psd(self):
+        return self.psd_sum / max(self.psd_frames, 1)
+
+    def envelope_spectrum(self):
+        return self.env_freqs[:self.env_keep], self.env_sum / max(self.env_blocks, 1)
+
+    def finalize(self, shaft_hz=None, bearing=None):
+        self._flush()
+        if not self.n:
+            return None
+        s1, s2, s3, s4 = self.moments / self.n
+        mean = s1
+        var = s2 - mean ** 2
+        # Quarto momento central a partir dos momentos brutos
+        m4 = s4 - 4 * mean * s3 + 6 * mean ** 2 * s2 - 3 * mean ** 4
+        rms = np.sqrt(s2)
+
+        psd = self.psd()
+        total = psd.sum() + 1e-20
+        bands = {}
+        for lo, hi in BANDS_HZ:
+            if lo >= self.sr / 2:
+                continue
+            mask = (self.freqs >= lo) & (self.freqs < hi)
+            bands[f"{lo}-{hi}"] = round(float(_db(psd[mask].sum() / total)), 1)
+
+        psd_db = _db(psd)
+        peaks = _top_peaks(self.freqs, psd_db)
+        env_freqs, env = self.envelope_spectrum()
+        env_rel = env / (np.median(env) + 1e-20) if len(env) else env
+        env_peaks = _top_peaks(env_freqs, env_rel, min_hz=2)
+
+        features = {
+            "sample_rate": int(self.sr),
+            "duration_s": round(self.n / self.sr, 2),
+            "rms_db": round(float(20 * np.log10(rms + 1e-12)), 1),
+            "peak_db": round(float(20 * np.log10(self.peak + 1e-12)), 1),
+            "crest_factor": round(float(self.peak / (rms + 1e-12)), 2),
+            "kurtosis": round(float(m4 / var ** 2), 2) if var > 1e-12 else 0.0,
+            "spectral_centroid_hz": round(float((self.freqs * psd).sum() / total), 1),
+            "band_energy_db": bands,
+            "dominant_peaks": [[round(float(self.freqs[i]), 1), round(float(psd_db[i] - psd_db.max()), 1)] for i in peaks],
+            "envelope_peaks": [[round(float(env_freqs[i]), 1), round(float(env_rel[i]), 1)] for i in env_peaks],
+        }
+        if shaft_hz:
+            features["orders"] = order_spectrum(self.freqs, psd, shaft_hz)
+            if bearing:
+                features["bearing_matches"] = match_fault_frequencies(
+                    features["envelope_peaks"], bearing_fault_frequencies(shaft_hz, **bearing))
+        return features
+
+
+def extract(samples, sample_rate, shaft_hz=None, bearing=None):
+    acc = FeatureAccumulator(sample_rate)
+    acc.update(samples)
+    return acc.finalize(shaft_hz, bearing)
+
+
+# --- GANCHOS: ORDER TRACKING E ROLAMENTOS ---
+def order_spectrum(freqs, psd, shaft_hz, max_order=10, tolerance=0.03):
+    # Amplitude (dB relativo ao total) em cada ordem da rotação: 1x desequilíbrio,
+    # 2x desalinhamento, etc. Tolerância relativa para pequenas variações de velocidade.
+    total = psd.sum() + 1e-20
+    orders = {}
+    for k in range(1, max_order + 1):
+        f = k * shaft_hz
+        if f >= freqs[-1]:
+            break
+        mask = np.abs(freqs - f) <= max(f * tolerance, freqs[1])
+        orders[f"{k}x"] = round(float(_db(psd[mask].max() / total)), 1)
+    return orders
+
+
+def bearing_fault_frequencies(shaft_hz, n_balls, ball_diameter, pitch_diameter, contact_angle_deg=0.0):
+    # Frequências clássicas de defeito (Hz) para uma dada geometria do rolamento
+    ratio = ball_diameter / pitch_diameter * np.cos(np.radians(contact_angle_deg))
+    return {
+        "BPFO": n_balls / 2 * shaft_hz * (1 - ratio),
+        "BPFI": n_balls / 2 * shaft_hz * (1 + ratio),
+        "BSF": pitch_diameter / (2 * ball_diameter) * shaft_hz * (1 - ratio ** 2),
+        "FTF": shaft_hz / 2 * (1 - ratio),
+    }
+
+
+def match_fault_frequencies(envelope_peaks, fault_freqs, tolerance=0.03):
+    matches = {}
+    for name, f in fault_freqs.items():
+        hits = [p for p in envelope_peaks if abs(p[0] - f) <= f * tolerance]
+        if hits:
+            matches[name] = {"expected_hz": round(float(f), 1), "peak": hits[0]}
+    return matches
+
+
+# --- RESUMO PARA O PROMPT ---
+def prompt_summary(features):
+    if not features:
+        return "Sem medições locais (formato de áudio não descodificável no servidor)."
+    bands = ", ".join(f"{k} Hz: {v} dB" for k, v in features["band_energy_db"].items())
+    peaks = ", ".join(f"{f} Hz ({db} dB)" for f, db in features["dominant_peaks"]) or "nenhum"
+    env = ", ".join(f"{f} Hz (x{a})" for f, a in features["envelope_peaks"]) or "nenhum"
+    return (
+        f"- Duração: {features['duration_s']}s, RMS {features['rms_db']} dBFS, "
+        f"fator de crista {features['crest_factor']}, curtose {features['kurtosis']} (3 = ruído gaussiano)\n"
+        f"- Centroide espectral: {features['spectral_centroid_hz']} Hz\n"
+        f"- Energia por banda (relativa ao total): {bands}\n"
+        f"- Picos dominantes do espectro: {peaks}\n"
+        f"- Picos do espectro de envelope {ENVELOPE_BAND_HZ[0]}-{ENVELOPE_BAND_HZ[1]} Hz: {env}"
+    )
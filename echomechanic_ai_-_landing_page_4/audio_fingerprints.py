@@ -0,0 +1,448 @@
+import os
+import sys
+import json
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+import database
+import audio_dsp
+import audio_store
+import audio_features
+import embeddings
+
+# --- ASSINATURAS DE ÁUDIO E CASOS SEMELHANTES ---
+# Cada gravação era analisada isolada, mas o arquivo (historico.audio_path, com
+# o diagnóstico de cada uma) já tem precedentes. Cada gravação passa a ter uma
+# assinatura espectral compacta e o /api/analyze/similar devolve os casos
+# passados que soam mais parecidos:
+#   - assinatura (FINGERPRINT_DIM floats, 128 bytes em float16) calculada na
+#     mesma passagem que as características do audio_features: forma do espectro
+#     médio em bandas logarítmicas (dB relativos ao total, sem depender do ganho
+#     do microfone nem do sample rate), espectro de envelope em bandas (impactos
+#     periódicos dos rolamentos) e curtose/fator de crista; normalizada, por isso
+#     o produto interno é o cosseno;
+#   - vetores num ficheiro só de acrescentar lido por memmap (embeddings.VectorFile),
+#     a tabela audio_fingerprints (migração 013) liga cada audio_path à linha;
+#   - índice IVF em disco: a tabela audio_fingerprint_cells guarda os centroides
+#     (k-means esférico, ~sqrt(N) células) e cada assinatura fica na célula mais
+#     próxima. Uma pesquisa compara com os centroides e só lê as SIMILAR_NPROBE
+#     células mais próximas: ~2·NPROBE·sqrt(N) vetores em vez de N. O índice é
+#     retreinado em background quando o arquivo passa 4x o tamanho do treino;
+#   - as gravações novas ganham assinatura no /api/analyze (o áudio já está
+#     descodificado); as antigas pelo backfill em paralelo (python audio_fingerprints.py).
+# Casos de outras contas entram como precedente anónimo (só diagnóstico e confiança).
+
+FINGERPRINTS_DIR = os.environ.get("ECHO_FINGERPRINTS_DIR", "fingerprints")
+SIMILAR_DEFAULT = 5
+SIMILAR_MAX = 20
+SIMILAR_NPROBE = int(os.environ.get("ECHO_SIMILAR_NPROBE", "8"))
+# Casos a partir desta semelhança entram no prompt da análise
+SIMILAR_PROMPT_MIN = float(os.environ.get("ECHO_SIMILAR_PROMPT_MIN", "0.85"))
+SIMILAR_PROMPT_CASES = 3
+# Semelhança a partir da qual um caso da própria conta substitui a chamada ao
+# modelo (0 = desligado: o diagnóstico continua a ser do modelo)
+SIMILAR_SHORTCUT = float(os.environ.get("ECHO_SIMILAR_SHORTCUT", "0"))
+# Diagnósticos que não são precedente de nada
+EXCLUDED_DIAGNOSES = ("Fonte Inválida", "Erro Técnico")
+
+SPECTRUM_BANDS = 46
+SPECTRUM_RANGE_HZ = (20, 16000)
+SPECTRUM_FLOOR_DB = -100
+ENVELOPE_BANDS = 16
+ENVELOPE_RANGE_HZ = (2, audio_features.ENVELOPE_MAX_HZ)
+ENVELOPE_WEIGHT = 2.0
+SHAPE_WEIGHT = 1.0
+FINGERPRINT_DIM = SPECTRUM_BANDS + ENVELOPE_BANDS + 2
+FINGERPRINT_VERSION = 1
+
+# IVF: abaixo de MIN_TRAIN_ROWS a pesquisa é força bruta (poucos ms)
+MIN_TRAIN_ROWS = 1024
+TRAIN_SAMPLE = 20_000
+TRAIN_ITERATIONS = 8
+ASSIGN_CHUNK = 65_536
+SAVE_CHUNK = 50_000
+BACKFILL_WORKERS = int(os.environ.get("ECHO_FINGERPRINT_WORKERS", str(os.cpu_count() or 1)))
+BACKFILL_BATCH = 256
+
+stats = {"fingerprinted": 0, "undecodable": 0, "queries": 0, "scanned": 0, "trainings": 0, "shortcuts": 0}
+
+_vectors = None
+_cells = None          # (geração, centroides float32) em memória
+_lock = threading.Lock()
+_training = False
+
+
+# --- ASSINATURA ---
+def _band_levels(freqs, power, edges):
+    # Potência média por banda pelo integral (trapézios) interpolado nas fronteiras:
+    # não depende da resolução da FFT; bandas acima de Nyquist ficam a zero
+    cumulative = np.concatenate([[0.0], np.cumsum((power[1:] + power[:-1]) / 2 * np.diff(freqs))])
+    return np.diff(np.interp(edges, freqs, cumulative)) / np.diff(edges)
+
+
+def fingerprint(acc, features):
+    # acc: audio_features.FeatureAccumulator já finalizado
+    if not features:
+        return None
+    psd = acc.psd()
+    levels = _band_levels(acc.freqs, psd, np.geomspace(*SPECTRUM_RANGE_HZ, SPECTRUM_BANDS + 1))
+    spectrum = 10 * np.log10(np.maximum(levels / (psd.sum() + 1e-20), 10 ** (SPECTRUM_FLOOR_DB / 10)))
+    # Forma do espectro em décadas (20 dB), centrada
+    spectrum = (spectrum - spectrum.mean()) / 20
+
+    envelope = np.zeros(ENVELOPE_BANDS)
+    env_freqs, env = acc.envelope_spectrum()
+    if len(env) > 1:
+        rel = env / (np.median(env) + 1e-20)
+        envelope = np.log10(np.maximum(_band_levels(env_freqs, rel, np.geomspace(*ENVELOPE_RANGE_HZ, ENVELOPE_BANDS + 1)), 1e-3))
+        envelope -= envelope.mean()
+
+    # Impulsividade: curtose 3 e fator de crista ~3-4 são ruído gaussiano
+    shape = np.log([max(features["kurtosis"], 1e-3) / 3, max(features["crest_factor"], 1e-3) / 3.5])
+
+    vector = np.concatenate([spectrum, ENVELOPE_WEIGHT * envelope, SHAPE_WEIGHT * shape]).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def analyse(samples, sample_rate):
+    # (características, assinatura) numa só passagem pelo áudio
+    acc = audio_features.FeatureAccumulator(sample_rate)
+    acc.update(samples)
+    features = acc.finalize()
+    return features, fingerprint(acc, features)
+
+
+def analyse_file(path, head_seconds=0):
+    # analyse() lendo o ficheiro aos blocos (até audio_features.MAX_SECONDS), sem a
+    # gravação toda em memória. Devolve (características, assinatura, início) com
+    # os primeiros head_seconds de amostras ((amostras, sr), para a pré-triagem) ou
+    # (None, None, None) se não der para descodificar
+    opened = audio_dsp.stream(path, audio_features.MAX_SECONDS)
+    if opened is None:
+        return None, None, None
+    sr, blocks = opened
+    acc = audio_features.FeatureAccumulator(sr)
+    head, kept = [], 0
+    try:
+        for block in blocks:
+            acc.update(block)
+            if kept < head_seconds * sr:
+                head.append(block[:int(head_seconds * sr) - kept])
+                kept += len(head[-1])
+    except Exception as e:
+        # Ficheiro estragado a meio: fica o que já foi lido
+        print(f"ERRO: descodificação de {path} parou a meio: {e}")
+    features = acc.finalize()
+    return features, fingerprint(acc, features), (np.concatenate(head), sr) if head else None
+
+
+def fingerprint_file(path):
+    # Corre num processo do pool do backfill
+    return analyse_file(path)[1]
+
+
+def vectors():
+    global _vectors
+    if _vectors is None:
+        _vectors = embeddings.VectorFile(
+            os.path.join(FINGERPRINTS_DIR, f"v{FINGERPRINT_VERSION}-{FINGERPRINT_DIM}.f16"), FINGERPRINT_DIM)
+    return _vectors
+
+
+def _matrix(positions):
+    return np.asarray(vectors().view(int(positions.max()) + 1))[positions].astype(np.float32)
+
+
+# --- CÉLULAS DO ÍNDICE (tabelas na migração 013) ---
+def _centroids(conn):
+    # Centroides da geração atual (None = ainda sem índice, força bruta)
+    global _cells
+    generation = conn.execute("SELECT max(generation) FROM audio_fingerprint_cells").fetchone()[0]
+    if generation is None:
+        return None
+    if _cells is None or _cells[0] != generation:
+        blobs = conn.execute("SELECT centroid FROM audio_fingerprint_cells ORDER BY cell").fetchall()
+        _cells = (generation, np.frombuffer(b"".join(b[0] for b in blobs), dtype=np.float32).reshape(len(blobs), FINGERPRINT_DIM))
+    return _cells[1]
+
+
+def _assign(centroids, matrix):
+    if centroids is None:
+        return np.zeros(len(matrix), dtype=np.int64)
+    return np.concatenate([np.argmax(matrix[i:i + ASSIGN_CHUNK] @ centroids.T, axis=1)
+                           for i in range(0, len(matrix), ASSIGN_CHUNK)] or [np.zeros(0, np.int64)])
+
+
+def _needs_training(rows, centroids):
+    cells = 0 if centroids is None else len(centroids)
+    return rows >= MIN_TRAIN_ROWS and rows > 4 * cells * cells
+
+
+def _add(conn, items):
+    # items: [(audio_path, assinatura)]; devolve True se o índice precisa de treino.
+    # O lock de escrita vem antes de ver os caminhos já conhecidos: dois add() da
+    # mesma gravação em paralelo (ou o backfill noutro processo) não escrevem duas
+    # linhas no ficheiro nem batem no UNIQUE de audio_path
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    paths = [path for path, _ in items]
+    known = set()
+    for i in range(0, len(paths), 500):
+        chunk = paths[i:i + 500]
+        known.update(r[0] for r in conn.execute(
+            f"SELECT audio_path FROM audio_fingerprints WHERE audio_path IN ({', '.join('?' * len(chunk))})", chunk))
+    items = [(path, vector) for path, vector in dict(items).items() if path not in known]
+    centroids = _centroids(conn)
+    if items:
+        matrix = np.stack([vector for _, vector in items]).astype(np.float32)
+        cells = _assign(centroids, matrix)
+        with _lock:
+            first = vectors().append(matrix)
+        conn.executemany("INSERT OR IGNORE INTO audio_fingerprints (row, audio_path, cell) VALUES (?, ?, ?)",
+                         [(first + i, path, int(cell)) for i, ((path, _), cell) in enumerate(zip(items, cells))])
+        stats["fingerprinted"] += len(items)
+    return _needs_training(vectors().rows(), centroids)
+
+
+async def add(audio_path, vector):
+    if await database.run(_add, [(audio_path, vector)]):
+        schedule_training()
+
+
+def _vector_of(conn, audio_path):
+    row = conn.execute("SELECT row FROM audio_fingerprints WHERE audio_path=?", (audio_path,)).fetchone()
+    return _matrix(np.array([row[0]]))[0] if row else None
+
+
+async def vector_of(audio_path):
+    return await database.run(_vector_of, audio_path)
+
+
+# --- ÍNDICE IVF ---
+def _kmeans(sample, cells, rng):
+    # k-means esférico (vetores e centroides normalizados, atribuição por cosseno)
+    centroids = sample[rng.choice(len(sample), cells, replace=False)].copy()
+    for _ in range(TRAIN_ITERATIONS):
+        labels = _assign(centroids, sample)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Células vazias ficam com o centroide anterior
+        centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+    return centroids.astype(np.float32)
+
+
+def _training_rows(conn):
+    return np.array([r[0] for r in conn.execute("SELECT row FROM audio_fingerprints ORDER BY row")], dtype=np.int64)
+
+
+def fit(rows, seed=0):
+    # CPU, fora das threads da BD: (centroides, célula de cada linha)
+    rng = np.random.default_rng(seed)
+    cells = int(np.sqrt(len(rows)))
+    sample = np.sort(rng.choice(rows, min(len(rows), TRAIN_SAMPLE), replace=False))
+    centroids = _kmeans(_matrix(sample), cells, rng)
+    labels = np.concatenate([_assign(centroids, _matrix(rows[i:i + ASSIGN_CHUNK])) for i in range(0, len(rows), ASSIGN_CHUNK)])
+    return centroids, labels
+
+
+def _save_cells(conn, centroids):
+    global _cells
+    generation = (conn.execute("SELECT max(generation) FROM audio_fingerprint_cells").fetchone()[0] or 0) + 1
+    conn.execute("DELETE FROM audio_fingerprint_cells")
+    conn.executemany("INSERT INTO audio_fingerprint_cells (cell, generation, centroid) VALUES (?, ?, ?)",
+                     [(cell, generation, centroid.tobytes()) for cell, centroid in enumerate(centroids)])
+    _cells = (generation, centroids)
+
+
+def _save_labels(conn, rows, labels):
+    conn.executemany("UPDATE audio_fingerprints SET cell=? WHERE row=?", zip(labels.tolist(), rows.tolist()))
+
+
+def _assign_late(conn, centroids, last_row):
+    # Assinaturas gravadas durante o treino (células dos centroides antigos)
+    late = np.array([r[0] for r in conn.execute("SELECT row FROM audio_fingerprints WHERE row > ?", (last_row,))], dtype=np.int64)
+    if len(late):
+        _save_labels(conn, late, _assign(centroids, _matrix(late)))
+    stats["trainings"] += 1
+
+
+async def train():
+    # As células novas são gravadas em blocos de SAVE_CHUNK linhas: com um milhão
+    # de assinaturas, uma só transação prendia a escrita na BD durante segundos.
+    # Entretanto as pesquisas sondam as células novas com parte das linhas ainda
+    # nas antigas (recall um pouco mais baixo durante esses segundos)
+    global _training
+    try:
+        rows = await database.run(_training_rows)
+        if len(rows) < MIN_TRAIN_ROWS:
+            return
+        centroids, labels = await run_in_threadpool(fit, rows)
+        await database.run(_save_cells, centroids)
+        for i in range(0, len(rows), SAVE_CHUNK):
+            await database.run(_save_labels, rows[i:i + SAVE_CHUNK], labels[i:i + SAVE_CHUNK])
+        await database.run(_assign_late, centroids, int(rows[-1]))
+        print(f"DEBUG: Índice de assinaturas treinado ({len(rows)} gravações, {len(centroids)} células)")
+    except Exception as e:
+        print(f"ERRO ASSINATURAS: {e}")
+    finally:
+        _training = False
+
+
+def schedule_training():
+    global _training
+    if not _training:
+        _training = True
+        asyncio.get_running_loop().create_task(train())
+
+
+# --- PESQUISA ---
+def _nearest(conn, vector, k):
+    # [(linha, semelhança)] das k assinaturas mais próximas nas células sondadas, e quantas foram lidas
+    centroids = _centroids(conn)
+    if centroids is None:
+        cursor = conn.execute("SELECT row FROM audio_fingerprints")
+    else:
+        probe = np.argsort(-(centroids @ vector))[:SIMILAR_NPROBE].tolist()
+        cursor = conn.execute(f"SELECT row FROM audio_fingerprints WHERE cell IN ({', '.join('?' * len(probe))})", probe)
+    positions = np.fromiter((r[0] for r in cursor), dtype=np.int64)
+    if not len(positions):
+        return [], 0
+    scores = _matrix(positions) @ vector
+    k = min(k, len(positions))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [(int(positions[i]), float(scores[i])) for i in top], len(positions)
+
+
+def _similar(conn, vector, email, limit, exclude_path):
+    # Casos (um por gravação, o mais recente; os da própria conta primeiro) por
+    # ordem de semelhança. Pedimos mais vizinhos do que o limite: gravações sem
+    # diagnóstico útil (ou a própria) são saltadas
+    matches, scanned = _nearest(conn, vector, max(limit * 4, 16))
+    stats["queries"] += 1
+    stats["scanned"] += scanned
+    paths = dict(conn.execute(
+        f"SELECT row, audio_path FROM audio_fingerprints WHERE row IN ({', '.join('?' * len(matches))})",
+        [row for row, _ in matches]).fetchall()) if matches else {}
+    cases = []
+    for row, similarity in matches:
+        path = paths.get(row)
+        if path is None or path == exclude_path:
+            continue
+        case = conn.execute(f"""
+            SELECT id, user_email, maquina_nome, data_analise, diagnostico, confianca FROM historico
+            WHERE audio_path=? AND diagnostico IS NOT NULL AND diagnostico NOT IN ({', '.join('?' * len(EXCLUDED_DIAGNOSES))})
+            ORDER BY user_email = ? DESC, id DESC LIMIT 1
+        """, (path, *EXCLUDED_DIAGNOSES, email)).fetchone()
+        if case is None:
+            continue
+        result = {"diagnostico": case[4], "confianca": case[5], "similarity": round(similarity, 4), "proprio": case[1] == email}
+        if result["proprio"]:
+            result.update(historico_id=case[0], maquina_nome=case[2], data_analise=case[3])
+        cases.append(result)
+        if len(cases) == limit:
+            break
+    return cases, scanned
+
+
+async def similar_cases(vector, email, limit=SIMILAR_DEFAULT, exclude_path=None):
+    # Devolve (casos, assinaturas comparadas)
+    return await database.run(_similar, vector, email, limit, exclude_path)
+
+
+def _shortcut(conn, case):
+    row = conn.execute("SELECT detalhes_json FROM historico WHERE id=?", (case["historico_id"],)).fetchone()
+    return row[0] if row else None
+
+
+async def shortcut_result(cases):
+    # Diagnóstico de um caso da própria conta quase igual, em vez de chamar o modelo
+    if not SIMILAR_SHORTCUT or not cases or not cases[0]["proprio"] or cases[0]["similarity"] < SIMILAR_SHORTCUT:
+        return None
+    details = await database.run(_shortcut, cases[0])
+    if not details:
+        return None
+    stats["shortcuts"] += 1
+    data = json.loads(details)
+    data["similar_to"] = cases[0]["historico_id"]
+    return data
+
+
+def prompt_summary(cases):
+    cases = [c for c in cases if c["similarity"] >= SIMILAR_PROMPT_MIN][:SIMILAR_PROMPT_CASES]
+    if not cases:
+        return "Sem gravações semelhantes no arquivo."
+    return "\n".join(f"- {c['diagnostico']} (confiança {c['confianca']}, semelhança {c['similarity']:.2f})" for c in cases)
+
+
+# --- BACKFILL EM PARALELO ---
+# python audio_fingerprints.py [--workers N]
+# Descodifica e calcula a assinatura de cada gravação referida no historico que
+# ainda não a tem, num processo por CPU, e treina o índice no fim.
+def _missing(conn):
+    return [r[0] for r in conn.execute("""
+        SELECT DISTINCT h.audio_path FROM historico h
+        WHERE h.audio_path IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM audio_fingerprints f WHERE f.audio_path = h.audio_path)
+    """)]
+
+
+def local_file(audio_path):
+    # Caminhos antigos ("../assets/audio_history/...") e do armazém ("/assets/audio_store/...")
+    return audio_store.local_path(audio_path.replace("../", "/"))
+
+
+def backfill(conn, workers=BACKFILL_WORKERS):
+    paths = [p for p in _missing(conn) if os.path.isfile(local_file(p))]
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        batch = []
+        results = pool.map(fingerprint_file, [local_file(p) for p in paths], chunksize=max(1, min(16, len(paths) // (workers * 4))))
+        for path, vector in zip(paths, results):
+            if vector is None:
+                stats["undecodable"] += 1
+                continue
+            batch.append((path, vector))
+            if len(batch) == BACKFILL_BATCH:
+                _add(conn, batch)
+                conn.commit()
+                done += len(batch)
+                batch = []
+        if batch:
+            _add(conn, batch)
+            conn.commit()
+            done += len(batch)
+    return done, len(paths)
+
+
+def build_index(conn):
+    rows = _training_rows(conn)
+    if len(rows) < MIN_TRAIN_ROWS:
+        return 0
+    centroids, labels = fit(rows)
+    _save_cells(conn, centroids)
+    _save_labels(conn, rows, labels)
+    _assign_late(conn, centroids, int(rows[-1]))
+    conn.commit()
+    return len(centroids)
+
+
+if __name__ == "__main__":
+    import time
+    import migrations
+    workers = int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv else BACKFILL_WORKERS
+    conn = database.connect()
+    migrations.migrate(conn)
+    t0 = time.perf_counter()
+    done, total = backfill(conn, workers)
+    print(f"{done} de {total} gravação(ões) com assinatura em {time.perf_counter() - t0:.1f}s "
+          f"({workers} processo(s), {stats['undecodable']} não descodificável(is))")
+    cells = build_index(conn)
+    print(f"Índice: {vectors().rows()} assinatura(s), {cells or 'sem'} células")
+    conn.close()
@@ -0,0 +1,158 @@
+import os
+import sys
+import time
+import hashlib
+
+from starlette.concurrency import run_in_threadpool
+
+import database
+
+# --- ARMAZÉM DE ÁUDIO ENDEREÇADO POR CONTEÚDO ---
+# Cada gravação é guardada uma única vez, com o nome igual ao seu SHA-256 e
+# repartida por subpastas (ab/cd/abcd....mp3) para nenhuma pasta crescer demais.
+# A tabela audio_blobs regista os ficheiros; as "referências" são as linhas de
+# historico cujo audio_path aponta para o blob (e os jobs da fila ainda por
+# terminar). Um blob sem referências é lixo e é apagado por collect_garbage
+# (por exemplo depois de delete_user). O disco só é tocado fora das transações:
+# a linha do blob é gravada primeiro e o ficheiro posto no sítio depois do
+# commit (_place, idempotente), tal como o GC só apaga ficheiros depois do commit.
+
+STORE_DIR = os.path.join("assets", "audio_store")
+STORE_URL = "/assets/audio_store"
+TMP_DIR = os.path.join(STORE_DIR, "tmp")
+# Um blob acabado de gravar (ou reutilizado) ainda não tem linha no historico
+# enquanto a IA o analisa; o GC ignora blobs tocados há menos tempo do que isto.
+GC_GRACE_SECONDS = 600
+
+
+def blob_relpath(sha256, ext):
+    return os.path.join(sha256[:2], sha256[2:4], f"{sha256}.{ext}")
+
+
+def blob_url(sha256, ext):
+    return f"{STORE_URL}/{sha256[:2]}/{sha256[2:4]}/{sha256}.{ext}"
+
+
+def temp_path(ext):
+    os.makedirs(TMP_DIR, exist_ok=True)
+    return os.path.join(TMP_DIR, f"{os.urandom(8).hex()}.{ext}")
+
+
+def _put(conn, sha256, size, mime_type, ext):
+    # Só a BD: regista (ou volta a tocar) o blob e devolve (url, já existia?)
+    row = conn.execute("SELECT path FROM audio_blobs WHERE sha256=?", (sha256,)).fetchone()
+    if row:
+        conn.execute("UPDATE audio_blobs SET touched_at=? WHERE sha256=?", (int(time.time()), sha256))
+        return row[0], True
+    url = blob_url(sha256, ext)
+    conn.execute("INSERT OR IGNORE INTO audio_blobs (sha256, path, size, mime_type, touched_at) VALUES (?, ?, ?, ?, ?)",
+                 (sha256, url, size, mime_type, int(time.time())))
+    return url, False
+
+
+def _place(src_path, url):
+    # Depois do commit: a cópia nova vai para o sítio do blob. Se o ficheiro já lá
+    # estiver (mesmo conteúdo) a cópia é descartada e não ocupa mais disco; se
+    # faltar (ex: processo morto entre o commit e o move) esta cópia repõe-o
+    dest = local_path(url)
+    if os.path.exists(dest):
+        os.remove(src_path)
+    else:
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(src_path, dest)
+
+
+async def put(stored):
+    # stored: audio_upload.StoredAudio gravado num caminho temporário (temp_path)
+    # Devolve (url para historico.audio_path, deduplicado?)
+    ext = stored.path.rsplit(".", 1)[-1]
+    url, deduplicated = await database.run(_put, stored.sha256, stored.size, stored.mime_type, ext)
+    await run_in_threadpool(_place, stored.path, url)
+    stored.path = local_path(url)
+    return url, deduplicated
+
+
+def local_path(url):
+    return url.lstrip("/")
+
+
+def collect_garbage(conn, grace_seconds=GC_GRACE_SECONDS):
+    # Apaga as linhas dos blobs órfãos e devolve os ficheiros a remover
+    # (os ficheiros só são apagados depois do commit, em remove_files)
+    cutoff = int(time.time()) - grace_seconds
+    rows = conn.execute("""
+        SELECT b.sha256, b.path FROM audio_blobs b
+        WHERE b.touched_at < ?
+          AND NOT EXISTS (SELECT 1 FROM historico h WHERE h.audio_path = b.path)
+          AND NOT EXISTS (SELECT 1 FROM analysis_jobs j WHERE j.audio_path = b.path AND j.status IN ('queued', 'running'))
+    """, (cutoff,)).fetchall()
+    conn.executemany("DELETE FROM audio_blobs WHERE sha256=?", [(sha,) for sha, _ in rows])
+    return [local_path(path) for _, path in rows]
+
+
+def remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+async def gc(grace_seconds=GC_GRACE_SECONDS):
+    paths = await database.run(collect_garbage, grace_seconds)
+    await run_in_threadpool(remove_files, paths)
+    if paths:
+        print(f"DEBUG: GC de áudio removeu {len(paths)} ficheiro(s)")
+    return len(paths)
+
+
+# --- MIGRAÇÃO DOS FICHEIROS ANTIGOS ---
+# python audio_store.py [--remove-legacy]
+# Move para o armazém cada ficheiro referenciado em historico.audio_path
+# (uploads/ e assets/audio_history/) e reescreve o caminho na BD.
+def _sha256_file(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def import_legacy(conn, remove_legacy=False):
+    import shutil
+    import audio_upload
+
+    imported = saved = 0
+    legacy_paths = [r[0] for r in conn.execute(
+        "SELECT DISTINCT audio_path FROM historico WHERE audio_path IS NOT NULL AND audio_path NOT LIKE ?", (STORE_URL + "/%",))]
+    for old_url in legacy_paths:
+        path = local_path(old_url.replace("../", "/"))
+        if not os.path.isfile(path):
+            print(f"  (em falta) {old_url}")
+            continue
+        sha256 = _sha256_file(path)
+        ext = path.rsplit(".", 1)[-1] if "." in path else "mp3"
+        tmp = temp_path(ext)
+        shutil.copyfile(path, tmp)
+        size = os.path.getsize(tmp)
+        url, deduplicated = _put(conn, sha256, size, audio_upload.mime_type_for(ext), ext)
+        conn.commit()
+        _place(tmp, url)
+        conn.execute("UPDATE historico SET audio_path=? WHERE audio_path=?", (url, old_url))
+        conn.commit()
+        imported += 1
+        if deduplicated:
+            saved += size
+        if remove_legacy:
+            os.remove(path)
+        print(f"  {old_url} -> {url}{' (duplicado)' if deduplicated else ''}")
+    conn.commit()
+    print(f"{imported} ficheiro(s) importado(s), {saved / 1024:.0f} KB de duplicados poupados")
+
+
+if __name__ == "__main__":
+    import migrations
+    conn = database.connect()
+    migrations.migrate(conn)
+    import_legacy(conn, remove_legacy="--remove-legacy" in sys.argv)
+    conn.close()
@@ -0,0 +1,201 @@
+import os
+import struct
+import asyncio
+import hashlib
+import contextlib
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+import inference
+
+# --- UPLOAD DE ÁUDIO EM STREAMING ---
+# O analyze_audio fazia "await file.read()" (o ficheiro inteiro em memória),
+# gravava-o no disco e mandava os mesmos bytes inline ao Gemini. Aqui o upload
+# é copiado para o disco aos bocados (buffer limitado), o SHA-256 é calculado
+# pelo caminho e os limites de tamanho/duração são aplicados logo nos primeiros
+# bytes, antes de termos o ficheiro todo.
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+MAX_UPLOAD_BYTES = int(float(os.environ.get("ECHO_MAX_UPLOAD_MB", "25")) * 1024 * 1024)
+MAX_AUDIO_SECONDS = float(os.environ.get("ECHO_MAX_AUDIO_SECONDS", "600"))
+# Acima disto o áudio vai para a Files API do Gemini (enviado do disco) em vez de
+# seguir inline no pedido: o inline é lido para memória (uma cópia, no máximo
+# isto) e fica lá enquanto o pedido durar
+INLINE_AUDIO_MAX_BYTES = int(float(os.environ.get("ECHO_INLINE_AUDIO_MAX_MB", "4")) * 1024 * 1024)
+HEADER_PROBE_BYTES = 64 * 1024
+
+AUDIO_MIME_TYPES = {
+    "mp3": "audio/mp3",
+    "wav": "audio/wav",
+    "ogg": "audio/ogg",
+    "flac": "audio/flac",
+    "aac": "audio/aac",
+    "m4a": "audio/mp4",
+    "webm": "audio/webm",
+}
+
+# Bitrates (kbps) de MPEG Layer III, por índice do header da frame
+MP3_BITRATES_V1 = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]
+MP3_BITRATES_V2 = [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+class StoredAudio:
+    def __init__(self, path, sha256, size, mime_type, byte_rate=None):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.mime_type = mime_type
+        self.byte_rate = byte_rate
+
+    @property
+    def duration(self):
+        # Estimativa (exata para WAV, MP3 CBR e MP3 VBR com header Xing); None se o formato não for reconhecido
+        if not self.byte_rate:
+            return None
+        return self.size / self.byte_rate
+
+
+def mime_type_for(extension):
+    return AUDIO_MIME_TYPES.get(extension.lower(), "audio/mp3")
+
+
+def _mp3_byte_rate(head):
+    offset = 0
+    # Salta a tag ID3v2 (tamanho "syncsafe" de 28 bits)
+    if head[:3] == b"ID3" and len(head) >= 10:
+        size = 0
+        for b in head[6:10]:
+            size = (size << 7) | (b & 0x7F)
+        offset = 10 + size
+    # A primeira frame tem de começar logo aqui: gravações do browser (webm/ogg com
+    # extensão .mp3) contêm bytes 0xFFE.. ao acaso e dariam durações falsas.
+    i = offset
+    if len(head) < i + 4 or head[i] != 0xFF or (head[i + 1] & 0xE0) != 0xE0:
+        return None
+    version = (head[i + 1] >> 3) & 0x03   # 3 = MPEG1, 2 = MPEG2, 0 = MPEG2.5
+    layer = (head[i + 1] >> 1) & 0x03     # 1 = Layer III
+    bitrate_index = head[i + 2] >> 4
+    sr_index = (head[i + 2] >> 2) & 0x03
+    if layer != 1 or version == 1 or bitrate_index in (0, 15) or sr_index == 3:
+        return None
+    # Ficheiros VBR (ex: gravados pelo ffmpeg/lame) têm um header Xing/Info na
+    # primeira frame com o número total de frames e de bytes
+    vbr = _mp3_xing_byte_rate(head[i:i + 200], MP3_SAMPLE_RATES[version][sr_index], 1152 if version == 3 else 576)
+    if vbr:
+        return vbr
+    table = MP3_BITRATES_V1 if version == 3 else MP3_BITRATES_V2
+    return table[bitrate_index] * 1000 / 8
+
+
+def _mp3_xing_byte_rate(frame, sample_rate, samples_per_frame):
+    for tag in (b"Xing", b"Info"):
+        pos = frame.find(tag)
+        if pos < 0 or len(frame) < pos + 16:
+            continue
+        flags = struct.unpack(">I", frame[pos + 4:pos + 8])[0]
+        if flags & 0x03 != 0x03:   # precisamos dos campos "frames" e "bytes"
+            return None
+        frames, total_bytes = struct.unpack(">II", frame[pos + 8:pos + 16])
+        if not frames:
+            return None
+        return total_bytes / (frames * samples_per_frame / sample_rate)
+    return None
+
+
+def _wav_byte_rate(head):
+    if len(head) < 32 or head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+        return None
+    byte_rate = struct.unpack("<I", head[28:32])[0]
+    return byte_rate or None
+
+
+def estimate_byte_rate(head):
+    # Bytes por segundo de áudio, lidos do header; None se não for possível
+    return _wav_byte_rate(head) or _mp3_byte_rate(head)
+
+
+async def stream_to_disk(file, final_path, max_bytes=MAX_UPLOAD_BYTES, max_seconds=MAX_AUDIO_SECONDS):
+    # Content-Length já conhecido: rejeita antes de ler um único byte
+    if file.size and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Ficheiro demasiado grande (máx. {max_bytes // (1024 * 1024)} MB)")
+
+    ext = final_path.rsplit(".", 1)[-1] if "." in final_path else "mp3"
+    part_path = final_path + ".part"
+    sha = hashlib.sha256()
+    size = 0
+    head = b""
+    byte_rate = None
+    limit = max_bytes
+
+    try:
+        with open(part_path, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if len(head) < HEADER_PROBE_BYTES:
+                    head += chunk[:HEADER_PROBE_BYTES - len(head)]
+                    if byte_rate is None:
+                        byte_rate = estimate_byte_rate(head)
+                        if byte_rate:
+                            # A duração máxima passa a ser também um limite de bytes
+                            limit = min(max_bytes, int(max_seconds * byte_rate))
+                size += len(chunk)
+                if size > limit:
+                    if limit < max_bytes:
+                        raise HTTPException(status_code=413, detail=f"Gravação demasiado longa (máx. {max_seconds:.0f}s)")
+                    raise HTTPException(status_code=413, detail=f"Ficheiro demasiado grande (máx. {max_bytes // (1024 * 1024)} MB)")
+                sha.update(chunk)
+                await run_in_threadpool(out.write, chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Ficheiro de áudio vazio")
+        os.replace(part_path, final_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+    return StoredAudio(final_path, sha.hexdigest(), size, mime_type_for(ext), byte_rate)
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def _delete_upload(name):
+    import google.generativeai as genai
+    try:
+        await inference.run_blocking(genai.delete_file, name, priority=inference.PRIORITY_BACKGROUND)
+    except Exception as e:
+        # O Gemini apaga-o sozinho ao fim de 48h
+        print(f"ERRO: não foi possível apagar o upload {name}: {e}")
+
+
+# A parte do áudio no pedido ao modelo depende do backend do cliente:
+#   async with model.audio_part(stored) as part: ... generate_content([prompt, part])
+# (ModelClient.audio_part chama o backend, que usa uma destas)
+@contextlib.asynccontextmanager
+async def hash_audio_part(stored):
+    # Backend local (stub): só precisa do hash do conteúdo (chave das fixtures),
+    # por isso nem lê o ficheiro
+    yield {"mime_type": stored.mime_type, "sha256": stored.sha256}
+
+
+@contextlib.asynccontextmanager
+async def gemini_audio_part(stored):
+    # Ficheiros pequenos seguem inline (um único pedido, lidos do disco só agora);
+    # os grandes são enviados por referência através da Files API do Gemini e
+    # apagados à saída (em background, sem atrasar a resposta)
+    if stored.size <= INLINE_AUDIO_MAX_BYTES:
+        data = await run_in_threadpool(_read_file, stored.path)
+        yield {"mime_type": stored.mime_type, "data": data}
+        return
+    import google.generativeai as genai
+    uploaded = await inference.run_blocking(genai.upload_file, path=stored.path, mime_type=stored.mime_type)
+    try:
+        yield uploaded
+    finally:
+        asyncio.get_running_loop().create_task(_delete_upload(uploaded.name))
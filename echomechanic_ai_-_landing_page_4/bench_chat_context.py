@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+
+import database
+import migrations
+import chat_context
+
+# Benchmark: latência por mensagem do chat (contexto + gravação das 2 mensagens,
+# sem o modelo) em função do tamanho da sessão.
+#   antigo -> LIMIT 3 análises + sessão inteira ORDER BY id ASC + [-10:] + COUNT(*)
+#   novo   -> chat_context (ring buffer por sessão, validado pelo último id)
+# Uso: python bench_chat_context.py [mensagens por sessão ...]   (por omissão 10 1000 10000 100000)
+
+EMAIL = "tecnico@fabrica.pt"
+MESSAGES_PER_RUN = 200
+INSERT_SQL = "INSERT INTO chat_messages (user_email, role, content, timestamp, session_id) VALUES (?, ?, ?, ?, ?)"
+
+
+def populate(conn, sizes):
+    migrations.migrate(conn)
+    conn.executemany(
+        "INSERT INTO historico (user_email, maquina_nome, data_analise, diagnostico, confianca, detalhes_json) VALUES (?, ?, ?, ?, ?, ?)",
+        ((EMAIL, f"Máquina {i}", "2026-01-01 10:00", "Rolamento", "80%", "{}") for i in range(100)))
+    for session_id, size in enumerate(sizes, start=1):
+        conn.executemany(INSERT_SQL, ((EMAIL, random.choice(["user", "assistant"]), f"mensagem {i} " * 8,
+                                       "2026-01-01 10:00:00", session_id) for i in range(size)))
+    conn.commit()
+
+
+async def old_message(session_id):
+    await database.fetchall("SELECT maquina_nome, data_analise, diagnostico, detalhes_json FROM historico WHERE user_email=? ORDER BY id DESC LIMIT 3", (EMAIL,))
+    messages = await database.fetchall("SELECT role, content FROM chat_messages WHERE session_id=? ORDER BY id ASC", (session_id,))
+    recent = messages[-10:]
+    "".join(f"{role}: {content}\n" for role, content in recent)
+    await database.fetchone("SELECT COUNT(*) FROM chat_messages WHERE session_id=?", (session_id,))
+    await database.execute(INSERT_SQL, (EMAIL, "user", "pergunta", "2026-01-02 10:00:00", session_id))
+    await database.execute(INSERT_SQL, (EMAIL, "assistant", "resposta", "2026-01-02 10:00:00", session_id))
+
+
+async def new_message(session_id):
+    _, session = await chat_context.get(EMAIL, session_id)
+    session.memory_str()
+    c = await database.execute(INSERT_SQL, (EMAIL, "user", "pergunta", "2026-01-02 10:00:00", session_id))
+    chat_context.record(session_id, c.lastrowid, "user", "pergunta")
+    c = await database.execute(INSERT_SQL, (EMAIL, "assistant", "resposta", "2026-01-02 10:00:00", session_id))
+    chat_context.record(session_id, c.lastrowid, "assistant", "resposta")
+
+
+async def measure(send, session_id):
+    latencies = []
+    for _ in range(MESSAGES_PER_RUN):
+        t0 = time.perf_counter()
+        await send(session_id)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+async def main(sizes):
+    for session_id, size in enumerate(sizes, start=1):
+        old = await measure(old_message, session_id)
+        new = await measure(new_message, session_id)
+        print(f"  sessão com {size:>7,} mensagens: antigo p50 {old[0]:7.2f}ms p99 {old[1]:7.2f}ms"
+              f"  ->  novo p50 {new[0]:5.2f}ms p99 {new[1]:5.2f}ms")
+    print(f"  cache: {chat_context.stats}")
+
+
+if __name__ == "__main__":
+    random.seed(5)
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 1_000, 10_000, 100_000]
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "bench.db")
+        conn = database.connect()
+        populate(conn, sizes)
+        conn.close()
+        print(f"{MESSAGES_PER_RUN} mensagens por sessão (contexto + 2 INSERTs)")
+        asyncio.run(main(sizes))
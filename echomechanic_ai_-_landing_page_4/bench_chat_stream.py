@@ -0,0 +1,138 @@
+import os
+import sys
+import time
+import socket
+import sqlite3
+import tempfile
+import threading
+
+import httpx
+import uvicorn
+
+# Benchmark do chat da Samantha: tempo até ao primeiro byte de texto (TTFB) e
+# tempo total, com um modelo falso que gera TOKENS pedaços com TOKEN_DELAY entre eles.
+#   antigo -> POST /api/chat/send   (o texto só chega quando o modelo acaba)
+#   novo   -> POST /api/chat/stream (SSE, um event: token por pedaço)
+# No fim verifica que a resposta ficou gravada e que fechar a ligação a meio
+# cancela a geração e grava o texto parcial.
+# Uso: python bench_chat_stream.py [pedaços] [atraso em ms]   (por omissão 40 50)
+
+TOKENS = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+TOKEN_DELAY = (float(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000
+RUNS = 5
+EMAIL = "tecnico@fabrica.pt"
+
+tmp = tempfile.mkdtemp()
+os.environ["ECHO_DB_PATH"] = os.path.join(tmp, "bench.db")
+os.environ["ECHO_MODEL_BACKEND"] = "stub"
+
+import main
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponse:
+    def __init__(self, chunks):
+        self.text = "".join(chunk.text for chunk in chunks)
+
+
+class FakeStreamingModel:
+    produced = 0
+
+    def _chunks(self):
+        for i in range(TOKENS):
+            time.sleep(TOKEN_DELAY)
+            FakeStreamingModel.produced += 1
+            yield FakeChunk(f"palavra{i} ")
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        if stream:
+            return self._chunks()
+        return FakeResponse(list(self._chunks()))
+
+
+def start_server():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def new_session(client):
+    return client.post("/api/chat/sessions", json={"email": EMAIL, "title": "Bench"}).json()["id"]
+
+
+def measure_send(client, session_id):
+    t0 = time.perf_counter()
+    r = client.post("/api/chat/send", json={"message": "Olá", "email": EMAIL, "session_id": session_id})
+    elapsed = time.perf_counter() - t0
+    assert r.json()["content"].startswith("palavra0")
+    return elapsed, elapsed
+
+
+def measure_stream(client, session_id):
+    t0 = time.perf_counter()
+    first = None
+    with client.stream("POST", "/api/chat/stream", json={"message": "Olá", "email": EMAIL, "session_id": session_id}) as r:
+        for line in r.iter_lines():
+            if first is None and line == "event: token":
+                first = time.perf_counter() - t0
+    return first, time.perf_counter() - t0
+
+
+def assistant_messages(session_id):
+    conn = sqlite3.connect(os.environ["ECHO_DB_PATH"])
+    try:
+        return [row[0] for row in conn.execute(
+            "SELECT content FROM chat_messages WHERE session_id=? AND role='assistant' ORDER BY id", (session_id,))]
+    finally:
+        conn.close()
+
+
+def check_disconnect(client):
+    session_id = new_session(client)
+    FakeStreamingModel.produced = 0
+    with client.stream("POST", "/api/chat/stream", json={"message": "Olá", "email": EMAIL, "session_id": session_id}) as r:
+        tokens = 0
+        for line in r.iter_lines():
+            if line == "event: token":
+                tokens += 1
+                if tokens == 3:
+                    break
+    time.sleep(TOKEN_DELAY * 10 + 0.5)
+    saved = assistant_messages(session_id)
+    print(f"  desligado ao 3º pedaço: o modelo gerou {FakeStreamingModel.produced}/{TOKENS} pedaços,"
+          f" gravado: {saved[0][:40]!r}..." if saved else "  desligado ao 3º pedaço: nada gravado")
+    assert FakeStreamingModel.produced < TOKENS, "a geração não foi cancelada"
+    assert saved and saved[0].startswith("palavra0 palavra1 palavra2"), "resposta parcial não gravada"
+
+
+def main_bench():
+    main.model = FakeStreamingModel()
+    server, base_url = start_server()
+    try:
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            print(f"{TOKENS} pedaços, {TOKEN_DELAY * 1000:.0f}ms entre pedaços, {RUNS} pedidos")
+            for name, measure in (("antigo /api/chat/send", measure_send), ("novo /api/chat/stream", measure_stream)):
+                session_id = new_session(client)
+                results = [measure(client, session_id) for _ in range(RUNS)]
+                ttfb = sorted(r[0] for r in results)[RUNS // 2] * 1000
+                total = sorted(r[1] for r in results)[RUNS // 2] * 1000
+                print(f"  {name:<24} TTFB p50 {ttfb:8.1f}ms  total p50 {total:8.1f}ms")
+                saved = assistant_messages(session_id)
+                assert len(saved) == RUNS and all(s.startswith("palavra0") for s in saved)
+            check_disconnect(client)
+            print(f"  métricas: {client.get('/api/chat/stats').json()}")
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+
+import database
+import migrations
+import machine_trends
+import dashboard_summary
+import bench_trends
+
+# Benchmark do resumo do dashboard (mesmos dados do bench_trends: N análises,
+# 200 utilizadores x 5 máquinas).
+#   antes -> todas as análises do utilizador (o que o /api/history devolve) e
+#            contagens/custos calculados a partir do texto, em Python
+#   depois -> /api/dashboard/summary: uma linha do user_summary + 30 dias
+# Mede também o custo de manter os agregados em cada INSERT e o verificador.
+# Uso: python bench_dashboard.py [análises]
+
+REPEATS = 20
+INSERTS = 2000
+INSERT_SQL = ("INSERT INTO historico (user_email, maquina_nome, data_analise, diagnostico, confianca, detalhes_json, audio_path, features_json) "
+              "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+
+
+def old_summary(conn, email):
+    rows = conn.execute("SELECT maquina_nome, data_analise, diagnostico, confianca, detalhes_json FROM historico "
+                        "WHERE user_email=? ORDER BY id", (email,)).fetchall()
+    latest = {}
+    per_day = {}
+    for machine, data_analise, diagnostico, confianca, detalhes_json in rows:
+        latest[machine] = (diagnostico, confianca, json.loads(detalhes_json).get("estimated_cost"))
+        per_day[data_analise[:10]] = per_day.get(data_analise[:10], 0) + 1
+    exposure = 0.0
+    for diagnostico, confianca, cost in latest.values():
+        if dashboard_summary.is_fault(machine_trends.fault_class(diagnostico)):
+            exposure += machine_trends.parse_cost(cost)[1] or 0.0
+    return len(rows), len(latest), exposure, per_day
+
+
+def timed(func, *args):
+    t0 = time.perf_counter()
+    for _ in range(REPEATS):
+        func(*args)
+    return (time.perf_counter() - t0) / REPEATS * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    random.seed(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "bench.db")
+        conn = database.connect()
+        bench_trends.populate(conn, count)
+        t0 = time.perf_counter()
+        migrations.migrate(conn, target=10)
+        with conn:
+            machine_trends.backfill(conn)
+            dashboard_summary.rebuild(conn)
+        print(f"{count:,} análises, {count // bench_trends.USERS:,} por utilizador (migrações 009-010 em {time.perf_counter() - t0:.1f}s)")
+
+        email = "user7@fabrica.pt"
+        print(f"  antes  (historico + parse em Python): {timed(old_summary, conn, email):8.2f}ms")
+        print(f"  depois (user_summary + 30 dias):      {timed(dashboard_summary._summary, conn, email, 30):8.2f}ms")
+
+        rows = [(f"user{random.randrange(bench_trends.USERS)}@fabrica.pt", f"Máquina {random.randrange(5)}", "2026-10-01 10:00",
+                 "Desgaste do Rolamento", "90%", json.dumps({"estimated_cost": "100€ - 300€"}), None, None) for _ in range(INSERTS)]
+        t0 = time.perf_counter()
+        for row in rows:
+            with conn:
+                conn.execute(INSERT_SQL, row)
+        plain = (time.perf_counter() - t0) / INSERTS * 1000
+        t0 = time.perf_counter()
+        for row in rows:
+            with conn:
+                # O mesmo que o _insert_historico_rows do main.py
+                ids = [conn.execute(INSERT_SQL, row).lastrowid]
+                dashboard_summary.apply(conn, machine_trends.record(conn, ids, [row]))
+        full = (time.perf_counter() - t0) / INSERTS * 1000
+        print(f"  INSERT só no historico: {plain:.3f}ms   com machine_metrics + agregados: {full:.3f}ms")
+
+        t0 = time.perf_counter()
+        differences = dashboard_summary.check(conn)
+        print(f"  verificador (todos os utilizadores): {time.perf_counter() - t0:.1f}s, {len(differences)} diferença(s)")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
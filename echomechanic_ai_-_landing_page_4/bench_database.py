@@ -0,0 +1,102 @@
+import os
+import time
+import random
+import asyncio
+import sqlite3
+import tempfile
+
+import database
+
+# Benchmark: mistura de leituras e escritas em historico e chat_messages.
+#   antigo -> sqlite3.connect() por pedido, rollback journal, dentro do event loop
+#   novo   -> database.py (ligação por thread, WAL, pragmas, thread pool)
+
+CONCURRENCY = 32
+OPS = 4000
+WRITE_RATIO = 0.2
+USERS = [f"user{i}@fabrica.pt" for i in range(50)]
+
+
+def create_schema(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE historico (id INTEGER PRIMARY KEY AUTOINCREMENT, user_email TEXT, maquina_nome TEXT, data_analise TEXT, diagnostico TEXT, confianca TEXT, detalhes_json TEXT, audio_path TEXT)")
+    conn.execute("CREATE TABLE chat_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, user_email TEXT, role TEXT, content TEXT, timestamp TEXT, session_id INTEGER)")
+    rows = [(random.choice(USERS), f"Máquina {i % 40}", "2026-01-01 10:00", "Rolamento", "85%", '{"steps": []}', None) for i in range(5000)]
+    conn.executemany("INSERT INTO historico (user_email, maquina_nome, data_analise, diagnostico, confianca, detalhes_json, audio_path) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    msgs = [(random.choice(USERS), "user", "olá", "2026-01-01 10:00:00", i % 200) for i in range(5000)]
+    conn.executemany("INSERT INTO chat_messages (user_email, role, content, timestamp, session_id) VALUES (?, ?, ?, ?, ?)", msgs)
+    conn.commit()
+    conn.close()
+
+
+def pick_op():
+    if random.random() < WRITE_RATIO:
+        if random.random() < 0.5:
+            return ("INSERT INTO historico (user_email, maquina_nome, data_analise, diagnostico, confianca, detalhes_json) VALUES (?, ?, ?, ?, ?, ?)",
+                    (random.choice(USERS), "Bomba", "2026-01-02 10:00", "Normal", "90%", "{}"), True)
+        return ("INSERT INTO chat_messages (user_email, role, content, timestamp, session_id) VALUES (?, ?, ?, ?, ?)",
+                (random.choice(USERS), "assistant", "resposta", "2026-01-02 10:00:00", random.randrange(200)), True)
+    if random.random() < 0.5:
+        return ("SELECT maquina_nome, data_analise, diagnostico FROM historico WHERE user_email=? ORDER BY id DESC LIMIT 3", (random.choice(USERS),), False)
+    return ("SELECT role, content FROM chat_messages WHERE session_id=? ORDER BY id ASC", (random.randrange(200),), False)
+
+
+async def old_style(path):
+    errors = 0
+
+    async def worker(n):
+        nonlocal errors
+        for _ in range(n):
+            sql, params, write = pick_op()
+            try:
+                conn = sqlite3.connect(path)
+                c = conn.cursor()
+                c.execute(sql, params)
+                if write:
+                    conn.commit()
+                else:
+                    c.fetchall()
+                conn.close()
+            except sqlite3.OperationalError:
+                errors += 1
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*[worker(OPS // CONCURRENCY) for _ in range(CONCURRENCY)])
+    return errors
+
+
+async def new_style(path):
+    database.DB_PATH = path
+    errors = 0
+
+    async def worker(n):
+        nonlocal errors
+        for _ in range(n):
+            sql, params, write = pick_op()
+            try:
+                if write:
+                    await database.execute(sql, params)
+                else:
+                    await database.fetchall(sql, params)
+            except sqlite3.OperationalError:
+                errors += 1
+
+    await asyncio.gather(*[worker(OPS // CONCURRENCY) for _ in range(CONCURRENCY)])
+    return errors
+
+
+def bench(label, coro_fn):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        create_schema(path)
+        t0 = time.perf_counter()
+        errors = asyncio.run(coro_fn(path))
+        elapsed = time.perf_counter() - t0
+        print(f"{label:>24}: {OPS / elapsed:9.0f} ops/s  ({elapsed:.2f}s, erros={errors})")
+
+
+if __name__ == "__main__":
+    random.seed(42)
+    print(f"{OPS} operações, {int(WRITE_RATIO * 100)}% escritas, {CONCURRENCY} clientes concorrentes")
+    bench("connect() por pedido", old_style)
+    bench("database.py (WAL+pool)", new_style)
@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+
+import database
+import migrations
+import embeddings
+import chat_context
+import bench_search
+
+# Benchmark do índice de embeddings (embeddings.py) com o embedder stub:
+# historico com N análises (por omissão 200k, 40 utilizadores = 5000 por conta,
+# textos do bench_search).
+#   - backfill: análises/s do embed_pending e tamanho do ficheiro float16;
+#   - pesquisa: p50/p95 do _nearest (força bruta sobre as linhas do utilizador),
+#     com a matriz da conta fora e dentro da cache;
+#   - contexto do chat: related_context (pesquisa de texto + embeddings + fusão)
+#     e tokens do bloco, contra as mesmas análises com o texto completo.
+# Uso: python bench_embeddings.py [análises]
+
+USERS = 40
+REPEATS = 50
+MESSAGES = ["O compressor voltou a fazer ruído, será do rolamento?", "Há cavitação na bomba outra vez",
+            "falta de lubrificação nas engrenagens", "a correia da polia está a escorregar"]
+
+
+def percentiles(times):
+    times.sort()
+    return times[len(times) // 2], times[int(len(times) * 0.95)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    random.seed(7)
+    bench_search.USERS = USERS
+    # Sem rede: o Gemini mediria a API, não o índice
+    embeddings.EMBEDDING_BACKEND = "stub"
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "bench.db")
+        embeddings.EMBEDDINGS_DIR = os.path.join(tmp, "embeddings")
+        conn = database.connect()
+        bench_search.populate(conn, count)
+        migrations.migrate(conn)
+
+        t0 = time.perf_counter()
+        done = embeddings.embed_pending(conn)
+        elapsed = time.perf_counter() - t0
+        store = embeddings.vectors()
+        print(f"{count:,} análises, {USERS} utilizadores ({embeddings.embedder().model})")
+        print(f"  backfill: {done:,} em {elapsed:.1f}s ({done / elapsed:,.0f}/s), "
+              f"ficheiro {os.path.getsize(store.path) / 1e6:.1f} MB ({store.rows():,} x {store.dim} float16)")
+
+        model = embeddings.embedder()
+        # frio: a matriz float32 da conta é lida do ficheiro e convertida;
+        # quente: segunda pergunta da mesma conta (conversa), matriz em cache
+        for label, clear in (("frio", True), ("quente", False)):
+            times = []
+            for i in range(REPEATS):
+                query = model.embed([MESSAGES[i % len(MESSAGES)]], True)[0]
+                email = f"user{i % USERS}@fabrica.pt"
+                if clear:
+                    embeddings._matrices.clear()
+                else:
+                    embeddings._nearest(conn, email, query, embeddings.NEAREST_DEFAULT, set())
+                t0 = time.perf_counter()
+                embeddings._nearest(conn, email, query, embeddings.NEAREST_DEFAULT, set())
+                times.append((time.perf_counter() - t0) * 1000)
+            p50, p95 = percentiles(times)
+            print(f"  _nearest {label:>6} ({count // USERS:,} vetores por conta): p50 {p50:6.2f}ms  p95 {p95:6.2f}ms")
+
+        async def context():
+            times, tokens, full = [], [], []
+            for i in range(REPEATS):
+                email = f"user{random.randrange(USERS)}@fabrica.pt"
+                t0 = time.perf_counter()
+                text = await chat_context.related_context(email, MESSAGES[i % len(MESSAGES)], [])
+                times.append((time.perf_counter() - t0) * 1000)
+                tokens.append(chat_context.estimate_tokens(text))
+                # As mesmas candidatas com o texto todo (sem orçamento nem cortes)
+                ids = [row[0] for row in await embeddings.nearest(email, MESSAGES[i % len(MESSAGES)], chat_context.RELATED_CANDIDATES)]
+                rows = await database.fetchall(
+                    f"SELECT maquina_nome, diagnostico, detalhes_json FROM historico WHERE id IN ({', '.join('?' * len(ids))})", ids)
+                full.append(sum(chat_context.estimate_tokens(" ".join(str(v) for v in row)) for row in rows))
+            return times, tokens, full
+
+        times, tokens, full = asyncio.run(context())
+        p50, p95 = percentiles(times)
+        print(f"  related_context (texto + embeddings + fusão): p50 {p50:6.2f}ms  p95 {p95:6.2f}ms")
+        print(f"  tokens do bloco: média {sum(tokens) / len(tokens):.0f} (máx {max(tokens)}, orçamento {chat_context.RELATED_TOKENS}); "
+              f"as {chat_context.RELATED_CANDIDATES} candidatas completas: {sum(full) / len(full):.0f}")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
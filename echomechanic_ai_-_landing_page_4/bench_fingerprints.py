@@ -0,0 +1,161 @@
+import os
+import sys
+import time
+import wave
+import random
+import tempfile
+
+import numpy as np
+
+import database
+import migrations
+import audio_fingerprints
+
+# Benchmark das assinaturas de áudio (audio_fingerprints.py):
+#   - arquivo sintético de gravações WAV (famílias de avaria: desequilíbrio,
+#     desalinhamento, rolamento, cavitação, engrenagem, normal), com rotação,
+#     ganho e ruído diferentes em cada uma;
+#   - backfill: gravações/s com 1 processo e com um por CPU;
+#   - qualidade: o vizinho mais próximo (sem a própria) é da mesma família?
+#   - índice: p50/p95 da pesquisa IVF contra a força bruta e recall@10, com
+#     N assinaturas (variações das reais) a crescer 10x de cada vez.
+# Uso: python bench_fingerprints.py [gravações] [N máximo do índice]
+
+SAMPLE_RATE = 22050
+SECONDS = 8
+FAMILIES = ["Funcionamento Normal", "Desequilíbrio do Rotor", "Desalinhamento do Veio", "Desgaste do Rolamento",
+            "Cavitação na Bomba", "Engrenagem com Dentes Partidos"]
+REPEATS = 200
+
+
+def synth(family, rng):
+    t = np.arange(SAMPLE_RATE * SECONDS) / SAMPLE_RATE
+    shaft = rng.uniform(20, 30)
+    x = rng.normal(0, 0.02, len(t))
+    x += 0.05 * np.sin(2 * np.pi * shaft * t) + 0.02 * np.sin(2 * np.pi * 2 * shaft * t)
+    if family == "Desequilíbrio do Rotor":
+        x += 0.4 * np.sin(2 * np.pi * shaft * t + rng.uniform(0, 6))
+    elif family == "Desalinhamento do Veio":
+        x += 0.3 * np.sin(2 * np.pi * 2 * shaft * t) + 0.15 * np.sin(2 * np.pi * 3 * shaft * t)
+    elif family == "Desgaste do Rolamento":
+        # Impactos à BPFO a excitar uma ressonância
+        bpfo = 3.6 * shaft
+        impulses = np.zeros(len(t))
+        impulses[(np.arange(0, SECONDS, 1 / bpfo) * SAMPLE_RATE).astype(int)] = 1.0
+        ringing = np.exp(-np.arange(200) / 30) * np.sin(2 * np.pi * rng.uniform(3000, 4000) * np.arange(200) / SAMPLE_RATE)
+        x += 0.8 * np.convolve(impulses, ringing)[:len(t)]
+    elif family == "Cavitação na Bomba":
+        noise = np.fft.irfft(np.fft.rfft(rng.normal(0, 1, len(t))) * (np.fft.rfftfreq(len(t), 1 / SAMPLE_RATE) > 2000))
+        x += 0.15 * noise * (1 + (rng.random(len(t) // 2205 + 1) > 0.7).repeat(2205)[:len(t)])
+    elif family == "Engrenagem com Dentes Partidos":
+        mesh = 23 * shaft
+        x += 0.2 * np.sin(2 * np.pi * mesh * t) * (1 + 0.8 * np.sin(2 * np.pi * shaft * t))
+    x *= rng.uniform(0.3, 1.5) / max(np.abs(x).max(), 1e-9) * 0.5
+    return x
+
+
+def write_wav(path, samples):
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes((np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes())
+
+
+def populate(conn, count, rng):
+    # Gravações em assets/audio_history da pasta atual, como no arquivo real
+    for number, _, apply in migrations.MIGRATIONS:
+        if number < 13:
+            apply(conn)
+    conn.execute("PRAGMA user_version = 12")
+    os.makedirs(os.path.join("assets", "audio_history"))
+    rows = []
+    for i in range(count):
+        family = FAMILIES[i % len(FAMILIES)]
+        write_wav(os.path.join("assets", "audio_history", f"rec{i}.wav"), synth(family, rng))
+        rows.append((f"user{i % 10}@fabrica.pt", f"Máquina {i}", "2026-05-01 10:00", family, "85%", "{}",
+                     f"../assets/audio_history/rec{i}.wav"))
+    conn.executemany("INSERT INTO historico (user_email, maquina_nome, data_analise, diagnostico, confianca, detalhes_json, audio_path) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    migrations.migrate(conn)
+
+
+def percentiles(times):
+    times.sort()
+    return times[len(times) // 2], times[int(len(times) * 0.95)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 120
+    largest = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+    rng = np.random.default_rng(7)
+    random.seed(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        database.DB_PATH = "bench.db"
+        conn = database.connect()
+        populate(conn, count, rng)
+        print(f"{count} gravações WAV de {SECONDS}s, {os.cpu_count()} CPU(s)")
+
+        for workers in sorted({1, audio_fingerprints.BACKFILL_WORKERS}):
+            conn.execute("DELETE FROM audio_fingerprints")
+            conn.commit()
+            t0 = time.perf_counter()
+            done, _ = audio_fingerprints.backfill(conn, workers)
+            elapsed = time.perf_counter() - t0
+            print(f"  backfill com {workers} processo(s): {done} em {elapsed:.1f}s ({done / elapsed:.1f}/s, "
+                  f"{done * SECONDS / elapsed:.0f}s de áudio por segundo)")
+
+        # Vizinho mais próximo de cada gravação, sem ela própria
+        rows, paths = zip(*conn.execute("SELECT row, audio_path FROM audio_fingerprints ORDER BY row"))
+        rows = np.array(rows)
+        labels = dict(conn.execute("SELECT audio_path, diagnostico FROM historico"))
+        matrix = audio_fingerprints._matrix(rows)
+        scores = matrix @ matrix.T
+        np.fill_diagonal(scores, -np.inf)
+        hits = sum(labels[paths[i]] == labels[paths[j]] for i, j in enumerate(np.argmax(scores, axis=1)))
+        print(f"  vizinho mais próximo da mesma família: {hits}/{len(rows)} ({hits / len(rows):.0%}, acaso {1 / len(FAMILIES):.0%})")
+
+        # Índice: variações das assinaturas reais até N
+        size = len(rows)
+        target = 10_000
+        while target <= largest:
+            extra = target - size
+            base = matrix[rng.integers(0, len(matrix), extra)]
+            noisy = base + rng.normal(0, 0.05, base.shape).astype(np.float32)
+            noisy /= np.linalg.norm(noisy, axis=1, keepdims=True)
+            for i in range(0, extra, 100_000):
+                audio_fingerprints._add(conn, [(f"sintetico/{size + i + j}", v) for j, v in enumerate(noisy[i:i + 100_000])])
+            conn.commit()
+            size = target
+            t0 = time.perf_counter()
+            cells = audio_fingerprints.build_index(conn)
+            train = time.perf_counter() - t0
+
+            everything = np.array([r[0] for r in conn.execute("SELECT row FROM audio_fingerprints")])
+            ivf, brute, recall, scanned, lost = [], [], [], [], []
+            for _ in range(REPEATS):
+                query = matrix[rng.integers(0, len(matrix))] + rng.normal(0, 0.05, matrix.shape[1]).astype(np.float32)
+                query /= np.linalg.norm(query)
+                t0 = time.perf_counter()
+                found, n = audio_fingerprints._nearest(conn, query, 10)
+                ivf.append((time.perf_counter() - t0) * 1000)
+                scanned.append(n)
+                t0 = time.perf_counter()
+                exact = everything[np.argsort(-(audio_fingerprints._matrix(everything) @ query))[:10]]
+                brute.append((time.perf_counter() - t0) * 1000)
+                recall.append(len({r for r, _ in found} & set(exact.tolist())) / 10)
+                # Com centenas de variações quase iguais de cada gravação, o top-10 exato
+                # é decidido pelo ruído: conta também a semelhança média perdida
+                lost.append(1 - np.mean([s for _, s in found]) / np.mean(audio_fingerprints._matrix(exact) @ query))
+            p50, p95 = percentiles(ivf)
+            b50, _ = percentiles(brute)
+            print(f"  N={size:>9,}: treino {train:5.1f}s ({cells} células)  IVF p50 {p50:6.2f}ms  p95 {p95:6.2f}ms  "
+                  f"({np.mean(scanned):,.0f} lidas)  força bruta p50 {b50:7.2f}ms  recall@10 {np.mean(recall):.2f} "
+                  f"(semelhança -{np.mean(lost):.2%})")
+            target *= 10
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import random
+import tempfile
+
+import database
+import migrations
+
+# Benchmark: latência das queries de /api/history, /api/activity, /api/machines
+# e da memória do chat, antes e depois da migração 002 (índices compostos).
+# Uso: python bench_indexes.py [linhas ...]   (por omissão 10k, 1M e 10M)
+
+USERS = 2000
+SESSIONS = 20000
+REPEATS = 50
+
+QUERIES = {
+    "/api/history": ("SELECT * FROM historico WHERE user_email=? ORDER BY id DESC LIMIT 50", lambda: (random_user(),)),
+    "/api/activity": ("SELECT maquina_nome, diagnostico, data_analise FROM historico WHERE user_email=? AND data_analise >= ? ORDER BY data_analise DESC",
+                      lambda: (random_user(), "2026-06-01 00:00")),
+    "/api/machines": ("SELECT * FROM maquinas WHERE user_email=?", lambda: (random_user(),)),
+    "chat (session_id)": ("SELECT role, content FROM chat_messages WHERE session_id=? ORDER BY id DESC LIMIT 10", lambda: (random.randrange(SESSIONS),)),
+}
+
+
+def random_user():
+    return f"user{random.randrange(USERS)}@fabrica.pt"
+
+
+def populate(conn, rows):
+    migrations._001_base_schema(conn)
+    batch = 100000
+    for start in range(0, rows, batch):
+        n = min(batch, rows - start)
+        conn.executemany(
+            "INSERT INTO historico (user_email, maquina_nome, data_analise, diagnostico, confianca, detalhes_json) VALUES (?, ?, ?, ?, ?, ?)",
+            ((random_user(), f"Máquina {random.randrange(50)}",
+              f"2026-{random.randint(1, 12):02d}-{random.randint(1, 28):02d} 10:00", "Rolamento", "80%", "{}") for _ in range(n)))
+        conn.executemany(
+            "INSERT INTO chat_messages (user_email, role, content, timestamp, session_id) VALUES (?, ?, ?, ?, ?)",
+            ((random_user(), "user", "mensagem", "2026-01-01 10:00:00", random.randrange(SESSIONS)) for _ in range(n)))
+    conn.executemany("INSERT INTO maquinas (user_email, nome) VALUES (?, ?)",
+                     ((random_user(), f"Máquina {i}") for i in range(max(1000, rows // 100))))
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+
+
+def measure(conn):
+    results = {}
+    for label, (sql, params) in QUERIES.items():
+        t0 = time.perf_counter()
+        for _ in range(REPEATS):
+            conn.execute(sql, params()).fetchall()
+        results[label] = (time.perf_counter() - t0) / REPEATS * 1000
+    return results
+
+
+def run(rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = database.connect(os.path.join(tmp, "bench.db"))
+        t0 = time.perf_counter()
+        populate(conn, rows)
+        print(f"\n{rows:,} linhas (carga em {time.perf_counter() - t0:.1f}s)")
+        before = measure(conn)
+        t0 = time.perf_counter()
+        migrations.migrate(conn, target=2)
+        print(f"  migração 002 em {time.perf_counter() - t0:.2f}s")
+        after = measure(conn)
+        for label in QUERIES:
+            print(f"  {label:>18}: {before[label]:9.3f}ms -> {after[label]:7.3f}ms")
+        conn.close()
+
+
+if __name__ == "__main__":
+    random.seed(7)
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 1_000_000, 10_000_000]
+    for size in sizes:
+        run(size)
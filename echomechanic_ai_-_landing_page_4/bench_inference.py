@@ -0,0 +1,96 @@
+import time
+import socket
+import asyncio
+import threading
+import statistics
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+import inference
+
+# Benchmark: 60 uploads concorrentes para um modelo falso lento (bloqueante, como o SDK)
+# enquanto medimos a latência de um endpoint leve (tipo /api/history).
+# Compara a chamada direta (antiga) com a camada inference.py (nova).
+
+CONCURRENT_UPLOADS = 60
+PINGS = 200
+FAKE_MODEL_LATENCY = 0.25
+
+
+class FakeModel:
+    def generate_content(self, *args, **kwargs):
+        time.sleep(FAKE_MODEL_LATENCY)  # simula a ida e volta ao Gemini
+        return '{"diagnosis": "Normal"}'
+
+
+def build_app(use_inference_layer):
+    app = FastAPI()
+    model = FakeModel()
+
+    @app.post("/api/analyze")
+    async def analyze():
+        if use_inference_layer:
+            text = await inference.generate_content(model, "prompt")
+        else:
+            text = model.generate_content("prompt")
+        return {"raw": text}
+
+    @app.get("/api/history")
+    async def history():
+        return []
+
+    return app
+
+
+def p(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def start_server(app):
+    # Servidor uvicorn real numa thread, para o cliente não partilhar o event loop da app
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+async def run(use_inference_layer):
+    server, thread, base_url = start_server(build_app(use_inference_layer))
+    limits = httpx.Limits(max_connections=CONCURRENT_UPLOADS + 10)
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as client:
+        latencies = []
+
+        async def ping():
+            for _ in range(PINGS):
+                t0 = time.perf_counter()
+                await client.get("/api/history")
+                latencies.append((time.perf_counter() - t0) * 1000)
+                await asyncio.sleep(0.005)
+
+        t0 = time.perf_counter()
+        uploads = [client.post("/api/analyze") for _ in range(CONCURRENT_UPLOADS)]
+        await asyncio.gather(ping(), *uploads)
+        total = time.perf_counter() - t0
+
+    server.should_exit = True
+    thread.join()
+    label = "inference.py" if use_inference_layer else "chamada direta"
+    print(f"{label:>16}: p50={statistics.median(latencies):8.2f}ms  "
+          f"p99={p(latencies, 99):8.2f}ms  max={max(latencies):8.2f}ms  total={total:.2f}s")
+
+
+if __name__ == "__main__":
+    print(f"{CONCURRENT_UPLOADS} uploads concorrentes, modelo falso de {FAKE_MODEL_LATENCY * 1000:.0f}ms, "
+          f"concorrência máx. IA = {inference.MODEL_MAX_CONCURRENCY}")
+    asyncio.run(run(False))
+    asyncio.run(run(True))
+    inference.shutdown()
@@ -0,0 +1,103 @@
+import time
+import asyncio
+
+import inference
+import model_client
+import model_scheduler
+
+# Benchmark do scheduler do modelo contra o stub local (sem rede nem quota real).
+#  1. 429s injetados: 30% dos pedidos ao acaso e o primeiro modelo da cadeia
+#     esgotado. Sem scheduler (uma só tentativa) vs com retries + fallback.
+#  2. Prioridades: uma rajada de análises em background e depois 5 mensagens de
+#     chat, com quota de 4 pedidos/s. Tempo de espera do chat com e sem prioridade.
+# Uso: python bench_model_scheduler.py
+
+REQUESTS = 200
+BACKGROUND_REQUESTS = 30
+CHAT_REQUESTS = 5
+
+# Backoff curto para o benchmark não demorar (a forma da curva é a mesma)
+model_scheduler.BACKOFF_BASE_SECONDS = 0.005
+model_scheduler.BACKOFF_MAX_SECONDS = 0.05
+
+
+def flaky_backend():
+    return model_client.StubBackend(fixtures_path=None, error_rate=0.3, exhausted=["stub-lite"], seed=1)
+
+
+async def run_requests(client, count):
+    ok = 0
+    latencies = []
+
+    async def one(i):
+        nonlocal ok
+        t0 = time.perf_counter()
+        try:
+            await inference.generate_content(client, f"pergunta {i}")
+            ok += 1
+        except Exception:
+            pass
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    await asyncio.gather(*(one(i) for i in range(count)))
+    latencies.sort()
+    return ok, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+class SingleAttempt:
+    # Como era antes: um pedido ao modelo escolhido, sem retries nem fallback
+    def __init__(self, backend):
+        self.backend = backend
+
+    def generate_content(self, contents, **kwargs):
+        return self.backend.generate_content(self.backend.model_name, contents, **kwargs)
+
+
+async def bench_retries():
+    print(f"1. {REQUESTS} pedidos, 30% de 429 ao acaso, 'stub-lite' esgotado")
+    ok, p50, p99 = await run_requests(SingleAttempt(flaky_backend()), REQUESTS)
+    print(f"  sem scheduler: {ok}/{REQUESTS} respondidos  p50 {p50:6.1f}ms  p99 {p99:6.1f}ms")
+
+    backend = flaky_backend()
+    client = model_client.ModelClient(backend, model_scheduler.Scheduler(backend.key_id, 0, 0))
+    before = dict(model_scheduler.stats)
+    ok, p50, p99 = await run_requests(client, REQUESTS)
+    delta = {k: round(model_scheduler.stats[k] - before[k], 1) for k in ("retries", "failovers", "cooldowns", "gave_up")}
+    print(f"  com scheduler: {ok}/{REQUESTS} respondidos  p50 {p50:6.1f}ms  p99 {p99:6.1f}ms  {delta}")
+    print(f"  pedidos por modelo: {backend.calls}  cooldowns: {client.scheduler.snapshot()['cooling_down']}")
+
+
+async def bench_priorities(use_priorities):
+    backend = model_client.StubBackend(fixtures_path=None, models=["stub-flash"])
+    scheduler = model_scheduler.Scheduler(backend.key_id, model_rpm=0, key_rpm=240)
+    scheduler.key_bucket = model_scheduler.TokenBucket(240, burst=2)
+    client = model_client.ModelClient(backend, scheduler)
+    waits = {"background": [], "chat": []}
+
+    async def call(kind, priority):
+        t0 = time.perf_counter()
+        await inference.generate_content(client, kind, priority=priority)
+        waits[kind].append(time.perf_counter() - t0)
+
+    background_priority = inference.PRIORITY_BACKGROUND if use_priorities else inference.PRIORITY_ANALYSIS
+    chat_priority = inference.PRIORITY_CHAT if use_priorities else inference.PRIORITY_ANALYSIS
+    tasks = [asyncio.create_task(call("background", background_priority)) for _ in range(BACKGROUND_REQUESTS)]
+    await asyncio.sleep(0.3)
+    tasks += [asyncio.create_task(call("chat", chat_priority)) for _ in range(CHAT_REQUESTS)]
+    await asyncio.gather(*tasks)
+    chat = sum(waits["chat"]) / len(waits["chat"])
+    background = sum(waits["background"]) / len(waits["background"])
+    return chat, background
+
+
+async def main():
+    await bench_retries()
+    print(f"2. {BACKGROUND_REQUESTS} análises em background + {CHAT_REQUESTS} mensagens de chat, quota 4 pedidos/s")
+    for use_priorities in (False, True):
+        chat, background = await bench_priorities(use_priorities)
+        name = "com prioridades" if use_priorities else "sem prioridades"
+        print(f"  {name}: espera média do chat {chat:5.2f}s  background {background:5.2f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
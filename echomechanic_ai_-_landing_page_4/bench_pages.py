@@ -0,0 +1,83 @@
+import sys
+import time
+import asyncio
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse
+
+import pages
+
+# Benchmark da rota /dashboard: pedidos/s e bytes servidos.
+#   antigo -> open() + read() do HTML a cada pedido, sem compressão nem ETag
+#   novo   -> pages.serve (memória, gzip/brotli pré-comprimidos, 304 com If-None-Match)
+#   python bench_pages.py [ficheiro.html]   (por omissão dashboard.html;
+#   para a versão com o logo em base64: git show <commit>:.../dashboard.html > /tmp/d.html)
+
+REQUESTS = 2000
+CONCURRENCY = 16
+
+
+def build_apps(filename):
+    old = FastAPI()
+
+    @old.get("/dashboard", response_class=HTMLResponse)
+    async def read_dashboard_old():
+        try:
+            with open(filename, "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return f"Erro: {filename} nao encontrado"
+
+    new = FastAPI()
+
+    @new.get("/dashboard", response_class=HTMLResponse)
+    async def read_dashboard_new(request: Request):
+        return pages.serve(request, filename)
+
+    return old, new
+
+
+async def run(app, headers):
+    transport = httpx.ASGITransport(app=app)
+    sent = 0
+    statuses = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        queue = asyncio.Queue()
+        for _ in range(REQUESTS):
+            queue.put_nowait(None)
+
+        async def worker():
+            nonlocal sent
+            while not queue.empty():
+                queue.get_nowait()
+                # stream para contar os bytes no fio (antes da descompressão)
+                async with client.stream("GET", "/dashboard", headers=headers) as r:
+                    async for chunk in r.aiter_raw():
+                        sent += len(chunk)
+                    statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+        elapsed = time.perf_counter() - t0
+    return REQUESTS / elapsed, sent / REQUESTS, statuses
+
+
+async def main(filename):
+    old, new = build_apps(filename)
+    etag = pages.get(filename).etag("br" if "br" in pages.get(filename).variants else "gzip")
+    scenarios = [
+        ("antigo (sem compressão)", old, {"accept-encoding": "gzip, br"}),
+        ("novo, identity", new, {"accept-encoding": "identity"}),
+        ("novo, gzip", new, {"accept-encoding": "gzip"}),
+        ("novo, br", new, {"accept-encoding": "gzip, br"}),
+        ("novo, revalidação (304)", new, {"accept-encoding": "gzip, br", "if-none-match": etag}),
+    ]
+    print(f"{filename}: {REQUESTS} pedidos, {CONCURRENCY} em paralelo")
+    for name, app, headers in scenarios:
+        rps, per_request, statuses = await run(app, headers)
+        print(f"  {name:<26} {rps:>8.0f} pedidos/s  {per_request / 1024:>9.1f} KB/pedido  {statuses}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "dashboard.html"))
@@ -0,0 +1,146 @@
+import os
+import sys
+import time
+import wave
+import tempfile
+
+import numpy as np
+
+import audio_dsp
+
+# Benchmark da pré-triagem: que fração das chamadas ao modelo é evitada num
+# conjunto etiquetado, e quantas gravações válidas seriam rejeitadas por engano.
+#   python bench_prescreen.py            -> conjunto sintético (gerado aqui)
+#   python bench_prescreen.py <pasta>    -> <pasta>/invalid/* e <pasta>/valid/*
+
+SR = 44100
+SECONDS = 10
+PER_CLASS = 10
+rng = np.random.default_rng(3)
+
+
+def t_axis():
+    return np.arange(SR * SECONDS) / SR
+
+
+def silence():
+    return rng.normal(0, 10 ** (-rng.uniform(65, 80) / 20), SR * SECONDS)
+
+
+def speech():
+    # Trem de impulsos glóticos (f0 com entoação) filtrado por formantes,
+    # modulado por sílabas (~4 Hz) e com pausas entre palavras
+    t = t_axis()
+    f0 = rng.uniform(100, 220) * (1 + 0.1 * np.sin(2 * np.pi * 0.5 * t))
+    phase = np.cumsum(f0) / SR
+    source = (np.diff(np.floor(phase), prepend=0) > 0).astype(float)
+    spectrum = np.fft.rfft(source)
+    freqs = np.fft.rfftfreq(len(source), 1 / SR)
+    envelope = sum(np.exp(-((freqs - f) / bw) ** 2) for f, bw in
+                   [(rng.uniform(500, 800), 120), (rng.uniform(1100, 1800), 150), (rng.uniform(2300, 2900), 200)])
+    voiced = np.fft.irfft(spectrum * envelope, len(source))
+    syllables = np.clip(np.sin(2 * np.pi * rng.uniform(3, 5) * t), 0, None) ** 2
+    words = (np.sin(2 * np.pi * 0.4 * t + rng.uniform(0, 6)) > -0.3).astype(float)
+    x = voiced * syllables * words
+    return 0.3 * x / np.abs(x).max() + rng.normal(0, 0.001, len(t))
+
+
+def machine():
+    # Motor: harmónicos da rotação + ruído largo + impactos de rolamento com ressonância
+    t = t_axis()
+    rpm_hz = rng.uniform(20, 50)
+    x = sum(rng.uniform(0.05, 0.3) / k * np.sin(2 * np.pi * k * rpm_hz * t + rng.uniform(0, 6)) for k in range(1, 8))
+    x += rng.normal(0, rng.uniform(0.02, 0.1), len(t))
+    bpfo = rpm_hz * rng.uniform(3, 5)
+    impacts = np.zeros(len(t))
+    impacts[(np.arange(0, SECONDS, 1 / bpfo) * SR).astype(int)] = rng.uniform(0.2, 0.6)
+    ring = np.exp(-np.arange(400) / 60) * np.sin(2 * np.pi * 3000 * np.arange(400) / SR)
+    x += np.convolve(impacts, ring)[:len(t)]
+    return 0.5 * x / np.abs(x).max()
+
+
+def fan():
+    # Ventilador/bomba: ruído largo filtrado + tom de passagem das pás
+    t = t_axis()
+    noise = np.cumsum(rng.normal(0, 1, len(t)))
+    noise = noise - np.convolve(noise, np.ones(50) / 50, mode="same")
+    x = noise / np.abs(noise).max() + 0.3 * np.sin(2 * np.pi * rng.uniform(80, 400) * t)
+    return 0.4 * x / np.abs(x).max()
+
+
+def knocking():
+    # Batidas na mesa: impulsos esparsos (inválido, mas deixado para o modelo)
+    t = t_axis()
+    x = np.zeros(len(t))
+    for start in rng.uniform(0, SECONDS - 0.1, 12):
+        i = int(start * SR)
+        x[i:i + 2000] += np.exp(-np.arange(2000) / 300) * rng.normal(0, 1, 2000)
+    return 0.8 * x / np.abs(x).max() + rng.normal(0, 0.002, len(t))
+
+
+CLASSES = {"silence": (silence, False), "speech": (speech, False), "knocking": (knocking, False),
+           "machine": (machine, True), "fan": (fan, True)}
+
+
+def write_wav(path, x):
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SR)
+        w.writeframes((np.clip(x, -1, 1) * 32767).astype("<i2").tobytes())
+
+
+def synthetic_set(tmp):
+    samples = []
+    for name, (generator, valid) in CLASSES.items():
+        for i in range(PER_CLASS):
+            path = os.path.join(tmp, f"{name}_{i}.wav")
+            write_wav(path, generator())
+            samples.append((path, name, valid))
+    return samples
+
+
+def folder_set(folder):
+    samples = []
+    for label, valid in (("invalid", False), ("valid", True)):
+        directory = os.path.join(folder, label)
+        for name in sorted(os.listdir(directory)):
+            samples.append((os.path.join(directory, name), label, valid))
+    return samples
+
+
+def run(samples):
+    per_class = {}
+    latencies = []
+    avoided = invalid = false_rejects = valid_total = 0
+    for path, name, valid in samples:
+        t0 = time.perf_counter()
+        result = audio_dsp.prescreen(path)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        rejected = result["verdict"] in ("silence", "speech")
+        per_class.setdefault(name, [0, 0])
+        per_class[name][0] += rejected
+        per_class[name][1] += 1
+        if valid:
+            valid_total += 1
+            false_rejects += rejected
+        else:
+            invalid += 1
+            avoided += rejected
+
+    for name, (rejected, total) in per_class.items():
+        print(f"  {name:>10}: {rejected}/{total} rejeitados localmente")
+    total = len(samples)
+    print(f"\nChamadas ao modelo evitadas: {avoided}/{total} ({avoided / total:.0%} do total, "
+          f"{avoided / max(invalid, 1):.0%} das inválidas)")
+    print(f"Rejeições erradas (válidas): {false_rejects}/{valid_total}")
+    print(f"Latência: média {np.mean(latencies):.1f}ms, p95 {np.percentile(latencies, 95):.1f}ms "
+          f"({SECONDS}s de áudio por ficheiro no conjunto sintético)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run(folder_set(sys.argv[1]))
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            run(synthetic_set(tmp))
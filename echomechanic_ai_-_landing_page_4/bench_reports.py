@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+
+import database
+import migrations
+import reports
+
+# Benchmark da exportação em massa: páginas/s para N análises (por omissão 1000).
+#   antes -> um /api/report/pdf por análise: render_pdf de cada uma, em série
+#   depois -> reports.stream_pdf / stream_zip em série (1) e com o pool de 2 e 4
+#             processos (ECHO_REPORT_WORKERS); o pool só compensa se aqui for mais rápido
+# Também confirma que o PDF combinado tem uma página por análise e que a xref
+# aponta para os objetos certos, e mostra o maior bloco escrito de uma vez na
+# resposta (o que o servidor tem em memória, nunca o documento inteiro).
+# Uso: python bench_reports.py [análises]
+
+EMAIL = "gestor@fabrica.pt"
+DETAILS = json.dumps({
+    "description": "Vibração anómala no rolamento do lado do acoplamento, com harmónicos a 2x a rotação.",
+    "steps": ["Parar a máquina e bloquear", "Verificar folga do rolamento", "Substituir rolamento 6205",
+              "Realinhar o acoplamento", "Registar a vibração após arranque"],
+    "estimated_cost": "250€ - 400€",
+    "repair_time": "3 horas",
+})
+
+
+def populate(conn, count):
+    migrations.migrate(conn)
+    conn.executemany(
+        "INSERT INTO historico (user_email, maquina_nome, data_analise, diagnostico, confianca, detalhes_json) VALUES (?, ?, ?, ?, ?, ?)",
+        ((EMAIL, f"Máquina {i % 40}", f"2026-09-{i % 28 + 1:02d} 10:00", "Rolamento Desgastado", "87%", DETAILS)
+         for i in range(count)))
+    conn.commit()
+
+
+async def consume(stream, keep=False):
+    size = largest = 0
+    chunks = []
+    async for chunk in stream:
+        size += len(chunk)
+        largest = max(largest, len(chunk))
+        if keep:
+            chunks.append(chunk)
+    return size, largest, b"".join(chunks)
+
+
+def check_pdf(data, count):
+    # Cada entrada da xref tem de apontar para "<n> 0 obj"
+    xref = int(data.rsplit(b"startxref\n", 1)[1].split(b"\n")[0])
+    lines = data[xref:].split(b"\n")
+    total = int(lines[1].split()[1])
+    for number in range(1, total):
+        offset = int(lines[2 + number][:10])
+        assert data.startswith(f"{number} 0 obj".encode(), offset), f"xref errada no objeto {number}"
+    assert f"/Count {count}".encode() in data, "número de páginas errado"
+
+
+async def bench(count):
+    export = reports.export_filter(EMAIL)
+
+    rows = await database.fetchall_dicts(f"SELECT {reports.REPORT_COLUMNS} FROM historico ORDER BY id")
+    t0 = time.perf_counter()
+    for row in rows:
+        reports.render_pdf(row)
+    elapsed = time.perf_counter() - t0
+    print(f"  antes  (render_pdf por análise): {count / elapsed:7.1f} páginas/s  ({elapsed:.2f}s)")
+
+    check_pdf((await consume(reports.stream_pdf(export), keep=True))[2], count)
+
+    for workers in sorted({1, 2, 4, reports.EXPORT_WORKERS}):
+        reports.shutdown()
+        reports.EXPORT_WORKERS = workers
+        for name, stream in (("pdf", reports.stream_pdf), ("zip", reports.stream_zip)):
+            t0 = time.perf_counter()
+            size, largest, _ = await consume(stream(export))
+            elapsed = time.perf_counter() - t0
+            print(f"  export {name} ({'série' if workers <= 1 else f'{workers} processos'}):  {count / elapsed:7.1f} páginas/s  ({elapsed:.2f}s, "
+                  f"{size / 1024 / 1024:.1f} MB, maior bloco {largest / 1024:.0f} KB)")
+    reports.shutdown()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "bench.db")
+        conn = database.connect()
+        populate(conn, count)
+        conn.close()
+        print(f"{count} análises, {os.cpu_count()} CPU(s)")
+        asyncio.run(bench(count))
+
+
+if __name__ == "__main__":
+    main()
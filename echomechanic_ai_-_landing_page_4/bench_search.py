@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+
+import database
+import migrations
+import search
+
+# Benchmark da pesquisa FTS5 (search.py) sobre N análises (por omissão 1M) e
+# N/2 mensagens de chat, 200 utilizadores.
+#   antes -> LIKE '%termo%' no historico do utilizador (a alternativa sem índice)
+#   depois -> /api/search (dono AND termos, bm25, excertos), p50/p95 por consulta
+# Mostra também o tempo da migração 011 (backfill) e o custo dos triggers por INSERT.
+# Uso: python bench_search.py [análises]
+
+USERS = 200
+REPEATS = 50
+QUERIES = ["rolamento", "ro", "rolam", "vibração rolamento", "vibracao desalinh", '"desgaste severo"', "cavitação bomba", "xyzzy"]
+
+MACHINES = ["Compressor", "Bomba", "Motor", "Ventilador", "Redutor", "Tapete", "Prensa", "Torno"]
+FAULTS = ["Desgaste do Rolamento", "Desalinhamento do Veio", "Desequilíbrio do Rotor", "Cavitação na Bomba",
+          "Folga Mecânica", "Falha de Lubrificação", "Engrenagem com Dentes Partidos", "Funcionamento Normal"]
+WORDS = ("vibração ruído impacto desgaste severo moderado ligeiro frequência harmónicos rotação temperatura atrito "
+         "lubrificante folga acoplamento eixo chumaceira veio rotor estator carga pressão caudal sucção descarga "
+         "correia polia engrenagem dentes óleo massa ciclo paragem manutenção inspeção substituir verificar").split()
+
+
+def sentence(n):
+    return " ".join(random.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+
+def populate(conn, count):
+    for number, _, apply in migrations.MIGRATIONS:
+        if number < 9:
+            apply(conn)
+    batch = []
+    for i in range(count):
+        details = json.dumps({"description": sentence(25), "steps": [sentence(6) for _ in range(4)]}, ensure_ascii=False)
+        batch.append((f"user{i % USERS}@fabrica.pt", f"{random.choice(MACHINES)} {random.randrange(20)}", "2026-05-01 10:00",
+                      random.choice(FAULTS), "85%", details))
+        if len(batch) == 100_000:
+            conn.executemany("INSERT INTO historico (user_email, maquina_nome, data_analise, diagnostico, confianca, detalhes_json) VALUES (?, ?, ?, ?, ?, ?)", batch)
+            batch = []
+    conn.executemany("INSERT INTO historico (user_email, maquina_nome, data_analise, diagnostico, confianca, detalhes_json) VALUES (?, ?, ?, ?, ?, ?)", batch)
+    conn.executemany("INSERT INTO chat_messages (user_email, role, content, timestamp, session_id) VALUES (?, ?, ?, ?, ?)",
+                     ((f"user{i % USERS}@fabrica.pt", "user", sentence(15), "2026-05-01 10:00:00", i % 5000) for i in range(count // 2)))
+    # 009 e 010 não interessam aqui (ficam vazias): o benchmark é da 011
+    conn.execute("PRAGMA user_version = 10")
+    conn.commit()
+
+
+def percentiles(func):
+    times = []
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - t0) * 1000)
+    times.sort()
+    return times[len(times) // 2], times[int(len(times) * 0.95)], result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    random.seed(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "bench.db")
+        conn = database.connect()
+        t0 = time.perf_counter()
+        populate(conn, count)
+        print(f"{count:,} análises e {count // 2:,} mensagens, {USERS} utilizadores (carga em {time.perf_counter() - t0:.1f}s)")
+        t0 = time.perf_counter()
+        migrations.migrate(conn, target=11)
+        print(f"  migração 011 (índices + backfill): {time.perf_counter() - t0:.1f}s")
+
+        p50, p95, _ = percentiles(lambda: conn.execute(
+            "SELECT id FROM historico WHERE user_email=? AND (diagnostico LIKE ? OR detalhes_json LIKE ?) ORDER BY id DESC LIMIT 20",
+            (f"user{random.randrange(USERS)}@fabrica.pt", "%rolamento%", "%rolamento%")).fetchall())
+        print(f"  antes  LIKE (primeiras 20, sem relevância): p50 {p50:7.2f}ms  p95 {p95:7.2f}ms")
+        for query in QUERIES:
+            p50, p95, result = percentiles(lambda: search._search(
+                conn, f"user{random.randrange(USERS)}@fabrica.pt", query, ("analises", "chat"), search.SEARCH_DEFAULT_LIMIT))
+            print(f"  depois {query!r:>22}: p50 {p50:7.2f}ms  p95 {p95:7.2f}ms  "
+                  f"({len(result['analises'])} análises, {len(result['chat'])} mensagens)")
+        p50, p95, _ = percentiles(lambda: search._related(
+            conn, f"user{random.randrange(USERS)}@fabrica.pt", "O compressor voltou a fazer ruído, será do rolamento?", 3, set()))
+        print(f"  contexto do chat (análises relacionadas): p50 {p50:7.2f}ms  p95 {p95:7.2f}ms")
+
+        rows = [(f"user{random.randrange(USERS)}@fabrica.pt", "Bomba 1", "2026-06-01 10:00", random.choice(FAULTS), "80%",
+                 json.dumps({"description": sentence(25), "steps": [sentence(6)]})) for _ in range(2000)]
+        t0 = time.perf_counter()
+        for row in rows:
+            with conn:
+                conn.execute("INSERT INTO historico (user_email, maquina_nome, data_analise, diagnostico, confianca, detalhes_json) VALUES (?, ?, ?, ?, ?, ?)", row)
+        print(f"  INSERT no historico com os triggers do índice: {(time.perf_counter() - t0) / len(rows) * 1000:.3f}ms")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import tempfile
+
+import database
+import migrations
+import machine_trends
+
+# Benchmark da tendência por máquina: historico com N análises (por omissão 1M,
+# 200 utilizadores x 5 máquinas, 10 anos de dados).
+#   antes -> ler todas as linhas da máquina do historico e fazer parse de
+#            confianca/detalhes_json/features_json em Python, por balde
+#   depois -> /api/machines/trend: GROUP BY por balde em machine_metrics
+# Mostra também a velocidade do backfill da migração 009.
+# Uso: python bench_trends.py [análises]
+
+USERS = 200
+MACHINES = 5
+YEARS = 10
+REPEATS = 20
+DIAGNOSES = ["Funcionamento Normal", "Desgaste do Rolamento", "Desalinhamento do Veio", "Cavitação na Bomba", "Fonte Inválida"]
+
+
+def populate(conn, count):
+    for number, _, apply in migrations.MIGRATIONS:
+        if number < 9:
+            apply(conn)
+    start = 1_500_000_000
+    step = YEARS * 365 * 86400 // (count // (USERS * MACHINES) or 1)
+    batch = []
+    for i in range(count):
+        user, machine = i % USERS, (i // USERS) % MACHINES
+        ts = start + (i // (USERS * MACHINES)) * step + random.randrange(3600)
+        details = json.dumps({"diagnosis": "x", "estimated_cost": f"{random.randrange(50, 500)}€ - {random.randrange(500, 3000)}€",
+                              "repair_time": f"{random.randrange(1, 4)}h - {random.randrange(4, 12)}h", "steps": ["a", "b"]})
+        features = json.dumps({"rms_db": round(random.uniform(-30, -5), 1), "kurtosis": round(random.uniform(2, 9), 2),
+                               "crest_factor": round(random.uniform(2, 6), 2), "spectral_centroid_hz": round(random.uniform(200, 3000), 1)})
+        batch.append((f"user{user}@fabrica.pt", f"Máquina {machine}", time.strftime("%Y-%m-%d %H:%M", time.gmtime(ts)),
+                      random.choice(DIAGNOSES), f"{random.randrange(50, 100)}%", details, features))
+        if len(batch) == 100_000:
+            conn.executemany("INSERT INTO historico (user_email, maquina_nome, data_analise, diagnostico, confianca, detalhes_json, features_json) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+            batch = []
+    conn.executemany("INSERT INTO historico (user_email, maquina_nome, data_analise, diagnostico, confianca, detalhes_json, features_json) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+    conn.execute("PRAGMA user_version = 8")
+    conn.commit()
+
+
+def old_trend(conn, email, machine_name, points=machine_trends.TREND_DEFAULT_POINTS):
+    # O que era preciso antes: todas as linhas da máquina, parse em Python
+    rows = conn.execute("SELECT data_analise, confianca, detalhes_json, features_json FROM historico "
+                        "WHERE user_email=? AND maquina_nome=? ORDER BY id", (email, machine_name)).fetchall()
+    parsed = [(machine_trends.epoch(r[0]), machine_trends.parse_confidence(r[1]),
+               machine_trends.parse_cost(json.loads(r[2]).get("estimated_cost"))[1], json.loads(r[3]).get("kurtosis")) for r in rows]
+    start, end = parsed[0][0], parsed[-1][0]
+    size = max(3600, -(-(end - start + 1) // points))
+    buckets = {}
+    for ts, confidence, cost, kurtosis in parsed:
+        buckets.setdefault(ts // size, []).append((confidence, cost, kurtosis))
+    return [(b, len(v), sum(x[0] for x in v) / len(v)) for b, v in sorted(buckets.items())]
+
+
+def timed(func, *args):
+    t0 = time.perf_counter()
+    for _ in range(REPEATS):
+        result = func(*args)
+    return (time.perf_counter() - t0) / REPEATS * 1000, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    random.seed(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "bench.db")
+        conn = database.connect()
+        t0 = time.perf_counter()
+        populate(conn, count)
+        print(f"{count:,} análises, {count // (USERS * MACHINES):,} por máquina em {YEARS} anos (carga em {time.perf_counter() - t0:.1f}s)")
+
+        t0 = time.perf_counter()
+        migrations.migrate(conn, target=9)
+        with conn:
+            machine_trends.backfill(conn)
+        elapsed = time.perf_counter() - t0
+        print(f"  migração 009 (backfill): {elapsed:.1f}s, {count / elapsed:,.0f} linhas/s")
+
+        email, machine = "user7@fabrica.pt", "Máquina 3"
+        old_ms, old = timed(old_trend, conn, email, machine)
+        print(f"  antes  (parse em Python):         {old_ms:8.2f}ms  {len(old)} pontos")
+        new_ms, new = timed(machine_trends._trend, conn, email, machine, None, None, machine_trends.TREND_DEFAULT_POINTS, None)
+        print(f"  depois (machine_metrics, 10 anos): {new_ms:8.2f}ms  {len(new['points'])} pontos")
+        last_year = new["points"][-1]["t"] - 365 * 86400
+        new_ms, new = timed(machine_trends._trend, conn, email, machine, last_year, None, machine_trends.TREND_DEFAULT_POINTS, None)
+        print(f"  depois (último ano):               {new_ms:8.2f}ms  {len(new['points'])} pontos")
+
+        async def via_api():
+            t0 = time.perf_counter()
+            for _ in range(REPEATS):
+                await machine_trends.trend(email, machine)
+            return (time.perf_counter() - t0) / REPEATS * 1000
+        print(f"  /api/machines/trend (thread da BD): {asyncio.run(via_api()):7.2f}ms")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+import os
+import asyncio
+from collections import OrderedDict, deque
+
+import database
+import search
+import embeddings
+
+# --- CACHE DO CONTEXTO DO CHAT ---
+# O send_chat_message carregava a sessão inteira (SELECT ... ORDER BY id ASC),
+# ficava só com as últimas 10 mensagens e ainda fazia um COUNT(*) à parte: cada
+# mensagem numa conversa longa era mais lenta do que a anterior. Aqui cada
+# sessão tem um ring buffer das últimas CHAT_MEMORY_TURNS mensagens, atualizado
+# a cada INSERT, e cada utilizador tem o resumo das últimas análises em cache.
+# Antes de usar a cache confirmamos o id mais recente (uma query pelos índices
+# de user_email/session_id): mensagens ou análises escritas por outro processo
+# fazem recarregar a entrada (ORDER BY id DESC LIMIT 10). Custo constante por
+# mensagem, seja qual for o tamanho da conversa.
+#
+# --- MEMÓRIA COM RESUMO ---
+# Só as últimas mensagens iam para o prompt, tal e qual: o que era mais antigo
+# perdia-se e uma mensagem enorme fazia disparar o tamanho do prompt. Agora a
+# memória é o resumo guardado da conversa (chat_sessions.summary, cobre as
+# mensagens até summary_upto_id) + as mensagens recentes que couberem em
+# CHAT_MEMORY_TOKENS. O que sai da janela recente é resumido em background
+# pelo modelo, de forma incremental (resumo anterior + mensagens novas).
+#
+# --- ANÁLISES RELACIONADAS ---
+# Além das ANALYSIS_CONTEXT_ROWS análises mais recentes (em cache), o contexto
+# leva as análises mais relevantes para a mensagem: "o compressor voltou a
+# fazer aquele ruído" encontra a análise do compressor de há meses, que nunca
+# estaria entre as 3 últimas. Duas listas de candidatas, a pesquisa de texto
+# (search.py, mesmas palavras) e os embeddings (embeddings.py, mesmo assunto),
+# juntas por reciprocal rank fusion; as análises entram com descrição e passos
+# pela ordem da fusão enquanto couberem em RELATED_TOKENS.
+
+CHAT_MEMORY_TURNS = 10
+ANALYSIS_CONTEXT_ROWS = 3
+CONTEXT_MAX_SESSIONS = int(os.environ.get("ECHO_CHAT_CONTEXT_SESSIONS", "2000"))
+CHAT_MEMORY_TOKENS = int(os.environ.get("ECHO_CHAT_MEMORY_TOKENS", "1500"))
+SUMMARIES_ENABLED = os.environ.get("ECHO_CHAT_SUMMARIES", "1") == "1"
+SUMMARY_MAX_WORDS = 150
+SUMMARY_MIN_MESSAGES = 4
+SUMMARY_BATCH = 200
+RELATED_ENABLED = os.environ.get("ECHO_CHAT_RELATED", "1") == "1"
+RELATED_TOKENS = int(os.environ.get("ECHO_CHAT_RELATED_TOKENS", "600"))
+RELATED_CANDIDATES = 8
+RELATED_FIELD_CHARS = 300
+RRF_K = 60
+
+stats = {"hits": 0, "session_loads": 0, "analysis_loads": 0,
+         "requests": 0, "prompt_tokens": 0, "memory_tokens": 0, "raw_memory_tokens": 0,
+         "summaries": 0, "summary_errors": 0, "related_analyses": 0, "related_tokens": 0}
+
+_sessions = OrderedDict()
+_analyses = OrderedDict()
+_refreshing = set()
+_tasks = set()
+
+LATEST_IDS_SQL = """
+    SELECT (SELECT id FROM historico WHERE user_email=? ORDER BY id DESC LIMIT 1),
+           (SELECT id FROM chat_messages WHERE session_id=? ORDER BY id DESC LIMIT 1),
+           (SELECT COALESCE(summary_upto_id, 0) FROM chat_sessions WHERE id=?)
+"""
+
+SUMMARY_PROMPT = """
+És a Samantha, assistente de manutenção industrial da EchoMechanic. Mantém um resumo
+de uma conversa técnica com um utilizador, para usares como memória.
+
+RESUMO ATUAL:
+{summary}
+
+MENSAGENS NOVAS:
+{messages}
+
+Reescreve o resumo (máximo {max_words} palavras, português de Portugal) juntando as
+mensagens novas. Guarda máquinas, sintomas, diagnósticos, decisões e perguntas em
+aberto; descarta cumprimentos. Responde só com o texto do resumo.
+"""
+
+
+def estimate_tokens(text):
+    # ~4 caracteres por token: chega para orçamentos e métricas, sem gastar um
+    # pedido à API (model.count_tokens) por mensagem
+    return (len(text) + 3) // 4 if text else 0
+
+
+def _turn_line(role, content):
+    role_name = "Utilizador" if role == "user" else "Samantha"
+    return f"{role_name}: {content or ''}\n"
+
+
+class SessionContext:
+    def __init__(self, last_id, turns, summary=None, summary_upto_id=0):
+        # turns: (id, role, content) das últimas CHAT_MEMORY_TURNS mensagens
+        self.last_id = last_id
+        self.turns = deque(turns, maxlen=CHAT_MEMORY_TURNS)
+        # Se o buffer veio cheio da BD, pode haver mensagens mais antigas
+        self.has_older = len(self.turns) == CHAT_MEMORY_TURNS
+        self.summary = summary
+        self.summary_upto_id = summary_upto_id or 0
+        self.oldest_kept_id = None
+        self.memory_tokens = 0
+        self.raw_tokens = 0
+        self._summary_checked = None
+        self._memory = None
+
+    def append(self, message_id, role, content):
+        if len(self.turns) == self.turns.maxlen:
+            self.has_older = True
+        self.turns.append((message_id, role, content))
+        self.last_id = message_id
+        self._memory = None
+
+    def set_summary(self, summary, upto_id):
+        self.summary = summary
+        self.summary_upto_id = upto_id
+        self._memory = None
+
+    def memory_str(self):
+        # Texto da memória para o prompt, reconstruído só quando chega uma mensagem
+        # nova ou um resumo novo: resumo + mensagens recentes (da mais nova para a
+        # mais antiga) até esgotar CHAT_MEMORY_TOKENS
+        if self._memory is None:
+            memory = f"\nRESUMO DA CONVERSA ATÉ AQUI:\n{self.summary}\n" if self.summary else ""
+            budget = CHAT_MEMORY_TOKENS - estimate_tokens(memory)
+            lines = []
+            self.oldest_kept_id = None
+            for message_id, role, content in reversed(self.turns):
+                if message_id <= self.summary_upto_id:
+                    break  # já está no resumo
+                line = _turn_line(role, content)
+                cost = estimate_tokens(line)
+                if cost > budget:
+                    if not lines and budget > 0:
+                        # A mensagem mais recente entra sempre, cortada ao que sobra
+                        lines.append(line[:budget * 4] + "…\n")
+                        self.oldest_kept_id = message_id
+                    break
+                budget -= cost
+                lines.append(line)
+                self.oldest_kept_id = message_id
+            if lines:
+                memory += "\nHISTÓRICO DA CONVERSA:\n" + "".join(reversed(lines))
+            self._memory = memory
+            self.memory_tokens = estimate_tokens(memory)
+            # O que o prompt levaria antes (últimas mensagens completas, sem resumo)
+            self.raw_tokens = sum(estimate_tokens(_turn_line(role, content)) for _, role, content in self.turns)
+        return self._memory
+
+    def needs_summary(self):
+        # Há mensagens fora da janela recente que o resumo ainda não cobre?
+        self.memory_str()
+        cutoff = self.oldest_kept_id
+        if cutoff is None or cutoff == self._summary_checked:
+            return None
+        if not self.has_older and self.turns[0][0] >= cutoff:
+            return None
+        self._summary_checked = cutoff
+        return cutoff
+
+
+def _remember(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > CONTEXT_MAX_SESSIONS:
+        cache.popitem(last=False)
+
+
+def format_analyses(rows):
+    # rows: (id, maquina_nome, data_analise, diagnostico)
+    context_str = "Histórico recente de análises do utilizador:\n"
+    if not rows:
+        return context_str + "Nenhuma análise recente encontrada."
+    for _, m_name, m_date, m_diag in rows:
+        context_str += f"- Máquina: {m_name or 'Desconhecido'}, Data: {m_date or 'N/A'}, Diagnóstico: {m_diag or 'N/A'}\n"
+    return context_str
+
+
+def _clip(text):
+    return text if len(text) <= RELATED_FIELD_CHARS else text[:RELATED_FIELD_CHARS].rstrip() + "…"
+
+
+def _related_line(row):
+    _, m_name, m_date, m_diag, detalhes_json = row
+    description, steps = embeddings.details(detalhes_json)
+    line = f"- Máquina: {m_name or 'Desconhecido'}, Data: {m_date or 'N/A'}, Diagnóstico: {m_diag or 'N/A'}\n"
+    if description:
+        line += f"  Descrição: {_clip(description)}\n"
+    if steps:
+        line += f"  Passos: {_clip('; '.join(steps))}\n"
+    return line
+
+
+async def related_context(email, message, exclude):
+    # Texto das análises relacionadas com a mensagem ("" se não houver)
+    # Uma das pesquisas a falhar não impede a outra nem a resposta do chat
+    hits = await asyncio.gather(
+        search.related_analyses(email, message, RELATED_CANDIDATES, exclude),
+        embeddings.nearest(email, message, RELATED_CANDIDATES, exclude),
+        return_exceptions=True)
+    for index, result in enumerate(hits):
+        if isinstance(result, Exception):
+            print(f"ERRO: pesquisa de análises relacionadas falhou: {result}")
+            hits[index] = []
+    text_hits, vector_hits = hits
+    scores = {}
+    for ranking in ([row[0] for row in text_hits], [analysis_id for analysis_id, _ in vector_hits]):
+        for position, analysis_id in enumerate(ranking):
+            scores[analysis_id] = scores.get(analysis_id, 0.0) + 1 / (RRF_K + position)
+    if not scores:
+        return ""
+    ranked = sorted(scores, key=lambda analysis_id: (-scores[analysis_id], -analysis_id))
+    rows = await database.fetchall(
+        f"SELECT id, maquina_nome, data_analise, diagnostico, detalhes_json FROM historico "
+        f"WHERE user_email=? AND id IN ({', '.join('?' * len(ranked))})", (email, *ranked))
+    by_id = {row[0]: row for row in rows}
+    budget = RELATED_TOKENS
+    lines = []
+    for analysis_id in ranked:
+        if analysis_id not in by_id:
+            continue
+        line = _related_line(by_id[analysis_id])
+        cost = estimate_tokens(line)
+        if cost <= budget:
+            budget -= cost
+            lines.append(line)
+    stats["related_analyses"] += len(lines)
+    stats["related_tokens"] += RELATED_TOKENS - budget
+    return "Análises antigas relacionadas com a pergunta:\n" + "".join(lines) if lines else ""
+
+
+async def get(email, session_id, message=None):
+    # Devolve (texto das análises recentes e relacionadas com a mensagem,
+    # SessionContext ou None se não houver sessão)
+    last_analysis_id, last_message_id, summary_upto_id = await database.fetchone(
+        LATEST_IDS_SQL, (email, session_id, session_id))
+
+    analysis = _analyses.get(email)
+    if analysis is None or analysis[0] != last_analysis_id:
+        rows = await database.fetchall(
+            "SELECT id, maquina_nome, data_analise, diagnostico FROM historico WHERE user_email=? ORDER BY id DESC LIMIT ?",
+            (email, ANALYSIS_CONTEXT_ROWS))
+        analysis = (last_analysis_id, format_analyses(rows), [row[0] for row in rows])
+        stats["analysis_loads"] += 1
+    _remember(_analyses, email, analysis)
+
+    context_str = analysis[1]
+    if message and RELATED_ENABLED and last_analysis_id is not None:
+        related = await related_context(email, message, analysis[2])
+        if related:
+            context_str += "\n" + related
+
+    if not session_id:
+        return context_str, None
+    session = _sessions.get(session_id)
+    if session is None or session.last_id != last_message_id or session.summary_upto_id != (summary_upto_id or 0):
+        rows = await database.fetchall(
+            "SELECT id, role, content FROM chat_messages WHERE session_id=? ORDER BY id DESC LIMIT ?",
+            (session_id, CHAT_MEMORY_TURNS))
+        summary = await database.fetchone("SELECT summary, summary_upto_id FROM chat_sessions WHERE id=?", (session_id,))
+        session = SessionContext(last_message_id, reversed(rows), *(summary or (None, 0)))
+        stats["session_loads"] += 1
+    else:
+        stats["hits"] += 1
+    _remember(_sessions, session_id, session)
+    return context_str, session
+
+
+def record(session_id, message_id, role, content):
+    # Atualização incremental depois do INSERT (sem voltar a ler a sessão)
+    session = _sessions.get(session_id)
+    if session is not None:
+        session.append(message_id, role, content)
+
+
+def drop_session(session_id):
+    _sessions.pop(session_id, None)
+
+
+def record_usage(prompt_tokens, session):
+    stats["requests"] += 1
+    stats["prompt_tokens"] += prompt_tokens
+    if session is not None:
+        stats["memory_tokens"] += session.memory_tokens
+        stats["raw_memory_tokens"] += session.raw_tokens
+
+
+def schedule_summary(session_id, summarize):
+    # Chamado depois de gravar a resposta: se houver mensagens por resumir, o
+    # resumo é atualizado numa task à parte (o utilizador não espera por ele).
+    # summarize: async (prompt) -> texto
+    session = _sessions.get(session_id)
+    if not SUMMARIES_ENABLED or session is None or session_id in _refreshing:
+        return
+    cutoff = session.needs_summary()
+    if cutoff is None:
+        return
+    _refreshing.add(session_id)
+    task = asyncio.get_running_loop().create_task(_refresh_summary(session_id, session, cutoff, summarize))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _refresh_summary(session_id, session, cutoff, summarize):
+    try:
+        rows = await database.fetchall(
+            "SELECT id, role, content FROM chat_messages WHERE session_id=? AND id>? AND id<? ORDER BY id LIMIT ?",
+            (session_id, session.summary_upto_id, cutoff, SUMMARY_BATCH))
+        # Poucas mensagens por resumir: espera por mais (poupa quota)
+        if len(rows) < SUMMARY_MIN_MESSAGES:
+            return
+        prompt = SUMMARY_PROMPT.format(
+            summary=session.summary or "(vazio)",
+            messages="".join(_turn_line(role, content) for _, role, content in rows),
+            max_words=SUMMARY_MAX_WORDS)
+        summary = (await summarize(prompt)).strip()
+        if not summary:
+            return
+        upto_id = rows[-1][0]
+        await database.execute(
+            "UPDATE chat_sessions SET summary=?, summary_upto_id=? WHERE id=? AND COALESCE(summary_upto_id, 0) < ?",
+            (summary, upto_id, session_id, upto_id))
+        session.set_summary(summary, upto_id)
+        stats["summaries"] += 1
+    except Exception as e:
+        stats["summary_errors"] += 1
+        print(f"ERRO: resumo da conversa {session_id} falhou: {e}")
+    finally:
+        _refreshing.discard(session_id)
@@ -0,0 +1,205 @@
+import os
+import sys
+import datetime
+
+import database
+import machine_trends
+
+# --- RESUMO DO DASHBOARD ---
+# O dashboard tinha de tirar as contagens (análises por dia, falhas em aberto,
+# máquinas em risco, custo exposto) do /api/history e do /api/activity, com o
+# custo escondido no texto do estimated_cost. Agora há três tabelas de agregados
+# (migração 010), atualizadas na mesma transação de cada INSERT no historico:
+#   - machine_summary: por máquina, contagens e a última análise;
+#   - user_summary: uma linha por utilizador com os totais do dashboard;
+#   - daily_summary: análises e falhas por dia.
+# Uma máquina tem uma falha "em aberto" se a última análise é avaria; está "em
+# risco" se, além disso, a confiança é >= RISK_CONFIDENCE. O custo exposto soma
+# os limites do custo estimado das falhas em aberto.
+# O /api/dashboard/summary lê uma linha (mais os dias pedidos). O verificador
+# (check / rebuild, ou "python dashboard_summary.py [--fix] [email]") recalcula
+# tudo a partir do machine_metrics e compara com o que está guardado.
+
+RISK_CONFIDENCE = float(os.environ.get("ECHO_RISK_CONFIDENCE", "0.7"))
+DAY_SECONDS = 86400
+SUMMARY_DEFAULT_DAYS = 30
+SUMMARY_MAX_DAYS = 366
+# Somas de custos em float: diferenças abaixo disto não contam como inconsistência
+COST_TOLERANCE = 0.01
+
+USER_COLUMNS = ["analyses", "faults", "machines", "open_faults", "machines_at_risk", "cost_exposure_min", "cost_exposure_max"]
+
+MACHINE_LATEST_SQL = f"""
+    SELECT user_email, maquina_nome, analyses, faults, ts, historico_id, fault_class, confidence, cost_min, cost_max
+    FROM (
+        SELECT *, ROW_NUMBER() OVER (PARTITION BY user_email, maquina_nome ORDER BY ts DESC, historico_id DESC) AS position,
+               COUNT(*) OVER machine AS analyses,
+               SUM(fault_class NOT IN ({machine_trends.NON_FAULT_SQL})) OVER machine AS faults
+        FROM machine_metrics {{where}}
+        WINDOW machine AS (PARTITION BY user_email, maquina_nome)
+    ) WHERE position = 1
+"""
+
+DAILY_SQL = f"""
+    SELECT user_email, ts / {DAY_SECONDS}, COUNT(*), SUM(fault_class NOT IN ({machine_trends.NON_FAULT_SQL}))
+    FROM machine_metrics {{where}} GROUP BY user_email, ts / {DAY_SECONDS}
+"""
+
+
+def is_fault(fault_class):
+    return fault_class not in machine_trends.NON_FAULT_CLASSES
+
+
+def contribution(fault_class, confidence, cost_min, cost_max):
+    # (falha em aberto, em risco, custo mín., custo máx.) de uma máquina pela última análise
+    if fault_class is None or not is_fault(fault_class):
+        return 0, 0, 0.0, 0.0
+    at_risk = 1 if confidence is not None and confidence >= RISK_CONFIDENCE else 0
+    return 1, at_risk, cost_min or 0.0, cost_max or 0.0
+
+
+def apply(conn, metrics):
+    # Chamado na transação do INSERT; metrics = linhas do machine_trends.record
+    for row in metrics:
+        email, machine_name, ts, historico_id, _, _, confidence, cost_min, cost_max, _, fault_class = row[:11]
+        fault = 1 if is_fault(fault_class) else 0
+        current = conn.execute(
+            "SELECT last_ts, last_historico_id, last_fault_class, last_confidence, last_cost_min, last_cost_max "
+            "FROM machine_summary WHERE user_email=? AND maquina_nome=?", (email, machine_name)).fetchone()
+        new_machine = current is None
+        before = (0, 0, 0.0, 0.0) if new_machine else contribution(*current[2:])
+        # Análises gravadas fora de ordem não substituem a última
+        newer = new_machine or (ts, historico_id) > (current[0], current[1])
+        after = contribution(fault_class, confidence, cost_min, cost_max) if newer else before
+
+        conn.execute("""
+            INSERT INTO machine_summary (user_email, maquina_nome, analyses, faults, last_ts, last_historico_id,
+                last_fault_class, last_confidence, last_cost_min, last_cost_max)
+            VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_email, maquina_nome) DO UPDATE SET analyses = analyses + 1, faults = faults + excluded.faults
+        """, (email, machine_name, fault, ts, historico_id, fault_class, confidence, cost_min, cost_max))
+        if newer and not new_machine:
+            conn.execute("""
+                UPDATE machine_summary SET last_ts=?, last_historico_id=?, last_fault_class=?, last_confidence=?,
+                    last_cost_min=?, last_cost_max=? WHERE user_email=? AND maquina_nome=?
+            """, (ts, historico_id, fault_class, confidence, cost_min, cost_max, email, machine_name))
+
+        delta = [1, fault, 1 if new_machine else 0] + [a - b for a, b in zip(after, before)]
+        conn.execute(f"""
+            INSERT INTO user_summary (user_email, {', '.join(USER_COLUMNS)}) VALUES (?, {', '.join('?' * len(USER_COLUMNS))})
+            ON CONFLICT (user_email) DO UPDATE SET {', '.join(f'{c} = {c} + excluded.{c}' for c in USER_COLUMNS)}
+        """, (email, *delta))
+        conn.execute("""
+            INSERT INTO daily_summary (user_email, day, analyses, faults) VALUES (?, ?, 1, ?)
+            ON CONFLICT (user_email, day) DO UPDATE SET analyses = analyses + 1, faults = faults + excluded.faults
+        """, (email, ts // DAY_SECONDS, fault))
+
+
+def remove_user(conn, email):
+    for table in ("machine_summary", "user_summary", "daily_summary"):
+        conn.execute(f"DELETE FROM {table} WHERE user_email=?", (email,))
+
+
+# --- VERIFICADOR DE CONSISTÊNCIA ---
+def expected(conn, email=None):
+    # Agregados recalculados de raiz a partir do machine_metrics:
+    # (máquinas {(email, nome): linha}, utilizadores {email: colunas}, dias {(email, dia): (análises, falhas)})
+    where, params = ("WHERE user_email=?", (email,)) if email else ("", ())
+    machines = {}
+    users = {}
+    for row in conn.execute(MACHINE_LATEST_SQL.format(where=where), params):
+        machines[(row[0], row[1])] = tuple(row[2:])
+        totals = users.setdefault(row[0], [0] * len(USER_COLUMNS))
+        open_fault, at_risk, cost_min, cost_max = contribution(*row[6:])
+        for index, value in enumerate((row[2], row[3], 1, open_fault, at_risk, cost_min, cost_max)):
+            totals[index] += value
+    days = {(row[0], row[1]): (row[2], row[3]) for row in conn.execute(DAILY_SQL.format(where=where), params)}
+    return machines, {key: tuple(value) for key, value in users.items()}, days
+
+
+def stored(conn, email=None):
+    where, params = ("WHERE user_email=?", (email,)) if email else ("", ())
+    machines = {(r[0], r[1]): tuple(r[2:]) for r in conn.execute(
+        f"SELECT user_email, maquina_nome, analyses, faults, last_ts, last_historico_id, last_fault_class, "
+        f"last_confidence, last_cost_min, last_cost_max FROM machine_summary {where}", params)}
+    users = {r[0]: tuple(r[1:]) for r in conn.execute(
+        f"SELECT user_email, {', '.join(USER_COLUMNS)} FROM user_summary {where}", params)}
+    days = {(r[0], r[1]): (r[2], r[3]) for r in conn.execute(
+        f"SELECT user_email, day, analyses, faults FROM daily_summary {where}", params)}
+    return machines, users, days
+
+
+def _same(a, b):
+    if a is None or b is None:
+        return a == b
+    return all(abs(x - y) <= COST_TOLERANCE if isinstance(x, float) or isinstance(y, float) else x == y
+               for x, y in zip(a, b))
+
+
+def check(conn, email=None):
+    # Lista de diferenças (vazia = agregados consistentes)
+    differences = []
+    for table, want, have in zip(("machine_summary", "user_summary", "daily_summary"), expected(conn, email), stored(conn, email)):
+        for key in sorted(set(want) | set(have), key=str):
+            if not _same(want.get(key), have.get(key)):
+                differences.append(f"{table} {key}: esperado {want.get(key)}, guardado {have.get(key)}")
+    return differences
+
+
+def rebuild(conn, email=None):
+    # Apaga e volta a escrever os agregados (de um utilizador ou de todos)
+    machines, users, days = expected(conn, email)
+    if email:
+        remove_user(conn, email)
+    else:
+        for table in ("machine_summary", "user_summary", "daily_summary"):
+            conn.execute(f"DELETE FROM {table}")
+    conn.executemany("""
+        INSERT INTO machine_summary (user_email, maquina_nome, analyses, faults, last_ts, last_historico_id,
+            last_fault_class, last_confidence, last_cost_min, last_cost_max) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(*key, *value) for key, value in machines.items()])
+    conn.executemany(f"INSERT INTO user_summary (user_email, {', '.join(USER_COLUMNS)}) VALUES (?, {', '.join('?' * len(USER_COLUMNS))})",
+                     [(key, *value) for key, value in users.items()])
+    conn.executemany("INSERT INTO daily_summary (user_email, day, analyses, faults) VALUES (?, ?, ?, ?)",
+                     [(*key, *value) for key, value in days.items()])
+    return len(users)
+
+
+# --- LEITURA PARA O DASHBOARD ---
+def _summary(conn, email, days):
+    row = conn.execute(f"SELECT {', '.join(USER_COLUMNS)} FROM user_summary WHERE user_email=?", (email,)).fetchone()
+    totals = dict(zip(USER_COLUMNS, row or [0] * len(USER_COLUMNS)))
+    # Dias na mesma convenção do machine_metrics.ts (hora local gravada, sem fuso)
+    today = machine_trends.epoch(datetime.datetime.now().strftime("%Y-%m-%d %H:%M")) // DAY_SECONDS
+    counts = {r[0]: (r[1], r[2]) for r in conn.execute(
+        "SELECT day, analyses, faults FROM daily_summary WHERE user_email=? AND day > ?", (email, today - days))}
+    return {
+        "analyses": totals["analyses"],
+        "faults": totals["faults"],
+        "machines": totals["machines"],
+        "open_faults": totals["open_faults"],
+        "machines_at_risk": totals["machines_at_risk"],
+        "cost_exposure": {"min": round(totals["cost_exposure_min"], 2), "max": round(totals["cost_exposure_max"], 2)},
+        "daily": [{"day": (datetime.date(1970, 1, 1) + datetime.timedelta(days=day)).isoformat(),
+                   "analyses": counts.get(day, (0, 0))[0], "faults": counts.get(day, (0, 0))[1]}
+                  for day in range(today - days + 1, today + 1)],
+    }
+
+
+async def summary(email, days=SUMMARY_DEFAULT_DAYS):
+    return await database.run(_summary, email, max(1, min(days, SUMMARY_MAX_DAYS)))
+
+
+if __name__ == "__main__":
+    import migrations
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    conn = database.connect()
+    migrations.migrate(conn)
+    differences = check(conn, args[0] if args else None)
+    for line in differences:
+        print(line)
+    print(f"{len(differences)} diferença(s)")
+    if differences and "--fix" in sys.argv:
+        with conn:
+            print(f"Agregados reconstruídos para {rebuild(conn, args[0] if args else None)} utilizador(es)")
+    conn.close()
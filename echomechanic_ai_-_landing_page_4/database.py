@@ -0,0 +1,92 @@
+import os
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# --- CAMADA DE ACESSO À BASE DE DADOS ---
+# Antes cada endpoint fazia sqlite3.connect('users.db') dentro do event loop,
+# em modo rollback-journal, e pagava o custo de abrir a ligação em cada pedido.
+# Agora:
+#   - cada thread de BD tem UMA ligação persistente (reutilizada entre pedidos);
+#   - WAL permite leitores em paralelo com o escritor (acaba o "database is locked");
+#   - a cache de statements do sqlite3 fica grande, por isso as queries repetidas
+#     dos endpoints são preparadas uma única vez por ligação;
+#   - as queries correm numa thread pool, nunca no event loop.
+
+DB_PATH = os.environ.get("ECHO_DB_PATH", "users.db")
+DB_WORKERS = int(os.environ.get("ECHO_DB_WORKERS", "4"))
+DB_BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",      # seguro em WAL, evita um fsync por commit
+    "PRAGMA cache_size=-20000",       # ~20 MB de page cache por ligação
+    "PRAGMA mmap_size=268435456",     # 256 MB de leituras via mmap
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}",
+]
+
+_local = threading.local()
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="sqlite")
+
+
+def connect(path=None):
+    conn = sqlite3.connect(
+        path or DB_PATH,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_conn():
+    # Uma ligação por thread (as threads do executor vivem o tempo todo da app)
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = connect()
+        _local.conn = conn
+    return conn
+
+
+def _call(func, args):
+    conn = get_conn()
+    try:
+        result = func(conn, *args)
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+
+
+async def run(func, *args):
+    # Executa func(conn, *args) numa thread de BD, dentro de uma transação
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _call, func, args)
+
+
+# --- ATALHOS PARA QUERIES SIMPLES ---
+async def fetchone(sql, params=()):
+    return await run(lambda conn: conn.execute(sql, params).fetchone())
+
+
+async def fetchall(sql, params=()):
+    return await run(lambda conn: conn.execute(sql, params).fetchall())
+
+
+async def fetchall_dicts(sql, params=()):
+    def query(conn):
+        c = conn.execute(sql, params)
+        columns = [desc[0] for desc in c.description]
+        return [dict(zip(columns, row)) for row in c.fetchall()]
+    return await run(query)
+
+
+async def execute(sql, params=()):
+    # Devolve o cursor já executado (lastrowid / rowcount continuam acessíveis)
+    return await run(lambda conn: conn.execute(sql, params))
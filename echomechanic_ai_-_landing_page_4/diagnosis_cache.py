@@ -0,0 +1,77 @@
+import os
+import json
+import time
+import hashlib
+
+import database
+
+# --- CACHE DE DIAGNÓSTICOS ---
+# A mesma gravação (mesmo SHA-256) analisada com o mesmo prompt e o mesmo estilo
+# de resposta dá o mesmo diagnóstico; não vale a pena gastar outra chamada ao
+# Gemini (latência + quota, já temos erros 429). A cache vive na tabela
+# diagnosis_cache, com TTL e despejo LRU quando passa de CACHE_MAX_ENTRIES.
+
+CACHE_TTL_SECONDS = int(os.environ.get("ECHO_DIAG_CACHE_TTL", str(30 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.environ.get("ECHO_DIAG_CACHE_MAX_ENTRIES", "10000"))
+
+# Métricas do processo (expostas em /api/cache/stats)
+stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "bypass": 0}
+
+
+def cache_key(audio_sha256, prompt_version, preference):
+    return hashlib.sha256(f"{audio_sha256}|{prompt_version}|{preference}".encode()).hexdigest()
+
+
+def _get(conn, key, now):
+    row = conn.execute("SELECT response_json, created_at FROM diagnosis_cache WHERE key=?", (key,)).fetchone()
+    if not row:
+        return None, False
+    if now - row[1] > CACHE_TTL_SECONDS:
+        conn.execute("DELETE FROM diagnosis_cache WHERE key=?", (key,))
+        return None, True
+    conn.execute("UPDATE diagnosis_cache SET last_used_at=?, hits=hits+1 WHERE key=?", (now, key))
+    return json.loads(row[0]), False
+
+
+async def get(key):
+    data, expired = await database.run(_get, key, int(time.time()))
+    if data is not None:
+        stats["hits"] += 1
+    else:
+        stats["misses"] += 1
+        if expired:
+            stats["expired"] += 1
+    return data
+
+
+def _put(conn, key, response_json, now):
+    conn.execute("""
+        INSERT OR REPLACE INTO diagnosis_cache (key, response_json, created_at, last_used_at, hits)
+        VALUES (?, ?, ?, ?, 0)
+    """, (key, response_json, now, now))
+    # LRU: remove as entradas menos usadas recentemente acima do limite
+    excess = conn.execute("SELECT COUNT(*) FROM diagnosis_cache").fetchone()[0] - CACHE_MAX_ENTRIES
+    if excess > 0:
+        conn.execute("""
+            DELETE FROM diagnosis_cache WHERE key IN (
+                SELECT key FROM diagnosis_cache ORDER BY last_used_at ASC LIMIT ?
+            )
+        """, (excess,))
+    return max(excess, 0)
+
+
+async def put(key, data):
+    evicted = await database.run(_put, key, json.dumps(data), int(time.time()))
+    stats["evictions"] += evicted
+
+
+async def snapshot():
+    entries = await database.fetchone("SELECT COUNT(*) FROM diagnosis_cache")
+    lookups = stats["hits"] + stats["misses"]
+    return {
+        **stats,
+        "entries": entries[0],
+        "hit_rate": round(stats["hits"] / lookups, 3) if lookups else 0.0,
+        "ttl_seconds": CACHE_TTL_SECONDS,
+        "max_entries": CACHE_MAX_ENTRIES,
+    }
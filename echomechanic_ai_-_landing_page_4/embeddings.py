@@ -0,0 +1,449 @@
+import os
+import re
+import sys
+import json
+import asyncio
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: só o lock do processo
+    fcntl = None
+
+import database
+import inference
+import model_scheduler
+import search
+
+# --- ÍNDICE DE EMBEDDINGS (RAG DO CHAT) ---
+# A pesquisa de texto (search.py) só encontra análises com as mesmas palavras:
+# "o motor aquece e cheira a queimado" não chega à análise de "falha de
+# lubrificação". Cada análise (máquina, diagnóstico, descrição e passos) passa a
+# ter também um embedding, e o chat vai buscar as mais próximas da pergunta.
+#   - Embedder trocável (ECHO_EMBEDDING_BACKEND): stub, por omissão, local e
+#     determinístico (feature hashing de palavras e trigramas, sem rede nem
+#     quota), ou gemini (text-embedding-004), opcional: cada análise nova e cada
+#     pergunta do chat passam a gastar um pedido da quota da chave.
+#   - Vetores normalizados em float16 num ficheiro só de acrescentar
+#     (EMBEDDINGS_DIR/<modelo>-<dim>.f16), lido por memmap: um milhão de
+#     análises a 256 dimensões são 512 MB em disco e só as linhas do
+#     utilizador são lidas.
+#   - A tabela analysis_embeddings (migração 012) liga cada análise à linha do
+#     ficheiro; o índice (user_email, model, historico_id, row) dá as linhas de
+#     um utilizador sem tocar no historico.
+#   - Um worker em background calcula os embeddings que faltam (análises novas,
+#     acordado pelo schedule() depois de cada INSERT, e o backfill das antigas,
+#     das mais recentes para as mais antigas). UPDATE/DELETE no historico apagam
+#     a ligação por trigger; o worker volta a calcular as alteradas.
+#   - Com um embedder remoto (gemini) o backfill das análises que já existiam no
+#     arranque só corre com ECHO_EMBEDDINGS_BACKFILL=1 (ou com python
+#     embeddings.py), e os blocos do worker ficam limitados a EMBED_BATCHES_PER_MINUTE:
+#     um arranque normal não gasta a quota da chave com o historico todo.
+#   - Os embeddings passam pelo scheduler da chave (quota partilhada com o
+#     modelo de texto) e pelo inference (vaga da pool, prioridade e timeout):
+#     o backfill corre em PRIORITY_BACKGROUND e a pergunta do chat em
+#     PRIORITY_CHAT, com um timeout curto e sem RAG se falhar.
+#   - Pesquisa: produto interno (= cosseno) com todas as linhas do utilizador em
+#     NumPy. Cada conta tem no máximo milhares de análises, por isso a força bruta
+#     fica em poucos ms e não há índice aproximado (IVF/HNSW) a manter.
+
+EMBEDDING_BACKEND = os.environ.get("ECHO_EMBEDDING_BACKEND", "stub")
+EMBEDDINGS_ENABLED = os.environ.get("ECHO_EMBEDDINGS", "1") == "1"
+# Só para embedders remotos (o stub calcula sempre as antigas: é local e não gasta quota)
+EMBEDDINGS_BACKFILL = os.environ.get("ECHO_EMBEDDINGS_BACKFILL", "0") == "1"
+EMBED_BATCHES_PER_MINUTE = float(os.environ.get("ECHO_EMBEDDINGS_RPM", "6"))
+EMBEDDINGS_DIR = os.environ.get("ECHO_EMBEDDINGS_DIR", "embeddings")
+EMBED_BATCH = 64
+EMBED_POLL_SECONDS = 60
+EMBED_RETRY_SECONDS = 30
+STUB_DIM = 256
+GEMINI_MODEL = "models/text-embedding-004"
+GEMINI_DIM = 768
+# Texto de cada análise que vai para o embedding (em caracteres)
+EMBED_MAX_CHARS = 2000
+NEAREST_DEFAULT = 8
+# Memória para as matrizes float32 dos utilizadores ativos (conversa seguida = sem
+# voltar a ler e converter os vetores do ficheiro)
+MATRIX_CACHE_MB = int(os.environ.get("ECHO_EMBEDDINGS_CACHE_MB", "128"))
+# A pergunta do chat espera no máximo isto pelo embedding (depois segue sem ele)
+EMBED_QUERY_TIMEOUT_SECONDS = float(os.environ.get("ECHO_EMBED_QUERY_TIMEOUT", "5"))
+
+stats = {"embedded": 0, "errors": 0, "queries": 0, "query_errors": 0, "matrix_hits": 0, "cleared": 0}
+
+_wakeup = None
+_worker_task = None
+_embedder = None
+_vectors = None
+_lock = threading.Lock()
+_WORD = re.compile(r"[^\W_]+")
+# Matrizes float32 por utilizador (ver _user_matrix)
+_matrices = OrderedDict()
+_matrices_lock = threading.Lock()
+
+
+# --- EMBEDDERS ---
+@functools.lru_cache(maxsize=65536)
+def _word_features(word, dim):
+    # Posições e pesos (com sinal, do hash) da palavra (1) e dos seus trigramas (0.5)
+    padded = f"#{word}#"
+    positions, weights = [], []
+    for feature, weight in [(word, 1.0)] + [(padded[i:i + 3], 0.5) for i in range(len(padded) - 2)]:
+        digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+        positions.append(digest % dim)
+        weights.append(weight if digest >> 63 else -weight)
+    return np.array(positions, dtype=np.intp), np.array(weights, dtype=np.float32)
+
+
+class StubEmbedder:
+    # Local e determinístico: o mesmo texto dá sempre o mesmo vetor. Palavras sem
+    # acentos (peso 1) e trigramas de letras (peso 0.5, apanham "rolamento" /
+    # "rolamentos"); não percebe sinónimos, mas textos com o mesmo vocabulário
+    # ficam próximos.
+    name = "stub"
+    remote = False
+
+    def __init__(self, dim=STUB_DIM):
+        self.dim = dim
+        self.model = f"stub-{dim}"
+        self.scheduler = model_scheduler.for_key("stub", 0, 0)
+
+    def embed(self, texts, query=False):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for index, text in enumerate(texts):
+            features = [_word_features(word, self.dim) for word in _WORD.findall(search.fold(text or ""))]
+            if features:
+                positions, weights = zip(*features)
+                vectors[index] = np.bincount(np.concatenate(positions), np.concatenate(weights), self.dim)
+        return _normalize(vectors)
+
+
+class GeminiEmbedder:
+    name = "gemini"
+    remote = True
+
+    def __init__(self, model=GEMINI_MODEL, dim=GEMINI_DIM):
+        import google.generativeai as genai
+        import model_client
+        api_key = model_client.require_api_key()
+        genai.configure(api_key=api_key)
+        self._genai = genai
+        self.model = model.split("/")[-1]
+        self._model_path = model
+        self.dim = dim
+        self.scheduler = model_scheduler.for_key(model_client.key_id(api_key))
+
+    def embed(self, texts, query=False):
+        result = self._genai.embed_content(model=self._model_path, content=list(texts),
+                                           task_type="retrieval_query" if query else "retrieval_document")
+        return _normalize(np.asarray(result["embedding"], dtype=np.float32).reshape(len(texts), self.dim))
+
+
+EMBEDDERS = {"gemini": GeminiEmbedder, "stub": StubEmbedder}
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+async def embed(texts, query=False, priority=inference.PRIORITY_BACKGROUND, timeout=None):
+    # Vetores dos textos, com a quota da chave (retries em 429/503) e uma vaga da pool
+    model = embedder()
+    return await model.scheduler.call(
+        [model.model],
+        lambda model_name, remaining: inference.run_blocking(model.embed, texts, query, timeout=remaining, priority=priority),
+        priority, timeout)
+
+
+def embedder():
+    global _embedder
+    if _embedder is None:
+        if EMBEDDING_BACKEND not in EMBEDDERS:
+            raise ValueError(f"ECHO_EMBEDDING_BACKEND desconhecido: {EMBEDDING_BACKEND} (opções: {', '.join(EMBEDDERS)})")
+        _embedder = EMBEDDERS[EMBEDDING_BACKEND]()
+    return _embedder
+
+
+# --- FICHEIRO DE VETORES ---
+class VectorFile:
+    # Vetores float16 [linhas, dim] num ficheiro só de acrescentar, lidos por memmap.
+    # Vários processos (workers do uvicorn, python embeddings.py, backfill) podem
+    # escrever no mesmo ficheiro: as escritas têm um flock e a linha de cada
+    # append só é lida com ele. Uma escrita interrompida a meio de uma linha é
+    # cortada no append seguinte (e na abertura).
+
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        self.row_bytes = dim * 2
+        self._map = None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "ab") as f:
+            self._end(f)
+
+    def _end(self, f):
+        # Com o lock do ficheiro: corta uma linha incompleta e devolve o número de linhas
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        size = f.seek(0, os.SEEK_END)
+        if size % self.row_bytes:
+            size = f.truncate(size - size % self.row_bytes)
+        return size // self.row_bytes
+
+    def rows(self):
+        return os.path.getsize(self.path) // self.row_bytes
+
+    def append(self, vectors):
+        # Devolve o número da primeira linha escrita (o lock sai ao fechar o ficheiro)
+        data = np.ascontiguousarray(vectors, dtype=np.float16).tobytes()
+        with open(self.path, "ab") as f:
+            first = self._end(f)
+            f.write(data)
+        return first
+
+    def clear(self, rows):
+        # Apaga (zeros) os vetores de análises apagadas, ex: conta eliminada
+        zero = bytes(self.row_bytes)
+        with open(self.path, "r+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            for row in rows:
+                f.seek(row * self.row_bytes)
+                f.write(zero)
+        self._map = None
+
+    def view(self, needed=0):
+        # memmap do ficheiro; volta a mapear se cresceu desde a última vez
+        if self._map is None or len(self._map) < needed:
+            rows = self.rows()
+            self._map = np.memmap(self.path, dtype=np.float16, mode="r", shape=(rows, self.dim)) if rows else np.zeros((0, self.dim), np.float16)
+        return self._map
+
+
+def vectors():
+    global _vectors
+    if _vectors is None:
+        model = embedder()
+        _vectors = VectorFile(os.path.join(EMBEDDINGS_DIR, f"{model.model}-{model.dim}.f16"), model.dim)
+    return _vectors
+
+
+# --- TEXTO DAS ANÁLISES ---
+def details(detalhes_json):
+    # (descrição, passos) do detalhes_json; vazios se não der
+    try:
+        data = json.loads(detalhes_json) if detalhes_json else {}
+    except ValueError:
+        return "", []
+    if not isinstance(data, dict):
+        return "", []
+    steps = data.get("steps") if isinstance(data.get("steps"), list) else []
+    return str(data.get("description") or ""), [str(step) for step in steps]
+
+
+def analysis_text(maquina_nome, diagnostico, detalhes_json):
+    description, steps = details(detalhes_json)
+    return f"{maquina_nome or ''}. {diagnostico or ''}. {description} {' '.join(steps)}"[:EMBED_MAX_CHARS]
+
+
+# --- WORKER ---
+def _pending(conn, model, before, limit, after=0):
+    # Análises sem embedding do modelo atual, das mais recentes para as mais antigas
+    return conn.execute("""
+        SELECT h.id, h.user_email, h.maquina_nome, h.diagnostico, h.detalhes_json
+        FROM historico h LEFT JOIN analysis_embeddings e ON e.historico_id = h.id AND e.model = ?
+        WHERE h.id < ? AND h.id > ? AND e.historico_id IS NULL AND h.user_email IS NOT NULL
+        ORDER BY h.id DESC LIMIT ?
+    """, (model, before, after, limit)).fetchall()
+
+
+def _last_id(conn):
+    return conn.execute("SELECT COALESCE(MAX(id), 0) FROM historico").fetchone()[0]
+
+
+def _check(conn, model, rows):
+    # Ligações para linhas que já não existem no ficheiro (ex: ficheiro apagado) voltam a ser calculadas
+    return conn.execute("DELETE FROM analysis_embeddings WHERE model=? AND row >= ?", (model, rows)).rowcount
+
+
+def _save(conn, model, batch, first):
+    conn.executemany("INSERT OR REPLACE INTO analysis_embeddings (historico_id, user_email, model, row) VALUES (?, ?, ?, ?)",
+                     [(row[0], row[1], model, first + index) for index, row in enumerate(batch)])
+
+
+def _texts(batch):
+    return [analysis_text(row[2], row[3], row[4]) for row in batch]
+
+
+def _store(conn, model, batch, matrix):
+    # Acrescenta os vetores e liga-os às análises na mesma transação; um rollback
+    # depois do append só deixa linhas sem ligação no ficheiro (nunca duas
+    # análises na mesma linha)
+    with _lock:
+        first = vectors().append(matrix)
+    _save(conn, model, batch, first)
+
+
+def embed_pending(conn, limit=None):
+    # Calcula os embeddings em falta de uma vez, sem a app (python embeddings.py
+    # e benchmarks); devolve quantos calculou
+    model = embedder()
+    total = 0
+    before = sys.maxsize
+    while limit is None or total < limit:
+        batch = _pending(conn, model.model, before, EMBED_BATCH)
+        if not batch:
+            break
+        before = batch[-1][0]
+        _store(conn, model.model, batch, model.embed(_texts(batch)))
+        conn.commit()
+        total += len(batch)
+        stats["embedded"] += len(batch)
+    return total
+
+
+async def _worker():
+    model = embedder()
+    removed = await database.run(_check, model.model, vectors().rows())
+    if removed:
+        print(f"DEBUG: {removed} embedding(s) sem vetor no ficheiro voltam a ser calculados")
+    # Embedder remoto sem backfill: só as análises gravadas depois do arranque
+    after = await database.run(_last_id) if model.remote and not EMBEDDINGS_BACKFILL else 0
+    pause = 60.0 / EMBED_BATCHES_PER_MINUTE if model.remote and EMBED_BATCHES_PER_MINUTE > 0 else 0
+    while True:
+        try:
+            _wakeup.clear()
+            before = sys.maxsize
+            while True:
+                batch = await database.run(_pending, model.model, before, EMBED_BATCH, after)
+                if not batch:
+                    break
+                before = batch[-1][0]
+                # O embedder (rede, no caso do Gemini) não ocupa as threads da BD
+                matrix = await embed(_texts(batch), priority=inference.PRIORITY_BACKGROUND)
+                await database.run(_store, model.model, batch, matrix)
+                stats["embedded"] += len(batch)
+                await asyncio.sleep(pause)
+            try:
+                await asyncio.wait_for(_wakeup.wait(), EMBED_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stats["errors"] += 1
+            print(f"ERRO EMBEDDINGS: {e}")
+            await asyncio.sleep(EMBED_RETRY_SECONDS)
+
+
+async def start():
+    global _wakeup, _worker_task
+    if not EMBEDDINGS_ENABLED:
+        return
+    _wakeup = asyncio.Event()
+    _worker_task = asyncio.create_task(_worker())
+
+
+async def stop():
+    global _worker_task
+    if _worker_task is not None:
+        _worker_task.cancel()
+        await asyncio.gather(_worker_task, return_exceptions=True)
+        _worker_task = None
+
+
+def schedule():
+    # Chamado depois de gravar análises: o worker calcula os embeddings novos já
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def rows_of(conn, email):
+    # Linhas do ficheiro com vetores de um utilizador (antes de apagar a conta)
+    return [r[0] for r in conn.execute("SELECT row FROM analysis_embeddings WHERE user_email=?", (email,))]
+
+
+def clear(rows):
+    if rows and EMBEDDINGS_ENABLED:
+        with _lock:
+            vectors().clear(rows)
+        stats["cleared"] += len(rows)
+
+
+# --- PESQUISA ---
+def _user_matrix(conn, email, model):
+    # (ids, matriz float32) dos vetores do utilizador. A cache é validada por
+    # (contagem, maior id, soma das linhas) no índice: análises novas, apagadas ou
+    # recalculadas mudam sempre pelo menos um dos três
+    key = conn.execute("SELECT count(*), max(historico_id), sum(row) FROM analysis_embeddings WHERE user_email=? AND model=?",
+                       (email, model)).fetchone()
+    with _matrices_lock:
+        cached = _matrices.get(email)
+        if cached is not None and cached[0] == key:
+            _matrices.move_to_end(email)
+            stats["matrix_hits"] += 1
+            return cached[1], cached[2]
+    if not key[0]:
+        return None, None
+    ids, positions = np.array(conn.execute("SELECT historico_id, row FROM analysis_embeddings WHERE user_email=? AND model=?",
+                                           (email, model)).fetchall(), dtype=np.int64).T
+    matrix = np.asarray(vectors().view(int(positions.max()) + 1))[positions].astype(np.float32)
+    with _matrices_lock:
+        _matrices[email] = (key, ids, matrix)
+        _matrices.move_to_end(email)
+        while len(_matrices) > 1 and sum(entry[2].nbytes for entry in _matrices.values()) > MATRIX_CACHE_MB * 1e6:
+            _matrices.popitem(last=False)
+    return ids, matrix
+
+
+def _nearest(conn, email, query, k, exclude):
+    ids, matrix = _user_matrix(conn, email, embedder().model)
+    if ids is None:
+        return []
+    scores = matrix @ query
+    if exclude:
+        scores[np.isin(ids, list(exclude))] = -np.inf
+    k = min(k, int(np.isfinite(scores).sum()))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [(int(ids[i]), float(scores[i])) for i in top]
+
+
+async def nearest(email, text, k=NEAREST_DEFAULT, exclude=()):
+    # [(historico_id, similaridade)] das análises do utilizador mais próximas do texto
+    if not EMBEDDINGS_ENABLED or not text:
+        return []
+    stats["queries"] += 1
+    try:
+        query = (await embed([text], True, inference.PRIORITY_CHAT, EMBED_QUERY_TIMEOUT_SECONDS))[0]
+        return await database.run(_nearest, email, query, k, set(exclude))
+    except Exception as e:
+        # Sem quota, rede ou a demorar: o chat segue só com a pesquisa de texto
+        stats["query_errors"] += 1
+        print(f"ERRO EMBEDDINGS (pergunta): {e}")
+        return []
+
+
+def snapshot():
+    if not EMBEDDINGS_ENABLED:
+        return {**stats, "enabled": False}
+    model = embedder()
+    return {**stats, "enabled": True, "backend": model.name, "model": model.model, "dim": model.dim,
+            "file_rows": vectors().rows(), "worker": _worker_task is not None}
+
+
+if __name__ == "__main__":
+    # python embeddings.py -> calcula já os embeddings em falta (sem arrancar a app)
+    import migrations
+    conn = database.connect()
+    migrations.migrate(conn)
+    print(f"Embeddings calculados: {embed_pending(conn)}")
+    conn.close()
@@ -0,0 +1,198 @@
+import os
+import heapq
+import asyncio
+import functools
+import contextlib
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# --- CAMADA DE EXECUÇÃO DA IA ---
+# O SDK do Gemini (model.generate_content) é síncrono. Chamado diretamente dentro
+# de um endpoint "async def" bloqueia o event loop do uvicorn e todos os outros
+# pedidos (páginas, histórico, PDFs) ficam à espera da resposta da IA.
+# Aqui as chamadas correm numa thread pool limitada, com timeout por chamada e
+# um limite de concorrência configurável por variáveis de ambiente.
+
+MODEL_MAX_CONCURRENCY = int(os.environ.get("ECHO_MODEL_MAX_CONCURRENCY", "8"))
+MODEL_TIMEOUT_SECONDS = float(os.environ.get("ECHO_MODEL_TIMEOUT", "90"))
+
+# Prioridade de cada pedido ao modelo (menor = primeiro): o chat é interativo e
+# passa à frente das análises; as tarefas de fundo (fila de análises, resumos do
+# chat) só usam o que sobra. Vale para a espera por uma vaga na pool e para a
+# espera por quota do model_scheduler (que acontece antes de ocupar a vaga).
+PRIORITY_CHAT = 0
+PRIORITY_ANALYSIS = 5
+PRIORITY_BACKGROUND = 10
+
+_executor = ThreadPoolExecutor(max_workers=MODEL_MAX_CONCURRENCY, thread_name_prefix="gemini")
+
+# Métricas do streaming: first_token_ms = tempo do pedido até ao primeiro pedaço de texto
+stream_stats = {"streams": 0, "cancelled": 0, "errors": 0, "first_tokens": 0, "first_token_ms_total": 0.0, "first_token_ms_last": None}
+
+
+class ModelTimeoutError(Exception):
+    pass
+
+
+class PriorityLimiter:
+    # Semáforo com fila por prioridade: quando uma vaga fica livre vai para o
+    # pedido em espera com menor prioridade (por ordem de chegada no empate)
+    def __init__(self, limit):
+        self.free = limit
+        self._waiters = []
+        self._order = itertools.count()
+
+    async def acquire(self, priority):
+        if self.free > 0 and not self._waiters:
+            self.free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # A vaga pode ter chegado mesmo antes do cancelamento: devolve-a
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.free += 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+_limiter = PriorityLimiter(MODEL_MAX_CONCURRENCY)
+
+
+async def run_blocking(func, *args, timeout=None, priority=PRIORITY_ANALYSIS, **kwargs):
+    # Corre qualquer função síncrona da IA fora do event loop.
+    # O limitador garante que nunca há mais de MODEL_MAX_CONCURRENCY chamadas em voo;
+    # os restantes pedidos esperam aqui sem bloquear o loop, por ordem de prioridade.
+    if timeout is None:
+        timeout = MODEL_TIMEOUT_SECONDS
+    async with _limiter.slot(priority):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            # Nota: a thread continua até o SDK devolver, mas o pedido HTTP já não fica preso.
+            raise ModelTimeoutError(f"A chamada ao modelo excedeu {timeout:.0f}s")
+
+
+async def open_stream(open_func, priority=PRIORITY_CHAT, timeout=None):
+    # Ocupa uma vaga e abre o stream (o pedido HTTP) numa thread. Devolve o
+    # objeto do SDK com a vaga ainda ocupada (stream_content liberta-a no fim);
+    # se a abertura falhar (ex: 429, o scheduler tenta outra vez) a vaga é libertada já
+    if timeout is None:
+        timeout = MODEL_TIMEOUT_SECONDS
+    await _limiter.acquire(priority)
+    try:
+        return await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(_executor, open_func), timeout)
+    except asyncio.TimeoutError:
+        _limiter.release()
+        raise ModelTimeoutError(f"A chamada ao modelo excedeu {timeout:.0f}s")
+    except BaseException:
+        _limiter.release()
+        raise
+
+
+async def generate_content(model, *args, timeout=None, priority=PRIORITY_ANALYSIS, **kwargs):
+    # O ModelClient (model_client.py) espera pela quota e tenta outra vez fora da
+    # pool; outro objeto com generate_content síncrono corre uma só vez
+    if hasattr(model, "generate"):
+        return await model.generate(*args, timeout=timeout, priority=priority, **kwargs)
+    return await run_blocking(model.generate_content, *args, timeout=timeout, priority=priority, **kwargs)
+
+
+async def stream_content(model, *args, timeout=None, priority=PRIORITY_CHAT, **kwargs):
+    # Geração em streaming (stream=True): o iterador síncrono do SDK corre numa
+    # thread da pool e cada pedaço de texto passa para o event loop por uma
+    # asyncio.Queue assim que chega. O timeout conta entre pedaços. Se quem
+    # consome parar (ex: o cliente fechou a ligação), a thread deixa de ler e
+    # fecha o stream do SDK no pedaço seguinte, em vez de gerar até ao fim.
+    if timeout is None:
+        timeout = MODEL_TIMEOUT_SECONDS
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    cancelled = threading.Event()
+    done = object()
+
+    stream_stats["streams"] += 1
+    try:
+        if hasattr(model, "open_stream"):
+            response = await model.open_stream(*args, timeout=timeout, priority=priority, **kwargs)
+        else:
+            response = await open_stream(functools.partial(model.generate_content, *args, stream=True, **kwargs), priority, timeout)
+    except Exception:
+        stream_stats["errors"] += 1
+        raise
+
+    def produce():
+        try:
+            for chunk in response:
+                if cancelled.is_set():
+                    break
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Pedaço bloqueado pelos filtros de segurança
+                    continue
+                if text:
+                    loop.call_soon_threadsafe(queue.put_nowait, text)
+            close = getattr(response, "close", None)
+            if cancelled.is_set() and close:
+                close()
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    # A vaga ocupada pelo open_stream fica até ao fim do stream
+    try:
+        loop.run_in_executor(_executor, produce)
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                stream_stats["errors"] += 1
+                raise ModelTimeoutError(f"O modelo ficou {timeout:.0f}s sem enviar texto")
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                stream_stats["errors"] += 1
+                raise item
+            yield item
+    finally:
+        cancelled.set()
+        _limiter.release()
+
+
+def record_first_token(seconds):
+    stream_stats["first_tokens"] += 1
+    stream_stats["first_token_ms_total"] += seconds * 1000
+    stream_stats["first_token_ms_last"] = round(seconds * 1000, 1)
+
+
+def stream_snapshot():
+    snapshot = dict(stream_stats)
+    total = snapshot.pop("first_token_ms_total")
+    snapshot["first_token_ms_avg"] = round(total / snapshot["first_tokens"], 1) if snapshot["first_tokens"] else None
+    return snapshot
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,234 @@
+import re
+import json
+import math
+import calendar
+import datetime
+import functools
+
+import database
+
+# --- SÉRIES TEMPORAIS POR MÁQUINA ---
+# O historico guarda cada análise como texto livre: diagnostico, confianca
+# ("85%", "Alta (95%)"), custo dentro do detalhes_json e a máquina pelo nome.
+# Uma tendência ("a curtose deste compressor está a subir?") obrigava a ler e
+# fazer parse de todas as linhas em Python. A tabela machine_metrics (migração
+# 009) guarda os mesmos factos já normalizados e numéricos:
+#   - maquina_id (maquinas.id, quando a máquina está registada) e o nome;
+#   - ts em segundos epoch (hora gravada em data_analise, sem fuso);
+#   - confiança 0-1, limites do custo em euros, horas de paragem, classe da falha;
+#   - as características espectrais principais (features_json).
+# A chave primária (user_email, maquina_nome, ts, historico_id) numa tabela
+# WITHOUT ROWID deixa as linhas de cada máquina juntas e ordenadas no disco:
+# a tendência de anos de dados é uma leitura sequencial com GROUP BY por balde.
+# É preenchida na mesma transação do INSERT no historico (record) e, para as
+# linhas antigas, pelo backfill da migração 009.
+
+TREND_MAX_POINTS = 1000
+TREND_DEFAULT_POINTS = 200
+BACKFILL_BATCH = 5000
+
+METRICS_INSERT_SQL = """
+    INSERT OR REPLACE INTO machine_metrics (user_email, maquina_nome, ts, historico_id, maquina_id, confidence,
+        cost_min, cost_max, repair_hours, fault_class, rms_db, kurtosis, crest_factor, spectral_centroid_hz)
+    VALUES (?, ?, ?, ?, (SELECT id FROM maquinas WHERE user_email=? AND nome=? ORDER BY id LIMIT 1),
+        ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Classe da falha a partir do texto do diagnóstico (a primeira que bater)
+FAULT_CLASSES = [(name, re.compile(pattern)) for name, pattern in [
+    ("invalida", r"inválid|invalid|ruído ambiente|\bvoz\b"),
+    ("normal", r"\bnormal\b|sem anomalia|sem falha|saudável"),   # "anormal" não conta
+    ("lubrificacao", r"lubrifica"),
+    ("rolamento", r"rolamento|bearing"),
+    ("desalinhamento", r"desalinhamento|misalign"),
+    ("desequilibrio", r"desequil[íi]brio|unbalance|imbalance"),
+    ("engrenagem", r"engrenage|\bdentes?\b|gear"),
+    ("correia", r"correia|belt"),
+    ("cavitacao", r"cavita[çc][ãa]o"),
+    ("folga", r"folga|soltura|looseness"),
+    ("eletrica", r"el[ée]tric|electric"),
+]]
+
+# Classes que não são avaria (o resto, incluindo "outra", conta como falha)
+NON_FAULT_CLASSES = ("normal", "invalida")
+NON_FAULT_SQL = ", ".join(f"'{name}'" for name in NON_FAULT_CLASSES)
+
+# Confianças escritas por extenso pelo modelo
+CONFIDENCE_WORDS = [("muito alta", 0.95), ("alta", 0.85), ("média", 0.6), ("media", 0.6), ("muito baixa", 0.15), ("baixa", 0.3)]
+
+_NUMBER = re.compile(r"\d+(?:[.\s]\d{3})*(?:[.,]\d+)?")
+_HOURS = re.compile(r"(\d+(?:[.,]\d+)?)\s*(min|h|hora|dia|d\b|semana)?", re.IGNORECASE)
+_HOUR_UNITS = {"min": 1 / 60, "h": 1, "hora": 1, "d": 24, "dia": 24, "semana": 168}
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+# Os textos do modelo repetem-se muito ("85%", "Rolamento", "2h - 4h"): o
+# backfill de um milhão de linhas faz parse de cada texto diferente uma vez
+_parse_cache = functools.lru_cache(maxsize=4096)
+
+
+def _float(text):
+    # "1.200" / "1 200" (milhares) e "1,5" (decimal) -> float
+    text = re.sub(r"[.\s](?=\d{3}\b)", "", text)
+    return float(text.replace(",", "."))
+
+
+@_parse_cache
+def parse_confidence(value):
+    # "85%", "Alta (95%)", "0.85", "Alta" -> 0.85 / 0.95 / 0.85 / 0.85; None se não der
+    if value is None:
+        return None
+    text = str(value).strip().lower()
+    match = re.search(r"(\d+(?:[.,]\d+)?)\s*%", text) or re.fullmatch(r"(\d+(?:[.,]\d+)?)", text)
+    if match:
+        number = float(match.group(1).replace(",", "."))
+        number = number / 100 if "%" in text or number > 1 else number
+        return round(min(max(number, 0.0), 1.0), 4)
+    for word, number in CONFIDENCE_WORDS:
+        if word in text:
+            return number
+    return None
+
+
+@_parse_cache
+def parse_cost(value):
+    # "250€ - 400€" -> (250.0, 400.0); "0€" -> (0.0, 0.0); sem números -> (None, None)
+    numbers = [_float(n) for n in _NUMBER.findall(str(value or ""))]
+    if not numbers:
+        return None, None
+    return min(numbers[:2]), max(numbers[:2])
+
+
+@_parse_cache
+def parse_hours(value):
+    # Limite superior do tempo de paragem em horas: "2h - 4h" -> 4, "30 min" -> 0.5, "1 dia" -> 24
+    hours = []
+    text = str(value or "").lower()
+    matches = _HOURS.findall(text)
+    # "2 - 4h": a unidade do último número vale para os que não têm unidade
+    unit = next((u for _, u in reversed(matches) if u), "h")
+    for number, number_unit in matches:
+        hours.append(float(number.replace(",", ".")) * _HOUR_UNITS[(number_unit or unit).lower()])
+    return max(hours) if hours else None
+
+
+@_parse_cache
+def fault_class(diagnosis):
+    text = str(diagnosis or "").lower()
+    for name, pattern in FAULT_CLASSES:
+        if pattern.search(text):
+            return name
+    return "outra"
+
+
+def epoch(data_analise):
+    # "YYYY-MM-DD HH:MM" (ou só a data) -> segundos, tratando a hora gravada como UTC
+    text = str(data_analise or "").strip()
+    if len(text) == 16 and text[4] == "-" and text[10] == " ":
+        # Formato gravado pelo historico_row: sem strptime (é o caminho quente do backfill)
+        try:
+            day = datetime.date(int(text[:4]), int(text[5:7]), int(text[8:10])).toordinal() - _EPOCH_ORDINAL
+            return day * 86400 + int(text[11:13]) * 3600 + int(text[14:16]) * 60
+        except ValueError:
+            pass
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return calendar.timegm(datetime.datetime.strptime(text, fmt).timetuple())
+        except ValueError:
+            continue
+    return None
+
+
+def metrics_row(historico_id, email, machine_name, data_analise, diagnostico, confianca, detalhes_json, features_json):
+    # Parâmetros do METRICS_INSERT_SQL; None se a linha não tiver data utilizável
+    ts = epoch(data_analise)
+    if ts is None:
+        return None
+    try:
+        details = json.loads(detalhes_json) if detalhes_json else {}
+    except ValueError:
+        details = {}
+    try:
+        features = json.loads(features_json) if features_json else {}
+    except ValueError:
+        features = {}
+    cost_min, cost_max = parse_cost(details.get("estimated_cost"))
+    return (email, machine_name, ts, historico_id, email, machine_name,
+            parse_confidence(confianca), cost_min, cost_max, parse_hours(details.get("repair_time")),
+            fault_class(diagnostico), features.get("rms_db"), features.get("kurtosis"),
+            features.get("crest_factor"), features.get("spectral_centroid_hz"))
+
+
+def record(conn, historico_ids, rows):
+    # Chamado na transação que insere no historico; rows pela ordem do HISTORICO_INSERT_SQL
+    # (user_email, maquina_nome, data_analise, diagnostico, confianca, detalhes_json, audio_path, features_json).
+    # Devolve as linhas gravadas (metrics_row), para o resumo do dashboard
+    params = []
+    for historico_id, (email, machine_name, data_analise, diagnostico, confianca, detalhes_json, _, features_json) in zip(historico_ids, rows):
+        row = metrics_row(historico_id, email, machine_name, data_analise, diagnostico, confianca, detalhes_json, features_json)
+        if row is not None:
+            params.append(row)
+    conn.executemany(METRICS_INSERT_SQL, params)
+    return params
+
+
+def backfill(conn, batch=BACKFILL_BATCH):
+    # Linhas do historico que ainda não estão em machine_metrics (idempotente)
+    last_id = 0
+    total = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, user_email, maquina_nome, data_analise, diagnostico, confianca, detalhes_json, features_json "
+            "FROM historico WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch)).fetchall()
+        if not rows:
+            return total
+        last_id = rows[-1][0]
+        params = [row for row in (metrics_row(*r) for r in rows) if row is not None]
+        # INSERT OR IGNORE: não substitui o que já foi gravado pelo record
+        conn.executemany(METRICS_INSERT_SQL.replace("INSERT OR REPLACE", "INSERT OR IGNORE"), params)
+        total += len(params)
+
+
+def link_machine(conn, machine_id, email, machine_name):
+    # Máquina registada depois das análises: as linhas antigas passam a ter o maquina_id
+    conn.execute("UPDATE machine_metrics SET maquina_id=? WHERE user_email=? AND maquina_nome=? AND maquina_id IS NULL",
+                 (machine_id, email, machine_name))
+
+
+def _trend(conn, email, machine_name, start, end, points, bucket_seconds):
+    where = "user_email=? AND maquina_nome=? AND ts BETWEEN ? AND ?"
+    if start is None or end is None:
+        first, last = conn.execute("SELECT MIN(ts), MAX(ts) FROM machine_metrics WHERE user_email=? AND maquina_nome=?",
+                                   (email, machine_name)).fetchone()
+        if first is None:
+            return {"bucket_seconds": bucket_seconds, "points": []}
+        start = first if start is None else start
+        end = last if end is None else end
+    if not bucket_seconds:
+        # Baldes de tamanho fixo (alinhados a múltiplos do tamanho, desde 1970) para
+        # não passar de `points` pontos; mínimo 1 hora
+        bucket_seconds = max(3600, math.ceil((end - start + 1) / points))
+    rows = conn.execute(f"""
+        SELECT ts / ? AS bucket, COUNT(*), AVG(confidence), MIN(confidence), MAX(confidence),
+               AVG(cost_max), MAX(cost_max), AVG(rms_db), MAX(rms_db), AVG(kurtosis), MAX(kurtosis),
+               AVG(crest_factor), AVG(spectral_centroid_hz),
+               SUM(fault_class NOT IN ({NON_FAULT_SQL}))
+        FROM machine_metrics WHERE {where}
+        GROUP BY bucket ORDER BY bucket
+    """, (bucket_seconds, email, machine_name, start, end)).fetchall()
+    return {
+        "bucket_seconds": bucket_seconds,
+        "points": [{
+            "t": r[0] * bucket_seconds, "n": r[1],
+            "confidence": {"avg": r[2], "min": r[3], "max": r[4]},
+            "cost_max": {"avg": r[5], "max": r[6]},
+            "rms_db": {"avg": r[7], "max": r[8]},
+            "kurtosis": {"avg": r[9], "max": r[10]},
+            "crest_factor": r[11],
+            "spectral_centroid_hz": r[12],
+            "faults": r[13],
+        } for r in rows],
+    }
+
+
+async def trend(email, machine_name, start=None, end=None, points=TREND_DEFAULT_POINTS, bucket_seconds=None):
+    points = max(1, min(points, TREND_MAX_POINTS))
+    return await database.run(_trend, email, machine_name, start, end, points, bucket_seconds)
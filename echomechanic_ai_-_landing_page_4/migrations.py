@@ -0,0 +1,266 @@
+import database
+import machine_trends
+import dashboard_summary
+
+# --- MIGRAÇÕES DE ESQUEMA ---
+# Substituem os blocos "try: ALTER TABLE ... except: pass" do init_db.
+# A versão aplicada fica guardada em PRAGMA user_version; cada migração corre
+# uma única vez, por ordem, numa transação. Para alterar o esquema basta
+# acrescentar uma nova entrada no fim de MIGRATIONS (nunca editar as antigas).
+# As migrações só têm SQL escrito aqui (nada de funções dos módulos, que mudam
+# com o tempo): uma base antiga passa sempre pelos mesmos passos. Os dados que
+# precisam do código atual (BACKFILLS) são calculados no fim, com o esquema já
+# na última versão.
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_column(conn, table, column, ddl):
+    # Bases de dados antigas podem já ter a coluna (criada pelo init_db antigo)
+    if column not in _columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+def _001_base_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT UNIQUE, password TEXT, nome TEXT, role TEXT, empresa TEXT, notificacoes_alertas INTEGER DEFAULT 1, notificacoes_relatorios INTEGER DEFAULT 0, preferencia_ia TEXT DEFAULT 'simples')''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS maquinas (id INTEGER PRIMARY KEY AUTOINCREMENT, user_email TEXT, nome TEXT, marca TEXT, modelo TEXT, categoria TEXT, data_instalacao TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS historico (id INTEGER PRIMARY KEY AUTOINCREMENT, user_email TEXT, maquina_nome TEXT, data_analise TEXT, diagnostico TEXT, confianca TEXT, detalhes_json TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS chat_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, user_email TEXT, role TEXT, content TEXT, timestamp TEXT, session_id INTEGER)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS chat_sessions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_email TEXT, title TEXT, created_at TEXT)''')
+    # Colunas acrescentadas depois da primeira versão
+    _add_column(conn, "users", "notificacoes_alertas", "INTEGER DEFAULT 1")
+    _add_column(conn, "users", "notificacoes_relatorios", "INTEGER DEFAULT 0")
+    _add_column(conn, "users", "preferencia_ia", "TEXT DEFAULT 'simples'")
+    _add_column(conn, "chat_messages", "session_id", "INTEGER")
+    _add_column(conn, "historico", "audio_path", "TEXT")
+
+
+def _002_indexes(conn):
+    # /api/activity filtra por user_email + data_analise
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_historico_user_data ON historico (user_email, data_analise)")
+    # /api/history e o contexto do chat ordenam por id dentro do utilizador
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_historico_user_id ON historico (user_email, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_maquinas_user ON maquinas (user_email)")
+    # Memória do chat e contagens por sessão
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_session_id ON chat_messages (session_id, id)")
+    # /api/chat/history filtra por utilizador + sessão
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_user_session ON chat_messages (user_email, session_id, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_id ON chat_sessions (user_email, id)")
+
+
+def _003_history_filter_indexes(conn):
+    # Filtros de /api/history por máquina e diagnóstico, com paginação por id
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_historico_user_maquina_id ON historico (user_email, maquina_nome, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_historico_user_diag_id ON historico (user_email, diagnostico, id)")
+
+
+def _004_audio_blobs(conn):
+    # Armazém de áudio endereçado por conteúdo (ver audio_store.py)
+    conn.execute("""CREATE TABLE IF NOT EXISTS audio_blobs (sha256 TEXT PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mime_type TEXT, touched_at INTEGER)""")
+    # Contagem de referências do GC: historico.audio_path -> audio_blobs.path
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_historico_audio_path ON historico (audio_path)")
+
+
+def _005_diagnosis_cache(conn):
+    # Cache de respostas do modelo (ver diagnosis_cache.py)
+    conn.execute("""CREATE TABLE IF NOT EXISTS diagnosis_cache (key TEXT PRIMARY KEY, response_json TEXT, created_at INTEGER, last_used_at INTEGER, hits INTEGER DEFAULT 0)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_diagnosis_cache_lru ON diagnosis_cache (last_used_at)")
+
+
+def _006_audio_features(conn):
+    # Características espectrais compactas de cada análise (ver audio_features.py)
+    _add_column(conn, "historico", "features_json", "TEXT")
+
+
+def _007_analysis_jobs(conn):
+    # Fila de análises em background (ver analysis_jobs.py)
+    conn.execute("""CREATE TABLE IF NOT EXISTS analysis_jobs (id TEXT PRIMARY KEY, user_email TEXT, status TEXT, priority INTEGER DEFAULT 0, params_json TEXT, audio_path TEXT, result_json TEXT, error TEXT, attempts INTEGER DEFAULT 0, created_at REAL, started_at REAL, finished_at REAL)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_queue ON analysis_jobs (status, priority, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_audio_path ON analysis_jobs (audio_path)")
+    # Plano de subscrição (Básico/Profissional/...): define a prioridade na fila
+    _add_column(conn, "users", "plano", "TEXT DEFAULT 'basico'")
+
+
+def _008_chat_summaries(conn):
+    # Resumo incremental das mensagens antigas de cada conversa (ver chat_context.py)
+    _add_column(conn, "chat_sessions", "summary", "TEXT")
+    _add_column(conn, "chat_sessions", "summary_upto_id", "INTEGER DEFAULT 0")
+    # Tokens (estimados) de cada pedido ao modelo, na linha da resposta
+    _add_column(conn, "chat_messages", "prompt_tokens", "INTEGER")
+    _add_column(conn, "chat_messages", "completion_tokens", "INTEGER")
+
+
+def _009_machine_metrics(conn):
+    # Série temporal normalizada de cada análise (ver machine_trends.py); as
+    # análises já gravadas são copiadas no fim (BACKFILLS)
+    conn.execute("""CREATE TABLE IF NOT EXISTS machine_metrics (user_email TEXT, maquina_nome TEXT, ts INTEGER, historico_id INTEGER, maquina_id INTEGER REFERENCES maquinas (id), confidence REAL, cost_min REAL, cost_max REAL, repair_hours REAL, fault_class TEXT, rms_db REAL, kurtosis REAL, crest_factor REAL, spectral_centroid_hz REAL, PRIMARY KEY (user_email, maquina_nome, ts, historico_id)) WITHOUT ROWID""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_machine_metrics_maquina_ts ON machine_metrics (maquina_id, ts)")
+
+
+def _010_dashboard_summary(conn):
+    # Agregados do dashboard mantidos a cada INSERT (ver dashboard_summary.py);
+    # calculados para as análises antigas no fim (BACKFILLS)
+    conn.execute("""CREATE TABLE IF NOT EXISTS machine_summary (user_email TEXT, maquina_nome TEXT, analyses INTEGER, faults INTEGER, last_ts INTEGER, last_historico_id INTEGER, last_fault_class TEXT, last_confidence REAL, last_cost_min REAL, last_cost_max REAL, PRIMARY KEY (user_email, maquina_nome)) WITHOUT ROWID""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS user_summary (user_email TEXT PRIMARY KEY, analyses INTEGER, faults INTEGER, machines INTEGER, open_faults INTEGER, machines_at_risk INTEGER, cost_exposure_min REAL, cost_exposure_max REAL) WITHOUT ROWID""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS daily_summary (user_email TEXT, day INTEGER, analyses INTEGER, faults INTEGER, PRIMARY KEY (user_email, day)) WITHOUT ROWID""")
+
+
+def _011_search(conn):
+    # Índices FTS5 de historico e chat_messages, com triggers (ver search.py).
+    # rowid = (número do dono em search_owners << 32) | id
+    conn.execute("CREATE TABLE IF NOT EXISTS search_owners (id INTEGER PRIMARY KEY, email TEXT NOT NULL UNIQUE)")
+    conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS historico_fts USING fts5(maquina, diagnostico, descricao, passos, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4')""")
+    conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS chat_fts USING fts5(content, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4')""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS historico_fts_insert AFTER INSERT ON historico WHEN new.user_email IS NOT NULL BEGIN
+        INSERT OR IGNORE INTO search_owners (email) VALUES (new.user_email);
+        INSERT INTO historico_fts (rowid, maquina, diagnostico, descricao, passos) VALUES (
+            ((SELECT id FROM search_owners WHERE email = new.user_email) << 32 | new.id), new.maquina_nome, new.diagnostico,
+            CASE WHEN json_valid(new.detalhes_json) THEN json_extract(new.detalhes_json, '$.description') END,
+            CASE WHEN json_valid(new.detalhes_json) AND json_type(new.detalhes_json, '$.steps') = 'array'
+                 THEN (SELECT group_concat(value, ' ') FROM json_each(new.detalhes_json, '$.steps')) END);
+    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS historico_fts_delete AFTER DELETE ON historico BEGIN
+        DELETE FROM historico_fts WHERE rowid = ((SELECT id FROM search_owners WHERE email = old.user_email) << 32 | old.id);
+    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS historico_fts_update AFTER UPDATE OF user_email, maquina_nome, diagnostico, detalhes_json ON historico BEGIN
+        DELETE FROM historico_fts WHERE rowid = ((SELECT id FROM search_owners WHERE email = old.user_email) << 32 | old.id);
+        INSERT OR IGNORE INTO search_owners (email) SELECT new.user_email WHERE new.user_email IS NOT NULL;
+        INSERT INTO historico_fts (rowid, maquina, diagnostico, descricao, passos) VALUES (
+            ((SELECT id FROM search_owners WHERE email = new.user_email) << 32 | new.id), new.maquina_nome, new.diagnostico,
+            CASE WHEN json_valid(new.detalhes_json) THEN json_extract(new.detalhes_json, '$.description') END,
+            CASE WHEN json_valid(new.detalhes_json) AND json_type(new.detalhes_json, '$.steps') = 'array'
+                 THEN (SELECT group_concat(value, ' ') FROM json_each(new.detalhes_json, '$.steps')) END);
+    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS chat_fts_insert AFTER INSERT ON chat_messages WHEN new.user_email IS NOT NULL BEGIN
+        INSERT OR IGNORE INTO search_owners (email) VALUES (new.user_email);
+        INSERT INTO chat_fts (rowid, content) VALUES (((SELECT id FROM search_owners WHERE email = new.user_email) << 32 | new.id), new.content);
+    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS chat_fts_delete AFTER DELETE ON chat_messages BEGIN
+        DELETE FROM chat_fts WHERE rowid = ((SELECT id FROM search_owners WHERE email = old.user_email) << 32 | old.id);
+    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS chat_fts_update AFTER UPDATE OF user_email, content ON chat_messages BEGIN
+        DELETE FROM chat_fts WHERE rowid = ((SELECT id FROM search_owners WHERE email = old.user_email) << 32 | old.id);
+        INSERT OR IGNORE INTO search_owners (email) SELECT new.user_email WHERE new.user_email IS NOT NULL;
+        INSERT INTO chat_fts (rowid, content) VALUES (((SELECT id FROM search_owners WHERE email = new.user_email) << 32 | new.id), new.content);
+    END""")
+    # Linhas já existentes, com os segmentos juntos num só (pesquisas rápidas desde o início)
+    conn.execute("INSERT OR IGNORE INTO search_owners (email) SELECT DISTINCT user_email FROM historico WHERE user_email IS NOT NULL")
+    conn.execute("INSERT OR IGNORE INTO search_owners (email) SELECT DISTINCT user_email FROM chat_messages WHERE user_email IS NOT NULL")
+    conn.execute("""INSERT INTO historico_fts (rowid, maquina, diagnostico, descricao, passos)
+        SELECT ((SELECT id FROM search_owners WHERE email = h.user_email) << 32 | h.id), h.maquina_nome, h.diagnostico,
+            CASE WHEN json_valid(h.detalhes_json) THEN json_extract(h.detalhes_json, '$.description') END,
+            CASE WHEN json_valid(h.detalhes_json) AND json_type(h.detalhes_json, '$.steps') = 'array'
+                 THEN (SELECT group_concat(value, ' ') FROM json_each(h.detalhes_json, '$.steps')) END
+        FROM historico h WHERE h.user_email IS NOT NULL""")
+    conn.execute("""INSERT INTO chat_fts (rowid, content)
+        SELECT ((SELECT id FROM search_owners WHERE email = m.user_email) << 32 | m.id), m.content
+        FROM chat_messages m WHERE m.user_email IS NOT NULL""")
+    conn.execute("INSERT INTO historico_fts (historico_fts) VALUES ('optimize')")
+    conn.execute("INSERT INTO chat_fts (chat_fts) VALUES ('optimize')")
+
+
+def _012_embeddings(conn):
+    # Ligação análise -> linha do ficheiro de vetores (ver embeddings.py; o
+    # backfill é feito pelo worker, em background)
+    conn.execute("""CREATE TABLE IF NOT EXISTS analysis_embeddings (historico_id INTEGER PRIMARY KEY, user_email TEXT NOT NULL, model TEXT NOT NULL, row INTEGER NOT NULL)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_embeddings_user ON analysis_embeddings (user_email, model, historico_id, row)")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS analysis_embeddings_delete AFTER DELETE ON historico BEGIN
+        DELETE FROM analysis_embeddings WHERE historico_id = old.id;
+    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS analysis_embeddings_update AFTER UPDATE OF user_email, maquina_nome, diagnostico, detalhes_json ON historico BEGIN
+        DELETE FROM analysis_embeddings WHERE historico_id = old.id;
+    END""")
+
+
+def _013_audio_fingerprints(conn):
+    # Assinaturas espectrais e índice IVF dos casos semelhantes (ver
+    # audio_fingerprints.py; o backfill das gravações antigas é o CLI do módulo).
+    # A rowid é a linha do ficheiro: o índice por célula já dá as linhas a ler
+    conn.execute("""CREATE TABLE IF NOT EXISTS audio_fingerprints (row INTEGER PRIMARY KEY, audio_path TEXT NOT NULL UNIQUE, cell INTEGER NOT NULL DEFAULT 0)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_audio_fingerprints_cell ON audio_fingerprints (cell)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS audio_fingerprint_cells (cell INTEGER PRIMARY KEY, generation INTEGER NOT NULL, centroid BLOB NOT NULL)""")
+    # A assinatura vive enquanto alguma análise referir a gravação
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS historico_fingerprint_delete AFTER DELETE ON historico
+        WHEN OLD.audio_path IS NOT NULL AND NOT EXISTS (SELECT 1 FROM historico WHERE audio_path = OLD.audio_path)
+        BEGIN
+            DELETE FROM audio_fingerprints WHERE audio_path = OLD.audio_path;
+        END""")
+    # audio_store.import_legacy reescreve os caminhos antigos para o armazém
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS historico_fingerprint_move AFTER UPDATE OF audio_path ON historico
+        WHEN OLD.audio_path IS NOT NULL AND OLD.audio_path IS NOT NEW.audio_path
+        BEGIN
+            UPDATE OR IGNORE audio_fingerprints SET audio_path = NEW.audio_path WHERE audio_path = OLD.audio_path;
+            DELETE FROM audio_fingerprints WHERE audio_path = OLD.audio_path
+              AND NOT EXISTS (SELECT 1 FROM historico WHERE audio_path = OLD.audio_path);
+        END""")
+
+
+def _014_job_heartbeats(conn):
+    # Lease dos jobs a correr: só os sem heartbeat recente voltam para a fila (ver analysis_jobs.py)
+    _add_column(conn, "analysis_jobs", "heartbeat_at", "REAL")
+
+
+MIGRATIONS = [
+    (1, "esquema base", _001_base_schema),
+    (2, "índices compostos", _002_indexes),
+    (3, "índices dos filtros do histórico", _003_history_filter_indexes),
+    (4, "armazém de áudio", _004_audio_blobs),
+    (5, "cache de diagnósticos", _005_diagnosis_cache),
+    (6, "características espectrais", _006_audio_features),
+    (7, "fila de análises", _007_analysis_jobs),
+    (8, "resumos das conversas", _008_chat_summaries),
+    (9, "séries temporais das máquinas", _009_machine_metrics),
+    (10, "resumo do dashboard", _010_dashboard_summary),
+    (11, "pesquisa de texto", _011_search),
+    (12, "embeddings das análises", _012_embeddings),
+    (13, "assinaturas de áudio", _013_audio_fingerprints),
+    (14, "heartbeat dos jobs", _014_job_heartbeats),
+]
+
+
+# Migração -> (descrição, preenchimento com o código atual); só para as migrações
+# aplicadas nesta chamada ao migrate()
+BACKFILLS = {
+    9: ("análises copiadas para machine_metrics", machine_trends.backfill),
+    10: ("utilizadores com resumo do dashboard", dashboard_summary.rebuild),
+}
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn=None, target=None):
+    # target: última migração a aplicar (None = todas)
+    own_conn = conn is None
+    if own_conn:
+        conn = database.connect()
+    try:
+        version = current_version(conn)
+        applied = []
+        for number, description, apply in MIGRATIONS:
+            if number <= version or (target is not None and number > target):
+                continue
+            print(f"DB: a aplicar migração {number:03d} ({description})")
+            try:
+                conn.execute("BEGIN")
+                apply(conn)
+                # PRAGMA não aceita parâmetros; number vem da lista acima
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append(number)
+        if target is None:
+            for number in applied:
+                if number in BACKFILLS:
+                    description, backfill = BACKFILLS[number]
+                    with conn:
+                        print(f"DB: {backfill(conn)} {description}")
+        return current_version(conn)
+    finally:
+        if own_conn:
+            conn.close()
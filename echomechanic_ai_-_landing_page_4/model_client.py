@@ -0,0 +1,420 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import functools
+import threading
+
+import google.generativeai as genai
+from starlette.concurrency import run_in_threadpool
+
+import inference
+import model_scheduler
+
+# --- CLIENTE DO MODELO ---
+# O main.py configurava o Gemini e chamava genai.list_models() (pela rede) logo
+# no import: o servidor só arrancava depois disso e sem rede não havia forma de
+# correr a app nem os benchmarks. Aqui o modelo é um ModelClient (generate e
+# open_stream, assíncronos, chamados pelo inference, e audio_part, a forma como
+# o áudio segue no pedido) com um backend por trás:
+#   gemini -> escolha do modelo em background (warm) e guardada em disco com TTL,
+#             por isso um restart não volta a listar os modelos
+#   stub   -> respostas locais e determinísticas (fixtures gravadas ou respostas
+#             fixas), para testes e benchmarks offline; pode injetar 429s
+# ECHO_MODEL_BACKEND escolhe o backend; as métricas ficam em stats, por backend.
+# A chave do Gemini vem só do ambiente (GOOGLE_API_KEY, nunca no código): sem
+# ela a app arranca na mesma e o backend gemini falha no primeiro uso com um
+# MissingAPIKeyError explícito.
+# Quota, retries e fallback entre modelos: ver model_scheduler.py.
+
+MODEL_BACKEND = os.environ.get("ECHO_MODEL_BACKEND", "gemini")
+# Gere a chave no Google AI Studio e passe-a em GOOGLE_API_KEY
+GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
+SELECTION_CACHE_PATH = os.environ.get("ECHO_MODEL_SELECTION_CACHE", "model_selection.json")
+SELECTION_TTL_SECONDS = float(os.environ.get("ECHO_MODEL_SELECTION_TTL", str(24 * 3600)))
+FIXTURES_PATH = os.environ.get("ECHO_MODEL_FIXTURES", "model_fixtures.json")
+# Com ECHO_MODEL_RECORD=1 as respostas reais do Gemini são gravadas nas fixtures do stub
+RECORD_FIXTURES = os.environ.get("ECHO_MODEL_RECORD", "0") == "1"
+# Falhas simuladas do stub: fração de pedidos com 429 e modelos sempre esgotados
+STUB_ERROR_RATE = float(os.environ.get("ECHO_STUB_ERROR_RATE", "0"))
+STUB_EXHAUSTED = [m for m in os.environ.get("ECHO_STUB_EXHAUSTED", "").split(",") if m]
+
+DEFAULT_MODEL = "gemini-1.5-flash"
+
+# Lista de Prioridade (Quota Alta -> Quota Baixa/Preview)
+# A API retorna nomes como 'models/gemini-1.5-flash'
+PRIORITY_ORDER = [
+    'models/gemini-2.0-flash-lite', # High efficiency, lower cost/quota usage
+    'models/gemini-flash-lite-latest',
+    'models/gemini-1.5-flash',      # Stable, High Quota Tier
+    'models/gemini-1.5-flash-001',
+    'models/gemini-1.5-flash-002',
+    'models/gemini-1.5-flash-8b',
+    'models/gemini-2.0-flash-exp',  # Preview, Lower Quota
+    'models/gemini-2.0-flash',      # Sometimes alias for experimental
+]
+
+stats = {}
+
+_fixtures_lock = threading.Lock()
+
+
+class MissingAPIKeyError(RuntimeError):
+    pass
+
+
+def key_id(api_key):
+    # Identifica a chave (cache da escolha do modelo, quota partilhada) sem a guardar
+    return hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+
+
+def require_api_key(api_key=None):
+    api_key = api_key or GOOGLE_API_KEY
+    if not api_key:
+        raise MissingAPIKeyError("GOOGLE_API_KEY não definida: defina-a no ambiente ou use ECHO_MODEL_BACKEND=stub")
+    return api_key
+
+
+def _record(backend, started, error=None):
+    entry = stats.setdefault(backend, {"calls": 0, "errors": 0, "latency_ms_total": 0.0, "latency_ms_max": 0.0, "last_error": None})
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    entry["calls"] += 1
+    entry["latency_ms_total"] += elapsed_ms
+    entry["latency_ms_max"] = max(entry["latency_ms_max"], elapsed_ms)
+    if error is not None:
+        entry["errors"] += 1
+        entry["last_error"] = f"{type(error).__name__}: {error}"[:200]
+
+
+def snapshot():
+    result = {}
+    for backend, entry in stats.items():
+        result[backend] = dict(entry)
+        result[backend]["latency_ms_avg"] = round(entry["latency_ms_total"] / entry["calls"], 1) if entry["calls"] else None
+        result[backend]["latency_ms_total"] = round(entry["latency_ms_total"], 1)
+        result[backend]["latency_ms_max"] = round(entry["latency_ms_max"], 1)
+    return result
+
+
+def prompt_key(contents):
+    # Chave das fixtures: texto do prompt + conteúdo do áudio (ou nome do ficheiro na Files API)
+    h = hashlib.sha256()
+    for part in contents if isinstance(contents, (list, tuple)) else [contents]:
+        if isinstance(part, str):
+            h.update(part.encode("utf-8"))
+        elif isinstance(part, dict) and isinstance(part.get("data"), (bytes, bytearray)):
+            h.update(hashlib.sha256(part["data"]).digest())
+        elif isinstance(part, dict) and part.get("sha256"):
+            # Áudio passado só pelo hash (audio_upload, backend local): mesma chave que com os bytes
+            h.update(bytes.fromhex(part["sha256"]))
+        else:
+            h.update(str(getattr(part, "name", type(part).__name__)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _load_fixtures(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_fixture(path, key, text):
+    with _fixtures_lock:
+        fixtures = _load_fixtures(path)
+        fixtures[key] = text
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(fixtures, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+
+
+# --- SELEÇÃO ROBUSTA DE MODELO ---
+def _read_selection(api_key):
+    try:
+        with open(SELECTION_CACHE_PATH, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    # Outra chave pode ter acesso a outros modelos
+    if cached.get("key_id") != key_id(api_key) or time.time() - cached.get("selected_at", 0) > SELECTION_TTL_SECONDS:
+        return None
+    return cached if cached.get("model") else None
+
+
+def _write_selection(api_key, model_name, available):
+    data = {"model": model_name, "available": available, "selected_at": time.time(),
+            "key_id": key_id(api_key)}
+    try:
+        tmp_path = f"{SELECTION_CACHE_PATH}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp_path, SELECTION_CACHE_PATH)
+    except OSError as e:
+        print(f"ERRO: não foi possível guardar a escolha do modelo: {e}")
+
+
+def select_model(api_key):
+    cached = _read_selection(api_key)
+    if cached:
+        print(f"--> MODELO SELECIONADO (cache): {cached['model']}")
+        return cached["model"], cached.get("available", [])
+
+    print("\n--- A SELECIONAR MELHOR MODELO (QUOTA & ESTABILIDADE) ---")
+    available_models = []
+    try:
+        for m in genai.list_models():
+            if 'generateContent' in m.supported_generation_methods:
+                available_models.append(m.name)
+                print(f"Disponível: {m.name}")
+    except Exception as e:
+        print(f"Erro crítico ao listar modelos: {e}")
+        # Em caso de erro total, tentamos o mais provável às cegas (sem guardar: no
+        # próximo arranque volta a tentar listar)
+        print(f"--> Fallback de emergência para {DEFAULT_MODEL}")
+        return DEFAULT_MODEL, []
+
+    selected_name = DEFAULT_MODEL # Fallback default
+
+    found = False
+    for candidate in PRIORITY_ORDER:
+        if candidate in available_models:
+            selected_name = candidate
+            found = True
+            break
+
+    # Se nenhum da lista prioritária existir, tenta encontrar qualquer "flash"
+    if not found:
+        for m in available_models:
+            if 'flash' in m:
+                selected_name = m
+                break
+
+    print(f"--> MODELO SELECIONADO: {selected_name}")
+    print("----------------------------------------------------------\n")
+    if available_models:
+        _write_selection(api_key, selected_name, available_models)
+    return selected_name, available_models
+
+
+# --- BACKENDS ---
+class GeminiBackend:
+    name = "gemini"
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key or GOOGLE_API_KEY
+        self.key_id = key_id(self.api_key)
+        self.model_name = None
+        self.available = []
+        self._models = {}
+        self._lock = threading.Lock()
+        # Só configura o SDK (sem rede); a Files API do audio_upload também precisa disto.
+        # Sem chave não configura nada: resolve() e audio_part() dão o erro
+        if self.api_key:
+            genai.configure(api_key=self.api_key)
+
+    def ready(self):
+        return self.model_name is not None
+
+    def resolve(self):
+        # Primeira chamada escolhe o modelo (cache em disco ou list_models); as
+        # outras threads esperam pelo lock em vez de listarem também
+        if self.model_name is None:
+            require_api_key(self.api_key)
+            with self._lock:
+                if self.model_name is None:
+                    self.model_name, self.available = select_model(self.api_key)
+        return self
+
+    def chain(self):
+        # Modelo escolhido + os seguintes da lista de prioridade que a chave tem
+        self.resolve()
+        return [self.model_name] + [m for m in PRIORITY_ORDER if m in self.available and m != self.model_name]
+
+    def audio_part(self, stored):
+        # Inline ou Files API, conforme o tamanho (ver audio_upload)
+        import audio_upload
+        require_api_key(self.api_key)
+        return audio_upload.gemini_audio_part(stored)
+
+    def generate_content(self, model_name, *args, **kwargs):
+        model = self._models.get(model_name)
+        if model is None:
+            model = self._models.setdefault(model_name, genai.GenerativeModel(model_name))
+        return model.generate_content(*args, **kwargs)
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+STUB_DIAGNOSES = [
+    ("Desgaste de Rolamento", "Ruído periódico de alta frequência compatível com pista de rolamento danificada.", "80€ - 250€", "2h - 4h"),
+    ("Desalinhamento do Veio", "Componente forte a 2x a rotação, típico de acoplamento desalinhado.", "50€ - 150€", "1h - 3h"),
+    ("Funcionamento Normal", "Espetro estável, sem harmónicas nem impactos relevantes.", "0€", "0h"),
+]
+
+
+class StubBackend:
+    # Respostas determinísticas: a mesma entrada dá sempre a mesma saída.
+    # Primeiro procura nas fixtures (gravadas com ECHO_MODEL_RECORD=1), senão
+    # responde com um texto fixo conforme o tipo de pedido.
+    # error_rate/exhausted simulam a quota do Gemini (429) para testar o scheduler.
+    name = "stub"
+    key_id = "stub"
+
+    def __init__(self, fixtures_path=FIXTURES_PATH, models=("stub-lite", "stub-flash"),
+                 error_rate=STUB_ERROR_RATE, exhausted=STUB_EXHAUSTED, seed=0):
+        self.models = list(models)
+        self.model_name = self.models[0]
+        self.fixtures = _load_fixtures(fixtures_path) if fixtures_path else {}
+        self.error_rate = error_rate
+        self.exhausted = set(exhausted)
+        self.calls = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def ready(self):
+        return True
+
+    def resolve(self):
+        return self
+
+    def chain(self):
+        return list(self.models)
+
+    def audio_part(self, stored):
+        # Só o hash do áudio (chave das fixtures): o ficheiro nem é lido
+        import audio_upload
+        return audio_upload.hash_audio_part(stored)
+
+    def _default_text(self, contents, key):
+        if isinstance(contents, (list, tuple)):
+            # Análise de áudio (prompt + áudio): JSON no formato pedido em /api/analyze
+            diagnosis, description, cost, repair_time = STUB_DIAGNOSES[int(key[:8], 16) % len(STUB_DIAGNOSES)]
+            return json.dumps({
+                "diagnosis": diagnosis, "confidence": f"{70 + int(key[8:10], 16) % 25}%",
+                "description": description, "estimated_cost": cost, "repair_time": repair_time,
+                "steps": ["Desligar e bloquear a máquina", "Inspecionar o componente", "Voltar a gravar após a intervenção"],
+            }, ensure_ascii=False)
+        if "RESUMO ATUAL" in str(contents):
+            return "Resumo (modo local): conversa técnica sobre manutenção de uma máquina."
+        return "Olá! Sou a Samantha em modo local (sem ligação ao Gemini). Em que posso ajudar?"
+
+    def generate_content(self, model_name, contents, stream=False, **kwargs):
+        with self._lock:
+            self.calls[model_name] = self.calls.get(model_name, 0) + 1
+            fail = model_name in self.exhausted or self._random.random() < self.error_rate
+        if fail:
+            raise model_scheduler.QuotaExceededError(f"429 Resource has been exhausted ({model_name}, simulado)")
+        key = prompt_key(contents)
+        text = self.fixtures.get(key)
+        if text is None:
+            text = self._default_text(contents, key)
+        if stream:
+            return iter([StubResponse(word) for word in re.findall(r"\S+\s*", text)])
+        return StubResponse(text)
+
+
+BACKENDS = {"gemini": GeminiBackend, "stub": StubBackend}
+
+
+class ModelClient:
+    def __init__(self, backend, scheduler=None):
+        self.backend = backend
+        # O stub não tem quota, a não ser que o teste passe um scheduler com limites
+        if scheduler is None:
+            scheduler = model_scheduler.for_key(backend.key_id) if backend.name == "gemini" else model_scheduler.for_key(backend.key_id, 0, 0)
+        self.scheduler = scheduler
+
+    @property
+    def model_name(self):
+        return self.backend.model_name
+
+    def warm(self):
+        # Escolhe o modelo numa thread, para o arranque não ficar à espera da rede
+        def resolve():
+            try:
+                self.backend.resolve()
+            except Exception as e:
+                print(f"ERRO: inicialização do modelo ({self.backend.name}) falhou: {e}")
+        thread = threading.Thread(target=resolve, name="model-warm", daemon=True)
+        thread.start()
+        return thread
+
+    def audio_part(self, stored):
+        # async with model.audio_part(stored) as part: o backend decide o que o
+        # pedido leva (bytes inline, upload na Files API ou só o hash)
+        return self.backend.audio_part(stored)
+
+    async def _chain(self):
+        # A primeira escolha do modelo do Gemini pode ir à rede (list_models)
+        return self.backend.chain() if self.backend.ready() else await run_in_threadpool(self.backend.chain)
+
+    async def generate(self, contents, *args, timeout=None, priority=inference.PRIORITY_ANALYSIS, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.scheduler.call(
+                await self._chain(),
+                lambda model_name, remaining: inference.run_blocking(
+                    self.backend.generate_content, model_name, contents, *args, timeout=remaining, priority=priority, **kwargs),
+                priority, timeout)
+        except Exception as e:
+            _record(self.backend.name, started, e)
+            raise
+        _record(self.backend.name, started)
+        if RECORD_FIXTURES and self.backend.name != "stub":
+            try:
+                _save_fixture(FIXTURES_PATH, prompt_key(contents), response.text)
+            except ValueError:
+                pass
+        return response
+
+    async def open_stream(self, contents, *args, timeout=None, priority=inference.PRIORITY_CHAT, **kwargs):
+        # Stream aberto (com a vaga da pool ocupada, ver inference.open_stream);
+        # os 429 da abertura passam pelos retries e fallback do scheduler
+        started = time.perf_counter()
+        try:
+            response = await self.scheduler.call(
+                await self._chain(),
+                lambda model_name, remaining: inference.open_stream(
+                    functools.partial(self.backend.generate_content, model_name, contents, *args, stream=True, **kwargs),
+                    priority, remaining),
+                priority, timeout)
+        except Exception as e:
+            _record(self.backend.name, started, e)
+            raise
+        return self._timed_stream(contents, response, started)
+
+    def _timed_stream(self, contents, response, started):
+        # O tempo de um stream conta até ao último pedaço (ou até ao erro)
+        texts = []
+        try:
+            for chunk in response:
+                if RECORD_FIXTURES:
+                    try:
+                        texts.append(chunk.text)
+                    except ValueError:
+                        pass
+                yield chunk
+        except GeneratorExit:
+            # Stream fechado a meio por quem consome (ex: cliente desligou-se)
+            _record(self.backend.name, started)
+            raise
+        except Exception as e:
+            _record(self.backend.name, started, e)
+            raise
+        _record(self.backend.name, started)
+        if RECORD_FIXTURES and self.backend.name != "stub":
+            _save_fixture(FIXTURES_PATH, prompt_key(contents), "".join(texts))
+
+
+def create(backend=None):
+    backend = backend or MODEL_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"ECHO_MODEL_BACKEND desconhecido: {backend} (opções: {', '.join(BACKENDS)})")
+    return ModelClient(BACKENDS[backend]())
@@ -0,0 +1,194 @@
+import os
+import time
+import random
+import asyncio
+import threading
+
+import inference
+
+# --- QUOTA, RETRIES E FALLBACK DO MODELO ---
+# O Gemini responde 429 quando passamos a quota (por modelo e por chave) e 503
+# quando está sobrecarregado; até aqui isso virava logo erro para o utilizador
+# e a lista de prioridade dos modelos só era usada uma vez, no arranque.
+# Cada chamada do ModelClient passa agora por aqui:
+#   1. token bucket local por chave e por modelo: não enviamos pedidos que iam
+#      levar 429 de certeza; as tarefas de fundo deixam uma reserva para o chat
+#   2. 429/503 -> nova tentativa com backoff exponencial e jitter
+#   3. modelo esgotado (continua a dar 429) -> fica de parte MODEL_COOLDOWN_SECONDS
+#      e o pedido passa para o modelo seguinte da cadeia (PRIORITY_ORDER)
+# As esperas (quota e backoff) são assíncronas e acontecem antes de ocupar uma
+# vaga do inference.PriorityLimiter: uma tarefa de fundo à espera de quota não
+# prende uma thread nem passa à frente do chat. Cada tentativa só ocupa a vaga
+# durante o pedido em si, e todo o ciclo respeita o prazo de quem chama.
+
+MODEL_RPM = float(os.environ.get("ECHO_MODEL_RPM", "15"))
+KEY_RPM = float(os.environ.get("ECHO_KEY_RPM", "60"))
+# Fração dos buckets que as tarefas de fundo não podem gastar (fica para o chat)
+BACKGROUND_RESERVE = float(os.environ.get("ECHO_MODEL_BACKGROUND_RESERVE", "0.2"))
+MAX_RETRIES = int(os.environ.get("ECHO_MODEL_MAX_RETRIES", "3"))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 20.0
+# Quanto tempo um pedido aceita esperar por quota local antes de tentar outro modelo
+MAX_QUEUE_WAIT_SECONDS = 15.0
+# Tempo total de espera (quota + backoff) antes de desistir; abaixo do timeout da IA
+MAX_TOTAL_WAIT_SECONDS = 60.0
+MODEL_COOLDOWN_SECONDS = 60.0
+RETRY_STATUSES = (429, 503)
+
+stats = {"calls": 0, "retries": 0, "failovers": 0, "throttled": 0, "throttle_wait_ms": 0.0, "gave_up": 0, "cooldowns": 0}
+
+
+class QuotaExceededError(Exception):
+    code = 429
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, burst or per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, reserve=0.0):
+        # Segundos até haver um token (mais a reserva, para pedidos de fundo)
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        needed = min(self.capacity, 1 + reserve * self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+def status_code(error):
+    # google.api_core.exceptions (ResourceExhausted, ServiceUnavailable, ...) e o
+    # QuotaExceededError do stub têm o código HTTP em .code
+    code = getattr(error, "code", None)
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        return None
+
+
+class Scheduler:
+    def __init__(self, key_id, model_rpm=MODEL_RPM, key_rpm=KEY_RPM):
+        self.key_id = key_id
+        self.model_rpm = model_rpm
+        self.key_bucket = TokenBucket(key_rpm) if key_rpm > 0 else None
+        self.model_buckets = {}
+        self.cooldown_until = {}
+        self.strikes = {}
+        self._lock = threading.Lock()
+
+    def _take(self, model_name, reserve):
+        # Tira um token do bucket da chave e do modelo ao mesmo tempo; devolve
+        # 0 se conseguiu, senão os segundos até haver quota
+        with self._lock:
+            buckets = [self.key_bucket]
+            if self.model_rpm > 0:
+                buckets.append(self.model_buckets.setdefault(model_name, TokenBucket(self.model_rpm)))
+            buckets = [bucket for bucket in buckets if bucket is not None]
+            wait = max([bucket.wait_time(reserve) for bucket in buckets], default=0.0)
+            if wait == 0:
+                for bucket in buckets:
+                    bucket.take()
+            return wait
+
+    async def _acquire(self, model_name, reserve, timeout):
+        # False se não houver quota local dentro do timeout
+        give_up_at = time.monotonic() + timeout
+        while True:
+            wait = self._take(model_name, reserve)
+            if wait == 0:
+                return True
+            if time.monotonic() + wait > give_up_at:
+                return False
+            stats["throttle_wait_ms"] += wait * 1000
+            await asyncio.sleep(wait)
+
+    def _strike(self, model_name):
+        # 429 seguidos de um modelo, contados entre todos os pedidos (um sucesso
+        # volta a zero): com os pedidos em paralelo, o primeiro a ver o modelo
+        # esgotado poupa os outros de o tentarem MAX_RETRIES vezes cada um
+        with self._lock:
+            strikes = self.strikes[model_name] = self.strikes.get(model_name, 0) + 1
+            now = time.monotonic()
+            if strikes >= MAX_RETRIES + 1 and self.cooldown_until.get(model_name, 0) <= now:
+                self.cooldown_until[model_name] = now + MODEL_COOLDOWN_SECONDS
+                stats["cooldowns"] += 1
+
+    def _ordered(self, chain):
+        # Modelos em cooldown passam para o fim da cadeia (se todos estiverem, tenta na mesma)
+        now = time.monotonic()
+        return sorted(chain, key=lambda name: self.cooldown_until.get(name, 0) > now)
+
+    async def call(self, chain, attempt, priority=inference.PRIORITY_ANALYSIS, timeout=None):
+        # attempt(model_name, segundos que restam) faz o pedido a um modelo concreto
+        # (inference.run_blocking, que só aí ocupa uma vaga da pool)
+        stats["calls"] += 1
+        if timeout is None:
+            timeout = inference.MODEL_TIMEOUT_SECONDS
+        reserve = BACKGROUND_RESERVE if priority >= inference.PRIORITY_BACKGROUND else 0.0
+        started = time.monotonic()
+        # Prazo de quem chama (pedidos incluídos) e, dentro dele, o das esperas
+        give_up_at = started + timeout
+        deadline = started + min(MAX_TOTAL_WAIT_SECONDS, timeout)
+        last_error = None
+
+        previous = None
+        for model_name in self._ordered(chain):
+            if previous is not None:
+                stats["failovers"] += 1
+                print(f"DEBUG: {previous} sem quota, a passar para {model_name}")
+            previous = model_name
+            for attempt_number in range(MAX_RETRIES + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not await self._acquire(model_name, reserve, min(remaining, MAX_QUEUE_WAIT_SECONDS)):
+                    stats["throttled"] += 1
+                    break
+                try:
+                    result = await attempt(model_name, give_up_at - time.monotonic())
+                    self.strikes[model_name] = 0
+                    return result
+                except Exception as e:
+                    if status_code(e) not in RETRY_STATUSES:
+                        raise
+                    last_error = e
+                    if status_code(e) == 429:
+                        self._strike(model_name)
+                # Modelo dado como esgotado (por este ou por outro pedido): passa ao seguinte
+                if attempt_number == MAX_RETRIES or self.cooldown_until.get(model_name, 0) > time.monotonic():
+                    break
+                # Full jitter: espera aleatória entre 0 e o teto exponencial
+                delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt_number))
+                if time.monotonic() + delay > deadline:
+                    break
+                stats["retries"] += 1
+                await asyncio.sleep(delay)
+
+        stats["gave_up"] += 1
+        raise last_error or QuotaExceededError("Sem quota disponível em nenhum modelo")
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            "cooling_down": {name: round(until - now, 1) for name, until in self.cooldown_until.items() if until > now},
+            "model_tokens": {name: round(bucket.tokens, 1) for name, bucket in self.model_buckets.items()},
+            "key_tokens": round(self.key_bucket.tokens, 1) if self.key_bucket else None,
+        }
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def for_key(key_id, model_rpm=MODEL_RPM, key_rpm=KEY_RPM):
+    # Um Scheduler por chave no processo: o modelo de texto e os embeddings
+    # gastam a mesma quota da chave
+    with _schedulers_lock:
+        if key_id not in _schedulers:
+            _schedulers[key_id] = Scheduler(key_id, model_rpm, key_rpm)
+        return _schedulers[key_id]
@@ -0,0 +1,109 @@
+import os
+import gzip
+import hashlib
+
+from fastapi.responses import HTMLResponse, Response
+
+try:
+    import brotli
+except ImportError:  # opcional: sem ele servimos só gzip
+    brotli = None
+
+# --- CACHE DAS PÁGINAS HTML ---
+# Cada handler de página abria e lia o ficheiro HTML do disco a cada pedido e
+# devolvia-o sem compressão nem validadores. Aqui cada template é lido uma vez,
+# comprimido de antemão (gzip e brotli) e guardado em memória; é recarregado
+# quando o mtime/tamanho do ficheiro muda. As respostas levam ETag forte e
+# Cache-Control, e um If-None-Match com a mesma ETag recebe 304 sem corpo.
+
+# O HTML muda a cada deploy: o browser guarda-o mas revalida sempre (304 barato).
+# Os assets com hash no nome (assets/build) é que são imutáveis.
+PAGE_CACHE_CONTROL = os.environ.get("ECHO_PAGE_CACHE_CONTROL", "no-cache")
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+stats = {"hits": 0, "loads": 0, "not_modified": 0}
+
+_cache = {}
+
+
+class Page:
+    def __init__(self, path, stat, body):
+        self.path = path
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.digest = hashlib.sha256(body).hexdigest()[:20]
+        # Uma representação por codificação, cada uma com a sua ETag forte
+        self.variants = {"identity": body, "gzip": gzip.compress(body, GZIP_LEVEL)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+
+    def etag(self, encoding):
+        return f'"{self.digest}"' if encoding == "identity" else f'"{self.digest}-{encoding}"'
+
+
+def get(path):
+    # Um stat por pedido chega para apanhar ficheiros alterados no disco
+    stat = os.stat(path)
+    page = _cache.get(path)
+    if page is None or page.mtime_ns != stat.st_mtime_ns or page.size != stat.st_size:
+        with open(path, "rb") as f:
+            page = Page(path, stat, f.read())
+        _cache[path] = page
+        stats["loads"] += 1
+    else:
+        stats["hits"] += 1
+    return page
+
+
+def _choose_encoding(accept_encoding, available):
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    # brotli primeiro (mais pequeno), depois gzip
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return "identity"
+
+
+def _not_modified(if_none_match, page):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Qualquer representação da mesma versão conta (o conteúdo é o mesmo)
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return any(page.etag(encoding) in tags for encoding in page.variants)
+
+
+def serve(request, filename):
+    try:
+        page = get(filename)
+    except FileNotFoundError:
+        return HTMLResponse(f"Erro: {filename} nao encontrado")
+
+    encoding = _choose_encoding(request.headers.get("accept-encoding"), page.variants)
+    headers = {"ETag": page.etag(encoding), "Cache-Control": PAGE_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+
+    if _not_modified(request.headers.get("if-none-match"), page):
+        stats["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(page.variants[encoding], media_type="text/html; charset=utf-8", headers=headers)
+
+
+def preload(filenames):
+    for filename in filenames:
+        try:
+            get(filename)
+        except FileNotFoundError:
+            print(f"ERRO: página {filename} não encontrada")
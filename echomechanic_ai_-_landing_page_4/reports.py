@@ -0,0 +1,460 @@
+import os
+import re
+import json
+import zlib
+import asyncio
+import zipfile
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+from fpdf import FPDF
+from starlette.concurrency import run_in_threadpool
+
+import database
+
+# --- RELATÓRIOS PDF EM CACHE ---
+# O generate_pdf construía o documento FPDF de raiz a cada download e dentro do
+# event loop, apesar de uma linha do historico nunca mudar depois de gravada.
+# Agora cada relatório é renderizado uma vez (numa thread, fora do loop) e
+# guardado em disco com a chave id + TEMPLATE_VERSION; os downloads seguintes
+# são um FileResponse com ETag (e 304 se o browser já o tiver). Logo depois de
+# uma análise ser gravada o relatório é pré-gerado em background (prewarm).
+# Mudar o layout do relatório = mudar TEMPLATE_VERSION (os antigos deixam de ser usados).
+
+TEMPLATE_VERSION = "relatorio-v1"
+REPORT_DIR = os.environ.get("ECHO_REPORT_DIR", "report_cache")
+REPORT_COLUMNS = "id, maquina_nome, data_analise, diagnostico, confianca, detalhes_json"
+
+# Exportação em massa (ver a secção EXPORTAÇÃO EM MASSA). Por omissão em série
+# (1); o pool de processos só vale a pena com vários CPUs livres, ver bench_reports.py
+EXPORT_WORKERS = int(os.environ.get("ECHO_REPORT_WORKERS", "1"))
+EXPORT_CHUNK_ROWS = 25
+# Abaixo disto o arranque dos processos custa mais do que renderizar em série
+EXPORT_PARALLEL_MIN_ROWS = 200
+EXPORT_MAX_ROWS = int(os.environ.get("ECHO_REPORT_EXPORT_MAX", "5000"))
+# Fontes registadas sempre por esta ordem (F1, F2, F3) em todos os documentos,
+# para as páginas renderizadas em processos diferentes poderem ser juntadas
+PAGE_FONTS = (("B", "Helvetica-Bold"), ("", "Helvetica"), ("I", "Helvetica-Oblique"))
+A4_POINTS = (595.28, 841.89)
+
+stats = {"hits": 0, "renders": 0, "prewarmed": 0, "exports": 0, "exported_analyses": 0}
+
+_inflight = {}
+_tasks = set()
+_pool = None
+
+
+# --- HELPER PARA LIMPAR TEXTO (REMOVE EMOJIS) ---
+def clean_text(text):
+    if not text:
+        return ""
+    # Converte para string se não for
+    text = str(text)
+    # Truque: Codifica para latin-1 (o que o FPDF suporta) e ignora/substitui o que não consegue (emojis)
+    return text.encode('latin-1', 'replace').decode('latin-1')
+
+
+def add_report_page(pdf, row):
+    # Uma análise = uma página (ou mais, se o plano for longo)
+    pdf.add_page()
+
+    # Barra de Marca
+    pdf.set_fill_color(6, 182, 212) # Cyan da marca
+    pdf.rect(0, 0, 210, 15, 'F')
+
+    # Título
+    pdf.set_y(5)
+    pdf.set_font("Arial", "B", 16)
+    pdf.set_text_color(255, 255, 255) # Branco para o título sobre a barra
+    pdf.cell(0, 10, clean_text("Relatório Técnico - EchoMechanic AI"), ln=True, align="C")
+
+    pdf.set_text_color(0, 0, 0) # Reset para o resto do documento
+    pdf.ln(10)
+
+    # Dados da Máquina
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 10, clean_text("1. Identificação do Equipamento"), ln=True)
+    pdf.set_font("Arial", "", 11)
+    pdf.cell(0, 8, clean_text(f"Máquina: {row['maquina_nome']}"), ln=True)
+    pdf.cell(0, 8, clean_text(f"Data da Análise: {row['data_analise']}"), ln=True)
+    pdf.cell(0, 8, clean_text(f"ID do Registo: #{row['id']}"), ln=True)
+    pdf.ln(5)
+
+    # Diagnóstico
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 10, clean_text("2. Diagnóstico da IA"), ln=True)
+    pdf.set_font("Arial", "B", 11)
+    pdf.set_text_color(200, 0, 0) # Vermelho escuro
+    pdf.cell(0, 8, clean_text(f"Problema: {row['diagnostico']}"), ln=True)
+    pdf.set_text_color(0, 0, 0) # Reset cor
+    pdf.set_font("Arial", "", 11)
+    pdf.cell(0, 8, clean_text(f"Confiança: {row['confianca']}"), ln=True)
+    # Detalhes (Parse do JSON se existir)
+    try:
+        details = json.loads(row['detalhes_json'])
+        desc = details.get("description", "Sem descrição")
+        steps = details.get("steps", [])
+        cost = details.get("estimated_cost", "Não disponível")
+        repair_time = details.get("repair_time", "Não disponível")
+    except:
+        desc = "Detalhes não disponíveis"
+        steps = []
+        cost = "Não disponível"
+        repair_time = "Não disponível"
+
+    pdf.multi_cell(0, 8, clean_text(f"Descrição Técnica: {desc}"))
+    pdf.cell(0, 8, clean_text(f"Custo Estimado: {cost}"), ln=True)
+    pdf.cell(0, 8, clean_text(f"Tempo de Reparação: {repair_time}"), ln=True)
+    pdf.ln(5)
+
+    # Plano de Ação
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(0, 10, clean_text("3. Plano de Manutenção Recomendado"), ln=True)
+    pdf.set_font("Arial", "", 11)
+
+    for step in steps:
+        pdf.cell(10) # Indentação
+        # O clean_text aqui remove os emojis dos bullets se existirem
+        pdf.multi_cell(0, 8, clean_text(f"- {step}"))
+
+    # Rodapé
+    pdf.ln(20)
+    pdf.set_font("Arial", "I", 8)
+    pdf.cell(0, 10, clean_text("Documento gerado automaticamente por EchoMechanic AI"), align="C")
+
+
+def new_document():
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    for style, _ in PAGE_FONTS:
+        pdf.set_font("Arial", style)
+    return pdf
+
+
+def render_pdf(row):
+    pdf = new_document()
+    add_report_page(pdf, row)
+    # Importante: bytes deve ser retornado corretamente
+    return pdf.output(dest='S').encode('latin-1')
+
+
+def report_path(analysis_id):
+    return os.path.join(REPORT_DIR, TEMPLATE_VERSION, f"{analysis_id}.pdf")
+
+
+def etag(path):
+    st = os.stat(path)
+    return f'"{os.path.basename(path)[:-4]}-{TEMPLATE_VERSION}-{st.st_mtime_ns:x}"'
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+async def _render(analysis_id):
+    rows = await database.fetchall_dicts(f"SELECT {REPORT_COLUMNS} FROM historico WHERE id = ?", (analysis_id,))
+    if not rows:
+        return None
+    path = report_path(analysis_id)
+    data = await run_in_threadpool(render_pdf, rows[0])
+    await run_in_threadpool(_write, path, data)
+    stats["renders"] += 1
+    return path
+
+
+async def get(analysis_id):
+    # Caminho do PDF em disco (renderiza se ainda não existir); None se a análise não existir
+    path = report_path(analysis_id)
+    if os.path.exists(path):
+        stats["hits"] += 1
+        return path
+    # Dois pedidos ao mesmo relatório ao mesmo tempo esperam pela mesma renderização
+    task = _inflight.get(analysis_id)
+    if task is None:
+        task = asyncio.ensure_future(_render(analysis_id))
+        _inflight[analysis_id] = task
+        task.add_done_callback(lambda _: _inflight.pop(analysis_id, None))
+    return await asyncio.shield(task)
+
+
+def prewarm(analysis_ids):
+    # Chamado logo depois de gravar análises: o primeiro download já encontra o PDF feito
+    async def warm():
+        for analysis_id in analysis_ids:
+            try:
+                if await get(analysis_id):
+                    stats["prewarmed"] += 1
+            except Exception as e:
+                print(f"ERRO: pré-geração do relatório {analysis_id} falhou: {e}")
+
+    task = asyncio.get_running_loop().create_task(warm())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def remove(analysis_ids):
+    # Relatórios de análises apagadas (ex: delete_user) não ficam no disco
+    try:
+        versions = os.listdir(REPORT_DIR)
+    except FileNotFoundError:
+        return
+    for version in versions:
+        for analysis_id in analysis_ids:
+            try:
+                os.remove(os.path.join(REPORT_DIR, version, f"{analysis_id}.pdf"))
+            except FileNotFoundError:
+                pass
+
+
+# --- EXPORTAÇÃO EM MASSA ---
+# O relatório mensal de um gestor de manutenção cobre todas as máquinas, o que
+# eram centenas de pedidos ao /api/report/pdf. O /api/report/export junta as
+# análises de um utilizador (filtradas por datas e máquinas) num só PDF ou num
+# zip com um PDF por análise:
+#   - as linhas são lidas da BD em blocos de EXPORT_CHUNK_ROWS (keyset por id);
+#   - cada bloco é renderizado numa thread, em série, ou, com ECHO_REPORT_WORKERS
+#     > 1 e pelo menos EXPORT_PARALLEL_MIN_ROWS análises, num processo
+#     (ProcessPoolExecutor), vários em paralelo; cada bloco é escrito na resposta
+#     pela ordem original assim que fica pronto. Com 1 CPU o pool é mais lento
+#     do que a série (pickle dos blocos e das páginas entre processos);
+#   - cada bloco é um PDF normal do FPDF e as páginas são tiradas do próprio
+#     ficheiro (formato PDF, não o estado interno do FPDF); o PDF combinado é
+#     escrito objeto a objeto (páginas primeiro, fontes, árvore de páginas e
+#     xref no fim), por isso o servidor só tem em memória os blocos em curso e
+#     nunca o documento inteiro.
+
+
+_OBJECT = re.compile(rb"(\d+) 0 obj\n")
+_REF = rb"(\d+) 0 R"
+
+
+def _objects(document):
+    # {número: (dicionário, stream ou None)} de um PDF sem object streams (o do FPDF)
+    objects = {}
+    position = 0
+    while True:
+        match = _OBJECT.search(document, position)
+        if not match:
+            return objects
+        start = match.end()
+        end = document.index(b"endobj", start)
+        stream_at = document.find(b"stream\n", start, end)
+        if stream_at < 0:
+            objects[int(match.group(1))] = (document[start:end], None)
+            position = end
+            continue
+        header = document[start:stream_at]
+        length = int(re.search(rb"/Length (\d+)", header).group(1))
+        data_start = stream_at + len(b"stream\n")
+        objects[int(match.group(1))] = (header, document[data_start:data_start + length])
+        position = document.index(b"endobj", data_start + length)
+
+
+def split_pages(document):
+    # Conteúdo comprimido de cada página de um PDF do FPDF, pela ordem das páginas.
+    # As páginas usam /F1../F3 dos recursos: se o FPDF os mudar (ex: noutra versão)
+    # isto falha em vez de juntar páginas com as fontes trocadas
+    objects = _objects(document)
+    resources = next(header for header, _ in objects.values() if b"/Font <<" in header)
+    fonts = {int(index): objects[int(number)][0] for index, number in re.findall(rb"/F(\d+) " + _REF, resources)}
+    expected = {index: f"/BaseFont /{name}".encode() for index, (_, name) in enumerate(PAGE_FONTS, 1)}
+    if set(fonts) != set(expected) or any(expected[index] not in fonts[index] for index in expected):
+        raise ValueError("Fontes do PDF diferentes de PAGE_FONTS: não é possível juntar as páginas")
+    tree = next(header for header, _ in objects.values() if b"/Type /Pages" in header)
+    kids = re.search(rb"/Kids \[([^\]]*)\]", tree).group(1)
+    pages = []
+    for number in re.findall(_REF, kids):
+        contents = re.search(rb"/Contents " + _REF, objects[int(number)][0]).group(1)
+        header, stream = objects[int(contents)]
+        pages.append(stream if b"/FlateDecode" in header else zlib.compress(stream))
+    return pages
+
+
+def render_pages(rows):
+    # Corre numa thread ou num processo do pool: conteúdo (já comprimido) de cada página do bloco
+    pdf = new_document()
+    for row in rows:
+        add_report_page(pdf, row)
+    return split_pages(pdf.output(dest='S').encode('latin-1'))
+
+
+def render_documents(rows):
+    # Corre numa thread ou num processo do pool: um PDF completo por análise (para o zip)
+    return [render_pdf(row) for row in rows]
+
+
+def _process_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=EXPORT_WORKERS)
+    return _pool
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def export_filter(email, data_inicio=None, data_fim=None, maquinas=None):
+    # (where, params) com os mesmos filtros do /api/history
+    where = ["user_email=?"]
+    params = [email]
+    if maquinas:
+        where.append(f"maquina_nome IN ({', '.join('?' * len(maquinas))})")
+        params.extend(maquinas)
+    if data_inicio:
+        where.append("data_analise >= ?")
+        params.append(data_inicio)
+    if data_fim:
+        where.append("data_analise <= ?")
+        params.append(f"{data_fim} 23:59" if len(data_fim) == 10 else data_fim)
+    return " AND ".join(where), params
+
+
+async def export_count(export):
+    where, params = export
+    row = await database.fetchone(f"SELECT COUNT(*) FROM historico WHERE {where}", params)
+    return row[0]
+
+
+async def _export_rows(export):
+    # Blocos de linhas pela ordem das análises (keyset: nunca OFFSET)
+    where, params = export
+    last_id = 0
+    while True:
+        rows = await database.fetchall_dicts(
+            f"SELECT {REPORT_COLUMNS} FROM historico WHERE {where} AND id > ? ORDER BY id LIMIT ?",
+            (*params, last_id, EXPORT_CHUNK_ROWS))
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1]["id"]
+
+
+async def _rendered(export, render):
+    # (linhas, resultado de render(linhas)) por ordem
+    if EXPORT_WORKERS <= 1 or await export_count(export) < EXPORT_PARALLEL_MIN_ROWS:
+        async for rows in _export_rows(export):
+            yield rows, await run_in_threadpool(render, rows)
+        return
+    # Pool: até 2 blocos por processo em curso
+    loop = asyncio.get_running_loop()
+    pool = _process_pool()
+    pending = collections.deque()
+    try:
+        async for rows in _export_rows(export):
+            pending.append((rows, loop.run_in_executor(pool, render, rows)))
+            if len(pending) >= EXPORT_WORKERS * 2:
+                rows, future = pending.popleft()
+                yield rows, await future
+        while pending:
+            rows, future = pending.popleft()
+            yield rows, await future
+    finally:
+        # Cliente desligou-se a meio: os blocos que ainda não começaram não correm
+        for _, future in pending:
+            future.cancel()
+
+
+class _PdfWriter:
+    # Numeração dos objetos como no FPDF: 1 = árvore de páginas, 2 = recursos
+    # (ambos escritos no fim, quando já se sabe quantas páginas há)
+    def __init__(self):
+        self.position = 0
+        self.offsets = {}
+        self.count = 2
+
+    def new(self):
+        self.count += 1
+        return self.count
+
+    def write(self, data):
+        self.position += len(data)
+        return data
+
+    def obj(self, number, body, stream=None):
+        self.offsets[number] = self.position
+        data = f"{number} 0 obj\n{body}\n".encode("latin-1")
+        if stream is not None:
+            data += b"stream\n" + stream + b"\nendstream\n"
+        return self.write(data + b"endobj\n")
+
+
+async def stream_pdf(export):
+    # Gerador de bytes de um único PDF com uma (ou mais) páginas por análise
+    stats["exports"] += 1
+    pdf = _PdfWriter()
+    yield pdf.write(b"%PDF-1.3\n")
+    kids = []
+    async for rows, pages in _rendered(export, render_pages):
+        parts = []
+        for content in pages:
+            page, contents = pdf.new(), pdf.new()
+            kids.append(page)
+            parts.append(pdf.obj(page, f"<</Type /Page /Parent 1 0 R /Resources 2 0 R /Contents {contents} 0 R>>"))
+            parts.append(pdf.obj(contents, f"<</Filter /FlateDecode /Length {len(content)}>>", content))
+        stats["exported_analyses"] += len(rows)
+        yield b"".join(parts)
+
+    parts = []
+    fonts = []
+    for index, (_, name) in enumerate(PAGE_FONTS, 1):
+        number = pdf.new()
+        fonts.append(f"/F{index} {number} 0 R")
+        parts.append(pdf.obj(number, f"<</Type /Font /BaseFont /{name} /Subtype /Type1 /Encoding /WinAnsiEncoding>>"))
+    parts.append(pdf.obj(2, f"<</ProcSet [/PDF /Text /ImageB /ImageC /ImageI] /Font <<{' '.join(fonts)}>> >>"))
+    parts.append(pdf.obj(1, f"<</Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {len(kids)} "
+                            f"/MediaBox [0 0 {A4_POINTS[0]:.2f} {A4_POINTS[1]:.2f}]>>"))
+    info = pdf.new()
+    parts.append(pdf.obj(info, "<</Producer (EchoMechanic AI) /Title (Relatorio Tecnico - EchoMechanic AI)>>"))
+    catalog = pdf.new()
+    parts.append(pdf.obj(catalog, "<</Type /Catalog /Pages 1 0 R>>"))
+    xref = pdf.position
+    entries = "".join(f"{pdf.offsets[n]:010d} 00000 n \n" for n in range(1, pdf.count + 1))
+    parts.append(f"xref\n0 {pdf.count + 1}\n0000000000 65535 f \n{entries}"
+                 f"trailer\n<</Size {pdf.count + 1} /Root {catalog} 0 R /Info {info} 0 R>>\n"
+                 f"startxref\n{xref}\n%%EOF\n".encode("latin-1"))
+    yield b"".join(parts)
+
+
+class _ZipSink:
+    # Destino sem seek para o zipfile: guarda o que foi escrito até ao próximo drain()
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def zip_name(row):
+    machine = re.sub(r"[^\w\- ]+", "_", str(row["maquina_nome"] or "")).strip() or "maquina"
+    return f"{machine}/relatorio_analise_{row['id']}.pdf"
+
+
+async def stream_zip(export):
+    # Gerador de bytes de um zip com um PDF por análise, numa pasta por máquina
+    stats["exports"] += 1
+    sink = _ZipSink()
+    # Os PDFs do FPDF já vêm comprimidos: ZIP_STORED não perde nada e poupa CPU
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as archive:
+        async for rows, documents in _rendered(export, render_documents):
+            for row, data in zip(rows, documents):
+                archive.writestr(zip_name(row), data)
+            stats["exported_analyses"] += len(rows)
+            yield sink.drain()
+    yield sink.drain()
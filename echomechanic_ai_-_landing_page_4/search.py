@@ -0,0 +1,283 @@
+import re
+import html
+import math
+import functools
+import unicodedata
+
+import database
+
+# --- PESQUISA (FTS5) ---
+# Não havia pesquisa: para encontrar uma análise antiga era preciso percorrer o
+# /api/history, e o chat só via as 3 últimas análises. A migração 011 cria dois
+# índices FTS5, mantidos por triggers (qualquer INSERT/UPDATE/DELETE em
+# historico ou chat_messages, venha de onde vier, atualiza o índice):
+#   - historico_fts: máquina, diagnóstico, descrição e passos (do detalhes_json);
+#   - chat_fts: conteúdo das mensagens.
+# Os índices não guardam o id da linha tal e qual: o rowid é
+# (número do dono << 32) | id, com o número do dono atribuído na tabela
+# search_owners. Assim as entradas de cada utilizador ficam contíguas em todas
+# as listas de documentos, e a pesquisa (MATCH + rowid BETWEEN início e fim do
+# dono) salta diretamente para a parte do utilizador em vez de percorrer as
+# centenas de milhares de entradas de um termo comum como "rolamento".
+# Tokenizer unicode61 sem acentos: "vibracao" encontra "vibração". O último
+# termo (e qualquer termo acabado em *) é pesquisado por prefixo, para
+# pesquisar enquanto se escreve; "frases entre aspas" são pesquisadas juntas.
+# Ordenação: o bm25() do FTS5 calcula o IDF contando os documentos de cada termo
+# na tabela inteira (todas as contas), o que com um milhão de análises e termos
+# comuns custa centenas de ms por pesquisa. Por isso o bm25 é calculado aqui
+# sobre as CANDIDATES correspondências mais recentes do utilizador: frequências
+# de cada termo por coluna a partir do highlight() (pesos em HISTORICO_WEIGHTS /
+# CHAT_WEIGHTS) e IDF com as contagens só do utilizador, que o rowid por dono
+# torna baratas. Numa conta com milhares de análises a bater, as mais antigas
+# ficam de fora da ordenação, o que para um histórico de manutenção é o desejado.
+# Os excertos têm os termos marcados com <mark>.
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+MAX_TERMS = 8
+RELATED_ANALYSES = 3
+SNIPPET_TOKENS = 16
+OWNER_SHIFT = 32
+
+CANDIDATES = 250
+CONFIRM_PAGES = 4
+# Maior prefixo com índice (prefix = '2 3 4' nas tabelas)
+PREFIX_INDEX = 4
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Colunas do historico_fts de onde sai o excerto, por preferência: descricao, diagnostico, passos, maquina
+SNIPPET_COLUMNS = (2, 1, 3, 0)
+
+# Pesos do bm25 por coluna: maquina, diagnostico, descricao, passos / content
+HISTORICO_WEIGHTS = (2.0, 4.0, 1.0, 0.5)
+CHAT_WEIGHTS = (1.0,)
+HISTORICO_COLUMNS = "{maquina diagnostico descricao passos}"
+
+# Palavras que não ajudam a escolher análises para o contexto do chat
+STOPWORDS = {
+    "a", "o", "as", "os", "um", "uma", "de", "do", "da", "dos", "das", "em", "no", "na", "nos", "nas", "por", "para",
+    "com", "sem", "que", "qual", "quais", "e", "ou", "se", "ao", "à", "é", "foi", "ser", "está", "estão", "tem",
+    "como", "quando", "onde", "porque", "porquê", "isso", "isto", "este", "esta", "esse", "essa", "meu", "minha",
+    "há", "mais", "menos", "muito", "já", "não", "sim", "me", "te", "lhe", "eu", "tu", "ele", "ela", "olá", "bom",
+    "dia", "tarde", "noite", "obrigado", "obrigada", "pode", "podes", "posso", "devo", "fazer", "ver", "sobre",
+}
+
+_MARK_OPEN, _MARK_CLOSE = "\x02", "\x03"
+_MARKED = re.compile("\x02(.*?)\x03", re.S)
+_TERM = re.compile(r'"([^"]+)"|(\S+)')
+_WORD = re.compile(r"\w+")
+_ROW_ID = (1 << OWNER_SHIFT) - 1
+
+stats = {"searches": 0, "related": 0, "related_hits": 0}
+
+
+def owner_range(conn, email):
+    # (primeiro, último) rowid do utilizador nos índices; None se nunca escreveu nada
+    row = conn.execute("SELECT id FROM search_owners WHERE email=?", (email,)).fetchone()
+    if row is None:
+        return None
+    return row[0] << OWNER_SHIFT, (row[0] << OWNER_SHIFT) | _ROW_ID
+
+
+def _quote(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def parse_terms(text):
+    # [(texto, prefixo)] a partir do que o utilizador escreveu
+    terms = []
+    matches = list(_TERM.finditer(text or ""))
+    for position, match in enumerate(matches):
+        if match.group(1) is not None:
+            words = _WORD.findall(match.group(1))
+            if words:
+                terms.append((" ".join(words), False))
+            continue
+        raw = match.group(2)
+        prefix = raw.endswith("*") or position == len(matches) - 1
+        words = _WORD.findall(raw)
+        for index, word in enumerate(words):
+            terms.append((word, prefix and index == len(words) - 1))
+    return terms[:MAX_TERMS]
+
+
+def match_expression(terms, columns=None, any_term=False):
+    # Expressão MATCH do FTS5: colunas : (termos); None se não houver termos
+    if not terms:
+        return None
+    parts = [_quote(text) + ("*" if prefix else "") for text, prefix in terms]
+    body = f" {'OR' if any_term else 'AND'} ".join(parts)
+    return f"{columns} : ({body})" if columns else f"({body})"
+
+
+def fold(text):
+    # Minúsculas e sem acentos, como o tokenizer (remove_diacritics)
+    return "".join(c for c in unicodedata.normalize("NFKD", text.lower()) if not unicodedata.combining(c))
+
+
+@functools.lru_cache(maxsize=4096)
+def _marked_terms(marked, terms):
+    # Índices dos termos numa parte marcada pelo highlight() ("Rolamento",
+    # "desgaste severo"); as mesmas palavras repetem-se em quase todas as linhas
+    words = _WORD.findall(fold(marked))
+    found = []
+    position = 0
+    while position < len(words):
+        for index, (term_words, prefix) in enumerate(terms):
+            part = words[position:position + len(term_words)]
+            if len(part) == len(term_words) and part[:-1] == list(term_words[:-1]) and (
+                    part[-1].startswith(term_words[-1]) if prefix else part[-1] == term_words[-1]):
+                found.append(index)
+                position += len(term_words)
+                break
+        else:
+            position += 1
+    return tuple(found)
+
+
+def _ranked(conn, fts, table, columns, weights, email, terms, owner, limit, any_term=False):
+    # [(id, score, textos marcados por coluna)] das CANDIDATES correspondências mais
+    # recentes do utilizador, por bm25 calculado aqui (ver comentário no topo).
+    # Prefixos mais compridos que PREFIX_INDEX fariam o FTS5 juntar as listas de
+    # todas as contas: pesquisam-se pelas primeiras letras (índice de prefixos) e o
+    # resto confirma-se nas marcas do highlight(), página a página
+    indexed = [(text[:PREFIX_INDEX], True) if prefix and len(text) > PREFIX_INDEX else (text, prefix) for text, prefix in terms]
+    confirm = indexed != terms
+    expression = match_expression(indexed, columns, any_term)
+    folded = tuple((tuple(_WORD.findall(fold(text))), prefix) for text, prefix in terms)
+    marked = ", ".join(f"highlight({fts}, {column}, ?, ?)" for column in range(len(weights)))
+    candidates = []
+    scanned = 0
+    present = [0] * len(terms)
+    last = owner[1]
+    while True:
+        rows = conn.execute(f"""
+            SELECT rowid, {marked} FROM {fts} WHERE {fts} MATCH ? AND rowid BETWEEN ? AND ?
+            ORDER BY rowid DESC LIMIT ?
+        """, (*(_MARK_OPEN, _MARK_CLOSE) * len(weights), expression, owner[0], last, CANDIDATES)).fetchall()
+        for row in rows:
+            frequency = [0.0] * len(terms)
+            for weight, text in zip(weights, row[1:]):
+                if text and _MARK_OPEN in text:
+                    for fragment in _MARKED.findall(text):
+                        for index in _marked_terms(fragment, folded):
+                            frequency[index] += weight
+            for index, value in enumerate(frequency):
+                present[index] += value > 0
+            if any(frequency) if any_term else all(frequency):
+                candidates.append((row, frequency))
+        scanned += len(rows)
+        if not confirm or len(rows) < CANDIDATES or len(candidates) >= CANDIDATES or scanned >= CANDIDATES * CONFIRM_PAGES:
+            break
+        last = rows[-1][0] - 1
+    if not candidates:
+        return []
+
+    # IDF com as contagens do próprio utilizador (só a parte dele das listas); para
+    # um prefixo confirmado, a contagem do prefixo curto vezes a fração confirmada
+    total = conn.execute(f"SELECT count(*) FROM {table} WHERE user_email=?", (email,)).fetchone()[0]
+    idf = []
+    for index, (term, short) in enumerate(zip(terms, indexed)):
+        found = conn.execute(f"SELECT count(*) FROM {fts} WHERE {fts} MATCH ? AND rowid BETWEEN ? AND ?",
+                             (match_expression([short], columns), *owner)).fetchone()[0]
+        if term != short:
+            found = found * present[index] / scanned
+        idf.append(math.log(1 + (total - found + 0.5) / (found + 0.5)))
+
+    # Tamanho de cada linha em palavras (aproximado pelos espaços)
+    lengths = [sum(text.count(" ") + 1 for text in row[1:] if text) for row, _ in candidates]
+    average = sum(lengths) / len(lengths) or 1
+    scored = []
+    for (row, frequency), length in zip(candidates, lengths):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average)
+        score = sum(w * f * (BM25_K1 + 1) / (f + norm) for w, f in zip(idf, frequency))
+        scored.append((score, row[0], row[1:]))
+    scored.sort(key=lambda item: (-item[0], -item[1]))
+    results = []
+    for score, rowid, texts in scored[:limit]:
+        if confirm:
+            # Tira as marcas das palavras que só tinham o prefixo curto
+            texts = [_MARKED.sub(lambda m: m.group(0) if _marked_terms(m.group(1), folded) else m.group(1), text)
+                     if text else text for text in texts]
+        results.append((rowid & _ROW_ID, score, texts))
+    return results
+
+
+def _excerpt(text):
+    # SNIPPET_TOKENS palavras à volta da primeira marca, escapadas, com <mark>
+    words = (text or "").split()
+    first = next((i for i, word in enumerate(words) if _MARK_OPEN in word), 0)
+    start = max(0, min(first - SNIPPET_TOKENS // 4, len(words) - SNIPPET_TOKENS))
+    part = " ".join(words[start:start + SNIPPET_TOKENS])
+    if part.count(_MARK_OPEN) > part.count(_MARK_CLOSE):
+        part += _MARK_CLOSE
+    part = ("…" if start > 0 else "") + part + ("…" if start + SNIPPET_TOKENS < len(words) else "")
+    # Escapa o texto e só depois troca os marcadores por <mark> (seguro para innerHTML)
+    return html.escape(part).replace(_MARK_OPEN, "<mark>").replace(_MARK_CLOSE, "</mark>")
+
+
+def _by_id(conn, sql, ids):
+    return {row[0]: row for row in conn.execute(sql.format(ids=", ".join("?" * len(ids))), ids)} if ids else {}
+
+
+def _search_analyses(conn, email, terms, owner, limit):
+    ranked = _ranked(conn, "historico_fts", "historico", HISTORICO_COLUMNS, HISTORICO_WEIGHTS, email, terms, owner, limit)
+    rows = _by_id(conn, "SELECT id, maquina_nome, data_analise, diagnostico FROM historico WHERE id IN ({ids})",
+                  [item[0] for item in ranked])
+    results = []
+    for analysis_id, score, texts in ranked:
+        row = rows.get(analysis_id)
+        if row is None:
+            continue
+        # Excerto da primeira coluna de SNIPPET_COLUMNS com termos
+        excerpt = next((texts[column] for column in SNIPPET_COLUMNS if texts[column] and _MARK_OPEN in texts[column]), row[3])
+        results.append({"id": row[0], "maquina_nome": row[1], "data_analise": row[2], "diagnostico": row[3],
+                        "snippet": _excerpt(excerpt), "score": round(score, 3)})
+    return results
+
+
+def _search_chat(conn, email, terms, owner, limit):
+    ranked = _ranked(conn, "chat_fts", "chat_messages", None, CHAT_WEIGHTS, email, terms, owner, limit)
+    rows = _by_id(conn, "SELECT id, session_id, role, timestamp FROM chat_messages WHERE id IN ({ids})",
+                  [item[0] for item in ranked])
+    return [{"id": rows[message_id][0], "session_id": rows[message_id][1], "role": rows[message_id][2],
+             "timestamp": rows[message_id][3], "snippet": _excerpt(texts[0]), "score": round(score, 3)}
+            for message_id, score, texts in ranked if message_id in rows]
+
+
+def _search(conn, email, text, kinds, limit):
+    terms = parse_terms(text)
+    owner = owner_range(conn, email) if terms else None
+    results = {}
+    if "analises" in kinds:
+        results["analises"] = _search_analyses(conn, email, terms, owner, limit) if owner else []
+    if "chat" in kinds:
+        results["chat"] = _search_chat(conn, email, terms, owner, limit) if owner else []
+    return results
+
+
+async def search(email, text, kinds=("analises", "chat"), limit=SEARCH_DEFAULT_LIMIT):
+    stats["searches"] += 1
+    return await database.run(_search, email, text, kinds, max(1, min(limit, SEARCH_MAX_LIMIT)))
+
+
+def _related(conn, email, message, limit, exclude):
+    # Análises mais relevantes para a mensagem do chat (qualquer termo, por bm25)
+    terms = [(word, len(word) >= 5) for word in dict.fromkeys(w.lower() for w in _WORD.findall(message or ""))
+             if len(word) >= 3 and word not in STOPWORDS and not word.isdigit()][:MAX_TERMS]
+    owner = owner_range(conn, email) if terms else None
+    if not owner:
+        return []
+    ranked = _ranked(conn, "historico_fts", "historico", HISTORICO_COLUMNS, HISTORICO_WEIGHTS, email, terms, owner, limit + len(exclude), any_term=True)
+    rows = _by_id(conn, "SELECT id, maquina_nome, data_analise, diagnostico FROM historico WHERE id IN ({ids})",
+                  [item[0] for item in ranked])
+    return [tuple(rows[item[0]]) for item in ranked if item[0] in rows and item[0] not in exclude][:limit]
+
+
+async def related_analyses(email, message, limit=RELATED_ANALYSES, exclude=()):
+    # [(id, maquina_nome, data_analise, diagnostico)] por relevância
+    stats["related"] += 1
+    rows = await database.run(_related, email, message, limit, set(exclude))
+    if rows:
+        stats["related_hits"] += 1
+    return rows
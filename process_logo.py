@@ -10,6 +10,32 @@ except ImportError:
     subprocess.check_call([sys.executable, "-m", "pip", "install", "Pillow"])
     from PIL import Image, ImageDraw, ImageOps
 
+def circular_logo(img):
+    # Center square crop + circular mask (also used by build_assets.py)
+    img = img.convert("RGBA")
+    
+    # Determine the shortest dimension to create a square crop (perfect circle fits in square)
+    width, height = img.size
+    size = min(width, height)
+    
+    # Center crop to a square
+    left = (width - size) // 2
+    top = (height - size) // 2
+    right = left + size
+    bottom = top + size
+    
+    img = img.crop((left, top, right, bottom))
+    
+    # Create a circular mask (L mode - 8-bit pixels, black and white)
+    mask = Image.new("L", (size, size), 0)
+    draw = ImageDraw.Draw(mask)
+    draw.ellipse((0, 0, size, size), fill=255)
+    
+    # Apply the mask to the alpha channel of the image
+    result = ImageOps.fit(img, mask.size, centering=(0.5, 0.5))
+    result.putalpha(mask)
+    return result
+
 def process_logo():
     input_path = "Logotipo.jpg"
     # Update output path to be within the project structure
@@ -25,28 +51,7 @@ def process_logo():
         os.makedirs(output_dir)
 
     try:
-        img = Image.open(input_path).convert("RGBA")
-        
-        # Determine the shortest dimension to create a square crop (perfect circle fits in square)
-        width, height = img.size
-        size = min(width, height)
-        
-        # Center crop to a square
-        left = (width - size) // 2
-        top = (height - size) // 2
-        right = left + size
-        bottom = top + size
-        
-        img = img.crop((left, top, right, bottom))
-        
-        # Create a circular mask (L mode - 8-bit pixels, black and white)
-        mask = Image.new("L", (size, size), 0)
-        draw = ImageDraw.Draw(mask)
-        draw.ellipse((0, 0, size, size), fill=255)
-        
-        # Apply the mask to the alpha channel of the image
-        result = ImageOps.fit(img, mask.size, centering=(0.5, 0.5))
-        result.putalpha(mask)
+        result = circular_logo(Image.open(input_path))
         
         # Resize if necessary (optional, e.g., to 500x500 for optimization, but prompt said keep proportions)
         # keeping original high res is safer for quality, CSS will handle display size